@@ -1,19 +1,28 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file
+from flask import (Flask, render_template, request, jsonify, redirect, url_for, flash, send_file,
+                   Response, stream_with_context, session as browser_session)
 import os
 port = int(os.environ.get('PORT', 5000))
 import asyncio
+import concurrent.futures
 import time
 import json
-import zipfile
 import uuid
+import secrets
+import mimetypes
+from urllib.parse import quote
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
+import shutil
 import threading
+from collections import OrderedDict
 from datetime import datetime
 from core.generator import (
     EnhancedNoteToQuizGenerator,
     KnowledgePoint,
     Question,
+    KnowledgeBase,
+    QuestionSet,
+    ResultArchive,
     QuizFormatter,
     Config,  
     DocumentParser,
@@ -21,18 +30,230 @@ from core.generator import (
     KnowledgeExtractor,
     QuestionGenerator,
     KnowledgePointMerger,
+    ProgressReporter,
+    UsageStats,
     asdict
 )
+from core.session_store import SQLiteSessionStore, SessionWriter
+from core.jobs import BackgroundLoop, JobScheduler, QueueFullError
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# 每个进程同时处理的文档数与最多排队数，超出时返回503
+app.config['MAX_PROCESSING_JOBS'] = int(os.environ.get('MAX_PROCESSING_JOBS', 2))
+app.config['MAX_QUEUED_JOBS'] = int(os.environ.get('MAX_QUEUED_JOBS', 20))
+# 进度写入会话的最小间隔与单次SSE连接的最长时间（秒，超时后浏览器会自动重连）
+# SSE连接在推送期间占用一个worker：gunicorn默认的sync worker超时为30秒，单次连接必须
+# 明显短于它，否则worker会在推送途中被杀掉；改用 gthread/gevent worker 时可以适当调大
+app.config['PROGRESS_INTERVAL'] = 0.5
+app.config['SSE_MAX_DURATION'] = float(os.environ.get('SSE_MAX_DURATION', 20))
+# 按API Key共享的LLM客户端数量上限
+app.config['MAX_SHARED_CLIENTS'] = int(os.environ.get('MAX_SHARED_CLIENTS', 32))
+# 每个进程缓存的已解码会话结果数量上限
+app.config['MAX_CACHED_RESULTS'] = int(os.environ.get('MAX_CACHED_RESULTS', 64))
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('outputs', exist_ok=True)
 
-sessions = {}
+# 不写入会话数据库的配置项
+SECRET_CONFIG_KEYS = ('API_KEY',)
+# 浏览器Cookie中最多保留的API Key密钥流数量（每个会话一个）
+MAX_SEALED_KEYS = 8
+
+
+def config_to_dict(config: Config) -> dict:
+    """会话配置转为字典（包含实例上覆盖的字段，不包含API Key）"""
+    return {key: getattr(config, key) for key in Config.to_dict() if key not in SECRET_CONFIG_KEYS}
+
+
+def config_from_dict(data: dict, api_key: str = '') -> Config:
+    """从字典恢复会话配置（只设置实例属性，不影响Config类的默认值）
+
+    API Key 不随会话保存，由调用方传入（见 session_api_key）。
+    """
+    config = Config()
+    for key, value in data.items():
+        if hasattr(Config, key) and key not in SECRET_CONFIG_KEYS:
+            setattr(config, key, value)
+    config.API_KEY = api_key
+    return config
+
+
+def seal_api_key(session_id, api_key):
+    """拆分API Key，返回可以保存到会话中的密文
+
+    随机密钥流只保存在浏览器的签名Cookie中，服务端只保存与之异或后的密文，
+    单独任何一方都无法还原API Key。任何worker收到同一浏览器的请求时都能还原。
+    """
+    data = api_key.encode('utf-8')
+    pad = secrets.token_bytes(len(data))
+    pads = dict(browser_session.get('api_key_pads', {}))
+    pads.pop(session_id, None)
+    pads[session_id] = pad.hex()
+    browser_session['api_key_pads'] = dict(list(pads.items())[-MAX_SEALED_KEYS:])
+    return bytes(a ^ b for a, b in zip(data, pad)).hex()
+
+
+def session_api_key(session_id):
+    """用当前请求的Cookie还原会话的API Key，无法还原（如换了浏览器）时返回None"""
+    pad = browser_session.get('api_key_pads', {}).get(session_id)
+    sealed = sessions.get_field(session_id, 'sealed_api_key')
+    if pad is None or sealed is None:
+        return None
+    pad, sealed = bytes.fromhex(pad), bytes.fromhex(sealed)
+    if len(pad) != len(sealed):
+        return None
+    return bytes(a ^ b for a, b in zip(sealed, pad)).decode('utf-8', errors='replace')
+
+
+def cleanup_session_files(session_id, session_data):
+    """会话过期时删除上传文件和输出目录"""
+    file_path = session_data.get('file_path')
+    if file_path and os.path.exists(file_path):
+        os.remove(file_path)
+    output_dir = session_data.get('config', {}).get('OUTPUT_DIR')
+    if output_dir and os.path.isdir(output_dir):
+        shutil.rmtree(output_dir, ignore_errors=True)
+    with results_cache_lock:
+        results_cache.pop(session_id, None)
+
+
+# 会话保存在SQLite中，多个gunicorn worker共享
+sessions = SQLiteSessionStore(
+    os.environ.get('SESSION_DB_PATH', os.path.join('sessions', 'sessions.sqlite3')),
+    ttl=float(os.environ.get('SESSION_TTL', 24 * 3600)),
+    on_expire=cleanup_session_files
+)
+
+
+# 会话ID -> (结果版本, KnowledgeBase, QuestionSet)，按最近使用顺序淘汰
+results_cache = OrderedDict()
+results_cache_lock = threading.Lock()
+
+
+def new_results_version():
+    """知识点或题目将被重写时为会话分配新的结果版本，使各进程缓存的旧结果失效"""
+    return uuid.uuid4().hex
+
+
+def load_results(session_id):
+    """会话的知识点和题目（列式存储），按结果版本和题目数缓存在本进程中
+
+    返回的集合由多个请求共享，只能读取。
+    """
+    version = (sessions.get_field(session_id, 'results_version'),
+               sessions.count_items(session_id, 'questions'))
+    with results_cache_lock:
+        entry = results_cache.get(session_id)
+        if entry is not None and entry[0] == version:
+            results_cache.move_to_end(session_id)
+            return entry[1], entry[2]
+    
+    knowledge_base = KnowledgeBase(sessions.get_field(session_id, 'knowledge_points') or [])
+    question_set = QuestionSet(sessions.get_items(session_id, 'questions'))
+    with results_cache_lock:
+        results_cache[session_id] = (version, knowledge_base, question_set)
+        results_cache.move_to_end(session_id)
+        while len(results_cache) > app.config['MAX_CACHED_RESULTS']:
+            results_cache.popitem(last=False)
+    return knowledge_base, question_set
+
+
+def report_queue_positions(positions):
+    """把排队位置写入会话，供 /status 查询"""
+    for session_id, position in positions.items():
+        sessions.update(session_id, {'queue_position': position})
+
+
+jobs = JobScheduler(
+    max_workers=app.config['MAX_PROCESSING_JOBS'],
+    max_queue=app.config['MAX_QUEUED_JOBS'],
+    on_queue_change=report_queue_positions
+)
+
+# 所有LLM请求都在这个后台事件循环中执行
+background_loop = BackgroundLoop()
+
+# (API Key, API地址) -> [LLM客户端, 使用中的任务数]
+llm_clients = OrderedDict()
+llm_clients_lock = threading.Lock()
+# 已关闭的共享客户端累计的API用量
+retired_llm_usage = UsageStats()
+
+
+def acquire_llm_client(config):
+    """获取共享的LLM客户端，同一API Key的任务共用连接池和限流器"""
+    key = (config.API_KEY, config.API_BASE_URL)
+    with llm_clients_lock:
+        entry = llm_clients.pop(key, None)
+        if entry is None:
+            entry = [EnhancedNoteToQuizGenerator.build_llm_client(config), 0]
+        entry[1] += 1
+        llm_clients[key] = entry
+        return entry[0]
+
+
+def release_llm_client(config):
+    """归还LLM客户端；超过数量上限时关闭最久未使用的空闲客户端"""
+    key = (config.API_KEY, config.API_BASE_URL)
+    idle = []
+    with llm_clients_lock:
+        if key in llm_clients:
+            llm_clients[key][1] -= 1
+        excess = len(llm_clients) - app.config['MAX_SHARED_CLIENTS']
+        for candidate, (client, leases) in list(llm_clients.items()):
+            if excess <= 0:
+                break
+            if leases == 0:
+                del llm_clients[candidate]
+                idle.append(client)
+                excess -= 1
+    for client in idle:
+        retired_llm_usage.add(client.usage.snapshot())
+        background_loop.submit(client.aclose())
+
+
+def run_session_job(job, session_id, make_coroutine, api_key, writer):
+    """在后台事件循环中运行会话任务并等待结果
+
+    make_coroutine(generator) 返回要执行的协程；任务被取消（本进程的调度器或
+    其他worker设置的取消标记）时抛出 CancelledError。api_key 只保存在任务的内存中。
+    事件循环由所有任务共享，循环中的会话写入都交给 writer 在其线程中执行，
+    返回前等待这些写入完成。
+    """
+    config = config_from_dict(sessions.get_field(session_id, 'config'), api_key=api_key)
+    
+    async def run():
+        llm_client = acquire_llm_client(config)
+        usage_before = llm_client.usage.snapshot()
+        try:
+            async with EnhancedNoteToQuizGenerator(config, llm_client=llm_client) as generator:
+                generator.set_progress(ProgressReporter(
+                    lambda snapshot: writer.update({'progress': snapshot}),
+                    min_interval=app.config['PROGRESS_INTERVAL']
+                ))
+                task = asyncio.ensure_future(make_coroutine(generator))
+                watcher = asyncio.ensure_future(watch_cancellation(session_id, task))
+                try:
+                    return generator, await task
+                finally:
+                    watcher.cancel()
+                    await asyncio.gather(watcher, return_exceptions=True)
+        finally:
+            # 同一API Key的任务共用客户端，并发时用量中包含其他任务的请求
+            writer.update({'usage': llm_client.usage.since(usage_before)})
+            release_llm_client(config)
+
+    future = background_loop.submit(run())
+    job.add_cancel_callback(future.cancel)
+    try:
+        return future.result()
+    finally:
+        writer.close()
+
+
 def allowed_file(filename):
     """检查文件类型是否允许"""
     ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx', 'doc', 'md', 'markdown'}
@@ -86,17 +307,17 @@ def upload_file():
             config.OUTPUT_DIR = os.path.join('outputs', session_id)
             os.makedirs(config.OUTPUT_DIR, exist_ok=True)
             
-            sessions[session_id] = {
+            sessions.create(session_id, {
                 'file_path': file_path,
-                'config': config,
+                'config': config_to_dict(config),
+                'sealed_api_key': seal_api_key(session_id, config.API_KEY),
                 'status': 'uploaded',
                 'knowledge_points': None,
-                'questions': None,
                 'current_question': 0,
                 'user_answers': {},
                 'start_time': time.time(),
                 'enable_review': request.form.get('enableReview') == 'true'
-            }
+            })
             
             return jsonify({
                 'success': True,
@@ -115,85 +336,212 @@ def upload_file():
 @app.route('/process/<session_id>')
 def process_file(session_id):
     """开始处理文件"""
-    if session_id not in sessions:
+    if not sessions.exists(session_id):
         flash('会话不存在或已过期')
         return redirect(url_for('index'))
     
-    session_data = sessions[session_id]
+    api_key = session_api_key(session_id)
+    if api_key is None and sessions.get_field(session_id, 'status') in ('uploaded', 'error', 'cancelled'):
+        flash('API Key 已失效，请重新上传文档并输入API Key')
+        return redirect(url_for('index'))
     
-    if session_data['status'] in ['processing', 'completed']:
+    # 只有一个请求（可能来自不同worker）能把会话放入队列
+    if not sessions.compare_and_set(session_id, 'status', ['uploaded', 'error', 'cancelled'],
+                                    {'status': 'queued', 'cancel_requested': False, 'error': None}):
         return render_template('processing.html', session_id=session_id)
     
-    session_data['status'] = 'processing'
-    
-    thread = threading.Thread(target=process_document_async, args=(session_id,))
-    thread.daemon = True
-    thread.start()
+    try:
+        jobs.submit(session_id, lambda job: process_document_job(job, api_key))
+    except QueueFullError:
+        sessions.update(session_id, {'status': 'uploaded'})
+        response = jsonify({'error': '服务器繁忙，请稍后重试'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
     
     return render_template('processing.html', session_id=session_id)
 
-def process_document_async(session_id):
-    """异步处理文档"""
+@app.route('/cancel/<session_id>', methods=['POST'])
+def cancel_processing(session_id):
+    """取消排队中或处理中的任务"""
+    if not sessions.update(session_id, {'cancel_requested': True}):
+        return jsonify({'error': '会话不存在'}), 404
+    
+    # 仍在排队的任务直接标记为已取消；处理中的任务由其所在进程检测到标记后停止
+    sessions.compare_and_set(session_id, 'status', ['queued'], {'status': 'cancelled'})
+    jobs.cancel(session_id)
+    return jsonify({'success': True, 'status': sessions.get_field(session_id, 'status')})
+
+async def watch_cancellation(session_id, task, interval=1.0):
+    """轮询会话的取消标记（可能由其他worker设置），发现后取消处理任务"""
+    while not task.done():
+        await asyncio.sleep(interval)
+        # 读取可能等待数据库锁，放到线程中执行，不阻塞共享的事件循环
+        if await asyncio.to_thread(sessions.get_field, session_id, 'cancel_requested'):
+            task.cancel()
+            return
+
+def question_saver(writer):
+    """返回把题目逐道追加到会话的回调（追加顺序即答题顺序，之后不再改变）
+
+    回调在事件循环中调用，只把写入交给 writer，不等待数据库。
+    """
+    def save_question(question):
+        writer.append_items('questions', [asdict(question)])
+    return save_question
+
+def process_document_job(job, api_key):
+    """调度器中执行的文档处理任务"""
+    session_id = job.job_id
+    if job.cancelled or not sessions.compare_and_set(session_id, 'status', ['queued'],
+                                                     {'status': 'processing', 'queue_position': 0,
+                                                      'results_version': new_results_version()}):
+        return
+    writer = SessionWriter(sessions, session_id)
+    save_question = question_saver(writer)
+    
     try:
-        session_data = sessions[session_id]
-        session_data['status'] = 'processing'
+        session_data = sessions.get(session_id, ['file_path', 'config', 'start_time'])
         
         file_path = session_data['file_path']
         print(f"🔍 处理文件路径: {file_path}")
         print(f"🔍 文件是否存在: {os.path.exists(file_path)}")
         print(f"🔍 文件扩展名: {os.path.splitext(file_path)[1]}")
         
-        generator = EnhancedNoteToQuizGenerator(session_data['config'])
+        # 每道题生成后立即追加到会话，用户不必等全部生成完就能开始答题
+        sessions.clear_items(session_id, 'questions')
+        generator, (knowledge_points, questions) = run_session_job(
+            job, session_id, lambda generator: generator.process_document(file_path, on_question=save_question),
+            api_key, writer
+        )
+        
+        generator.save_archive(knowledge_points, questions, session_data['config']['OUTPUT_DIR'])
+        
+        sessions.update(session_id, {
+            'knowledge_points': [asdict(kp) for kp in knowledge_points],
+            'status': 'completed',
+            'processing_time': time.time() - session_data['start_time']
+        })
         
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+    except (asyncio.CancelledError, concurrent.futures.CancelledError):
+        print(f"⏹️ 已取消处理: {session_id}")
+        sessions.update(session_id, {'status': 'cancelled'})
+    except Exception as e:
+        sessions.update(session_id, {'status': 'error', 'error': str(e)})
+        import traceback
+        traceback.print_exc()
+    finally:
+        writer.close()
+
+def generate_questions_job(job, api_key):
+    """调度器中执行的出题任务（审核知识点之后）"""
+    session_id = job.job_id
+    if job.cancelled or not sessions.compare_and_set(session_id, 'status', ['queued'],
+                                                     {'status': 'processing', 'queue_position': 0,
+                                                      'results_version': new_results_version()}):
+        return
+    writer = SessionWriter(sessions, session_id)
+    save_question = question_saver(writer)
+    
+    try:
+        session_data = sessions.get(session_id, ['knowledge_points', 'config'])
+        kp_objects = [KnowledgePoint(**kp) for kp in session_data['knowledge_points']]
         
-        knowledge_points, questions = loop.run_until_complete(
-            generator.process_document(session_data['file_path'])
+        sessions.clear_items(session_id, 'questions')
+        generator, questions = run_session_job(
+            job, session_id,
+            lambda generator: generator.generator.generate_all(kp_objects, on_question=save_question),
+            api_key, writer
         )
         
-        generator.save_results(knowledge_points, questions, session_data['config'].OUTPUT_DIR)
+        generator.save_archive(kp_objects, questions, session_data['config']['OUTPUT_DIR'])
         
-        session_data['knowledge_points'] = [asdict(kp) for kp in knowledge_points]
-        session_data['questions'] = [asdict(q) for q in questions]
-        session_data['status'] = 'completed'
-        session_data['processing_time'] = time.time() - session_data['start_time']
+        sessions.update(session_id, {'status': 'completed'})
         
+    except (asyncio.CancelledError, concurrent.futures.CancelledError):
+        print(f"⏹️ 已取消出题: {session_id}")
+        sessions.update(session_id, {'status': 'cancelled'})
     except Exception as e:
-        sessions[session_id]['status'] = 'error'
-        sessions[session_id]['error'] = str(e)
+        sessions.update(session_id, {'status': 'error', 'error': str(e)})
         import traceback
         traceback.print_exc()
+    finally:
+        writer.close()
 
-@app.route('/status/<session_id>')
-def get_status(session_id):
-    """获取处理状态"""
-    if session_id not in sessions:
-        return jsonify({'error': '会话不存在'}), 404
+TERMINAL_STATUSES = ('completed', 'error', 'cancelled')
+
+def build_status(session_id):
+    """会话的处理状态与进度，会话不存在时返回None"""
+    session_data = sessions.get(session_id, ['status', 'processing_time', 'error', 'queue_position', 'progress'])
+    if session_data is None:
+        return None
     
-    session_data = sessions[session_id]
     response = {
         'status': session_data['status']
     }
     
     if session_data['status'] == 'completed':
         response.update({
-            'questions_count': len(session_data['questions']),
+            'questions_count': sessions.count_items(session_id, 'questions'),
             'processing_time': session_data.get('processing_time', 0)
         })
+    elif session_data['status'] == 'queued':
+        response['queue_position'] = session_data.get('queue_position')
+    elif session_data['status'] == 'processing':
+        response['progress'] = session_data.get('progress')
+        response['questions_available'] = sessions.count_items(session_id, 'questions')
     elif session_data['status'] == 'error':
         response['error'] = session_data.get('error', '未知错误')
     
+    return response
+
+@app.route('/status/<session_id>')
+def get_status(session_id):
+    """获取处理状态"""
+    response = build_status(session_id)
+    if response is None:
+        return jsonify({'error': '会话不存在'}), 404
     return jsonify(response)
 
+@app.route('/events/<session_id>')
+def stream_events(session_id):
+    """以Server-Sent Events推送处理状态与进度，状态结束时关闭连接"""
+    if not sessions.exists(session_id):
+        return jsonify({'error': '会话不存在'}), 404
+    
+    def events():
+        deadline = time.time() + app.config['SSE_MAX_DURATION']
+        last_payload = None
+        last_sent = time.time()
+        yield 'retry: 3000\n\n'
+        while time.time() < deadline:
+            status = build_status(session_id)
+            if status is None:
+                yield f"event: error\ndata: {json.dumps({'error': '会话不存在'}, ensure_ascii=False)}\n\n"
+                return
+            payload = json.dumps(status, ensure_ascii=False)
+            if payload != last_payload:
+                yield f"event: status\ndata: {payload}\n\n"
+                last_payload = payload
+                last_sent = time.time()
+            elif time.time() - last_sent > 15:
+                # 心跳，防止代理断开空闲连接
+                yield ': keep-alive\n\n'
+                last_sent = time.time()
+            if status['status'] in TERMINAL_STATUSES:
+                return
+            time.sleep(app.config['PROGRESS_INTERVAL'])
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/review/<session_id>', methods=['GET', 'POST'])
 def review_knowledge_points(session_id):
     """Knowledge point review page"""
-    if session_id not in sessions:
+    session_data = sessions.get(session_id, ['status', 'knowledge_points'])
+    if session_data is None:
         flash('Session not found or expired')
         return redirect(url_for('index'))
     
-    session_data = sessions[session_id]
     if session_data['status'] != 'completed':
         flash('Document processing not completed')
         return redirect(url_for('process_file', session_id=session_id))
@@ -214,7 +562,8 @@ def review_knowledge_points(session_id):
                 knowledge_type=kp_data.get('knowledge_type', '概念定义')
             )
             kp_list.append(kp)
-        session_data['knowledge_points'] = [asdict(kp) for kp in kp_list]
+        sessions.update(session_id, {'knowledge_points': [asdict(kp) for kp in kp_list],
+                                     'results_version': new_results_version()})
         return jsonify({'success': True, 'message': 'Knowledge points updated'})
     
     kp_list = [KnowledgePoint(**kp) for kp in session_data['knowledge_points']]
@@ -228,11 +577,15 @@ def generate_quiz():
     data = request.get_json()
     session_id = data.get('session_id')
     
-    if session_id not in sessions:
+    session_data = sessions.get(session_id, ['status'])
+    if session_data is None:
         return jsonify({'error': '会话不存在'}), 404
     
+    api_key = session_api_key(session_id)
+    if api_key is None:
+        return jsonify({'error': 'API Key 已失效，请重新上传文档并输入API Key'}), 403
+    
     try:
-        session_data = sessions[session_id]
         updated_kps = data.get('knowledge_points', [])
         
         kp_objects = []
@@ -249,22 +602,32 @@ def generate_quiz():
             )
             kp_objects.append(kp)
         
-        generator = EnhancedNoteToQuizGenerator(session_data['config'])
-        
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        questions = loop.run_until_complete(generator.generator.generate_all(kp_objects))
+        # 出题在后台任务中进行，这里只登记任务并立即返回
+        previous_status = session_data['status']
+        if not sessions.compare_and_set(session_id, 'status', ['completed', 'error', 'cancelled'], {
+            'status': 'queued',
+            'knowledge_points': [asdict(kp) for kp in kp_objects],
+            'reviewed': True,
+            'cancel_requested': False,
+            'error': None
+        }):
+            return jsonify({'error': '会话正在处理中'}), 409
         
-        session_data['knowledge_points'] = [asdict(kp) for kp in kp_objects]
-        session_data['questions'] = [asdict(q) for q in questions]
-        
-        generator.save_results(kp_objects, questions, session_data['config'].OUTPUT_DIR)
+        try:
+            # 审核后的出题优先于新上传的文档
+            jobs.submit(session_id, lambda job: generate_questions_job(job, api_key), priority=-1)
+        except QueueFullError:
+            sessions.update(session_id, {'status': previous_status})
+            response = jsonify({'error': '服务器繁忙，请稍后重试'})
+            response.headers['Retry-After'] = '30'
+            return response, 503
         
         return jsonify({
             'success': True,
             'session_id': session_id,
-            'questions_count': len(questions)
-        })
+            'status': 'queued',
+            'status_url': url_for('get_status', session_id=session_id)
+        }), 202
         
     except Exception as e:
         import traceback
@@ -274,46 +637,52 @@ def generate_quiz():
 @app.route('/quiz/<session_id>')
 def start_quiz(session_id):
     """开始做题"""
-    if session_id not in sessions:
+    session_data = sessions.get(session_id, ['status', 'enable_review', 'reviewed'])
+    if session_data is None:
         flash('会话不存在或已过期')
         return redirect(url_for('index'))
     
-    session_data = sessions[session_id]
-    if session_data['status'] != 'completed':
+    # 题目逐道生成，出题过程中也可以开始答题，页面会按需加载后续题目；
+    # 需要审核的会话在审核前处理中的是知识点提取，还没有题目
+    generating = not session_data.get('enable_review') or session_data.get('reviewed')
+    allowed = ('completed', 'processing') if generating else ('completed',)
+    if session_data['status'] not in allowed:
         flash('文档处理未完成')
         return redirect(url_for('process_file', session_id=session_id))
     
-    questions = []
-    for q_data in session_data['questions']:
-        q = Question(**q_data)
-        questions.append(q)
-    session_data['current_question'] = 0
-    session_data['user_answers'] = {}
-    session_data['quiz_start_time'] = time.time()
+    sessions.update(session_id, {
+        'current_question': 0,
+        'user_answers': {},
+        'quiz_start_time': time.time()
+    })
     
     return render_template('quiz.html', 
                          session_id=session_id,
-                         questions=questions,
                          current_question=0)
 
 @app.route('/submit_answer/<session_id>', methods=['POST'])
 def submit_answer(session_id):
     """Submit answer for a question"""
-    if session_id not in sessions:
+    session_data = sessions.get(session_id, ['status'])
+    if session_data is None:
         return jsonify({'error': 'Session not found'}), 404
     
-    session_data = sessions[session_id]
     data = request.get_json()
     question_id = int(data.get('question_id'))
     answer = data.get('answer') 
     
-    question = session_data['questions'][question_id]
+    found = sessions.get_items(session_id, 'questions', question_id, 1)
+    if not found:
+        return jsonify({'error': 'Question not found'}), 404
+    question = found[0]
     is_correct = answer == question['correct_answer']
     
-    session_data['user_answers'][str(question_id)] = answer
+    sessions.set_item(session_id, 'user_answers', str(question_id), answer)
     
-    if question_id < len(session_data['questions']) - 1:
-        session_data['current_question'] = question_id + 1
+    # 仍在生成时后面还会有新题目
+    more_coming = session_data['status'] not in TERMINAL_STATUSES
+    if more_coming or question_id < sessions.count_items(session_id, 'questions') - 1:
+        sessions.update(session_id, {'current_question': question_id + 1})
         is_last = False
     else:
         is_last = True
@@ -331,19 +700,18 @@ def submit_answer(session_id):
 @app.route('/results/<session_id>')
 def show_results(session_id):
     """显示答题结果"""
-    if session_id not in sessions:
+    session_data = sessions.get(session_id, ['user_answers', 'quiz_start_time'])
+    if session_data is None:
         flash('会话不存在或已过期')
         return redirect(url_for('index'))
     
-    session_data = sessions[session_id]
-    questions = session_data['questions']
+    _, questions = load_results(session_id)
     user_answers = session_data['user_answers']
     
     correct_count = 0
     results = []
     
-    for i, question_dict in enumerate(questions):
-        question = Question(**question_dict)
+    for i, question in enumerate(questions):
         user_answer = user_answers.get(str(i), '')
         is_correct = user_answer == question.correct_answer
         
@@ -374,64 +742,49 @@ def show_results(session_id):
 @app.route('/download/<session_id>/<format_type>')
 def download_results(session_id, format_type):
     """下载结果文件"""
-    if session_id not in sessions:
+    session_data = sessions.get(session_id, ['status', 'config', 'file_path'])
+    if session_data is None:
         return jsonify({'error': '会话不存在'}), 404
     
-    session_data = sessions[session_id]
     if session_data['status'] != 'completed':
         return jsonify({'error': '处理未完成'}), 400
     
+    if format_type not in ResultArchive.EXPORT_FORMATS:
+        return jsonify({'error': '不支持的格式'}), 400
+    
     try:
-        kp_list = [KnowledgePoint(**kp) for kp in session_data['knowledge_points']]
-        q_list = [Question(**q) for q in session_data['questions']]
-        
-        config = session_data['config']
+        config = config_from_dict(session_data['config'])
         base_name = os.path.splitext(os.path.basename(session_data['file_path']))[0]
-        output_dir = config.OUTPUT_DIR
-        os.makedirs(output_dir, exist_ok=True)
         
-        if format_type == 'json':
-            kp_data = [asdict(kp) for kp in kp_list]
-            q_data = [asdict(q) for q in q_list]
-            with open(f"{output_dir}/{base_name}_knowledge_points.json", 'w') as f:
-                json.dump(kp_data, f, indent=2)
-            with open(f"{output_dir}/{base_name}_questions.json", 'w') as f:
-                json.dump(q_data, f, indent=2)
-            
-            zip_path = f"{output_dir}/{base_name}.zip"
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                zipf.write(f"{output_dir}/{base_name}_knowledge_points.json", 
-                          f"{base_name}_knowledge_points.json")
-                zipf.write(f"{output_dir}/{base_name}_questions.json", 
-                          f"{base_name}_questions.json")
-            return send_file(zip_path, as_attachment=True)
-            
-        elif format_type == 'html':
-            html_content = QuizFormatter.to_html(q_list, kp_list)
-            file_path = f"{output_dir}/{base_name}.html"
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            return send_file(file_path, as_attachment=True)
-            
-        elif format_type == 'markdown':
-            md_content = QuizFormatter.to_markdown(q_list, kp_list)
-            file_path = f"{output_dir}/{base_name}.md"
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(md_content)
-            return send_file(file_path, as_attachment=True)
-            
-        else:
-            return jsonify({'error': '不支持的格式'}), 400
+        archive = ResultArchive(os.path.join(config.OUTPUT_DIR, ResultArchive.FILENAME))
+        if not archive.exists():
+            # 没有结果存档的旧会话由会话中保存的结果补写一次
+            knowledge_base, question_set = load_results(session_id)
+            archive = ResultArchive.write(archive.path, knowledge_base, question_set,
+                                          compression=config.RESULT_COMPRESSION)
+        
+        # 导出文件按 (会话, 格式, 内容摘要) 缓存：已生成时直接发送，否则边生成边发送并写入缓存
+        # send_file 会把相对路径解析到 app.root_path 下，这里按当前目录转为绝对路径
+        export_path = os.path.abspath(archive.export_path(format_type, base_name))
+        if os.path.exists(export_path):
+            return send_file(export_path, as_attachment=True)
+        
+        filename = os.path.basename(export_path)
+        return Response(
+            stream_with_context(archive.stream_export(format_type, base_name)),
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            headers={'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}"}
+        )
     
     except Exception as e:
         return jsonify({'error': f'下载失败: {str(e)}'}), 500
 
 @app.route('/api/knowledge_points/<session_id>')
 def get_knowledge_points(session_id):
-    if session_id not in sessions:
+    session_data = sessions.get(session_id, ['knowledge_points', 'status'])
+    if session_data is None:
         return jsonify({'error': '会话不存在'}), 404
     
-    session_data = sessions[session_id]
     return jsonify({
         'knowledge_points': session_data.get('knowledge_points', []),
         'status': session_data['status']
@@ -439,12 +792,23 @@ def get_knowledge_points(session_id):
 
 @app.route('/api/questions/<session_id>')
 def get_questions(session_id):
-    if session_id not in sessions:
+    """分页获取已生成的题目：cursor为起始位置，返回next_cursor供下次请求"""
+    session_data = sessions.get(session_id, ['status', 'current_question'])
+    if session_data is None:
         return jsonify({'error': '会话不存在'}), 404
     
-    session_data = sessions[session_id]
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    questions = sessions.get_items(session_id, 'questions', max(cursor, 0), limit)
+    next_cursor = max(cursor, 0) + len(questions)
+    available = sessions.count_items(session_id, 'questions')
+    
     return jsonify({
-        'questions': session_data.get('questions', []),
+        'questions': questions,
+        'next_cursor': next_cursor,
+        'available': available,
+        'complete': session_data['status'] in TERMINAL_STATUSES and next_cursor >= available,
+        'status': session_data['status'],
         'current_question': session_data.get('current_question', 0)
     })
 
@@ -464,13 +828,32 @@ def internal_server_error(e):
 @app.route('/api/session/<session_id>')
 def get_session_info(session_id):
     """获取会话信息（用于判断是否需要审核）"""
-    if session_id not in sessions:
+    session_data = sessions.get(session_id, ['status', 'enable_review', 'reviewed', 'usage'])
+    if session_data is None:
         return jsonify({'error': '会话不存在'}), 404
     
-    session_data = sessions[session_id]
     return jsonify({
         'status': session_data['status'],
-        'enable_review': session_data.get('enable_review', False)
+        'enable_review': session_data.get('enable_review', False),
+        'reviewed': session_data.get('reviewed', False),
+        'usage': session_data.get('usage')
+    })
+
+
+@app.route('/api/metrics')
+def get_metrics():
+    """本进程的任务队列状态和API用量（含提示词前缀缓存命中率）"""
+    usage = UsageStats()
+    usage.add(retired_llm_usage.snapshot())
+    with llm_clients_lock:
+        clients = [client for client, _ in llm_clients.values()]
+    for client in clients:
+        usage.add(client.usage.snapshot())
+    
+    return jsonify({
+        'jobs': jobs.stats(),
+        'shared_clients': len(clients),
+        'llm_usage': usage.snapshot()
     })
 
 
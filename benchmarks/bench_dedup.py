@@ -0,0 +1,109 @@
+"""标题去重基准测试：逐一比较（SequenceMatcher） vs MinHash-LSH
+
+用法:
+    python benchmarks/bench_dedup.py                 # 1k / 10k / 50k
+    python benchmarks/bench_dedup.py --sizes 1000 5000 --quality 中等
+    python benchmarks/bench_dedup.py --full          # 逐一比较也完整运行（很慢）
+
+逐一比较的耗时在规模较大时按已完成前缀的耗时外推（耗时随规模平方增长），
+结果中以 "~" 标注；完整运行的规模会同时校验两种实现的去重结果是否一致。
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from difflib import SequenceMatcher
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.generator import KnowledgePoint, KnowledgePointMerger  # noqa: E402
+
+# 常用汉字表（教材标题中的高频字）
+VOCAB = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经"
+    "十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相"
+    "全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果"
+    "料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则"
+    "任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带"
+    "安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装"
+    "影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选"
+    "标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严龙飞"
+)
+
+
+def make_titles(n: int, seed: int = 0) -> list:
+    """生成带近似重复的标题：约40%是已有标题的轻微改写"""
+    rng = random.Random(seed)
+    titles = []
+    for _ in range(n):
+        if titles and rng.random() < 0.4:
+            chars = list(rng.choice(titles))
+            for _ in range(rng.randint(1, 2)):
+                op = rng.random()
+                pos = rng.randrange(len(chars))
+                if op < 0.5:
+                    chars[pos] = rng.choice(VOCAB)
+                elif op < 0.75:
+                    chars.insert(pos, rng.choice(VOCAB))
+                elif len(chars) > 3:
+                    del chars[pos]
+            titles.append(''.join(chars))
+        else:
+            titles.append(''.join(rng.choice(VOCAB) for _ in range(rng.randint(4, 15))))
+    return titles
+
+
+def legacy_dedup(titles: list, threshold: float, time_budget: float = None):
+    """原实现：与每个已保留的标题逐一比较。返回 (保留的标题, 已处理数量, 耗时)"""
+    start = time.perf_counter()
+    unique = []
+    for processed, title in enumerate(titles):
+        if time_budget is not None and time.perf_counter() - start > time_budget:
+            return unique, processed, time.perf_counter() - start
+        if not any(SequenceMatcher(None, title, kept).ratio() > threshold for kept in unique):
+            unique.append(title)
+    return unique, len(titles), time.perf_counter() - start
+
+
+def lsh_dedup(titles: list, quality: str):
+    merger = KnowledgePointMerger(quality)
+    kps = [KnowledgePoint(id=i, title=t, summary="") for i, t in enumerate(titles)]
+    start = time.perf_counter()
+    unique = merger._deduplicate_by_title(kps)
+    return [kp.title for kp in unique], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--quality", default="中等")
+    parser.add_argument("--full", action="store_true", help="逐一比较完整运行，不外推")
+    parser.add_argument("--budget", type=float, default=20.0, help="逐一比较的单次时间预算（秒）")
+    args = parser.parse_args()
+
+    threshold = KnowledgePointMerger(args.quality).title_threshold
+    print(f"质量档位: {args.quality}  标题阈值: {threshold}")
+    print(f"{'标题数':>8} {'逐一比较(s)':>14} {'LSH(s)':>10} {'加速比':>10} {'保留数':>8} {'结果一致':>8}")
+
+    for n in args.sizes:
+        titles = make_titles(n)
+        lsh_unique, lsh_time = lsh_dedup(titles, args.quality)
+
+        budget = None if args.full else args.budget
+        legacy_unique, processed, legacy_time = legacy_dedup(titles, threshold, budget)
+        if processed == n:
+            legacy_label = f"{legacy_time:.2f}"
+            agreement = f"{len(set(legacy_unique) & set(lsh_unique)) / max(len(set(legacy_unique)), 1):.2%}"
+        else:
+            legacy_time *= (n / processed) ** 2
+            legacy_label = f"~{legacy_time:.0f}"
+            agreement = "-"
+
+        print(f"{n:>8} {legacy_label:>14} {lsh_time:>10.2f} {legacy_time / lsh_time:>9.0f}x "
+              f"{len(lsh_unique):>8} {agreement:>8}")
+
+
+if __name__ == "__main__":
+    main()
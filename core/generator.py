@@ -1,22 +1,37 @@
 import os
+import sys
 import json
 import asyncio
 import aiohttp
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator, Callable, Iterable, Iterator, Union
 import PyPDF2
 import docx
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, fields, replace
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import re
 from tqdm import tqdm
-import nest_asyncio
 import time
-
-nest_asyncio.apply()
-
-@dataclass
+import random
+import hashlib
+import sqlite3
+import threading
+import math
+import zlib
+import functools
+import importlib
+import multiprocessing
+import struct
+import gzip
+import zipfile
+import io
+import shutil
+import unicodedata
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+
+@dataclass(slots=True)
 class KnowledgePoint:
     """知识点数据结构"""
     id: int
@@ -34,7 +49,7 @@ class KnowledgePoint:
         if self.key_terms is None:
             self.key_terms = []
 
-@dataclass
+@dataclass(slots=True)
 class Question:
     """题目数据结构"""
     id: int
@@ -51,22 +66,330 @@ class Question:
         if self.related_knowledge_points is None:
             self.related_knowledge_points = [self.knowledge_point_id]
 
+
+class RecordView:
+    """列式集合中一条记录的只读视图，属性与对应的数据类相同，不复制数据"""
+
+    __slots__ = ("_columns", "_index")
+
+    def __init__(self, columns: Dict[str, list], index: int):
+        self._columns = columns
+        self._index = index
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: _unpack_value(column[self._index]) for name, column in self._columns.items()}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def _column_property(name: str) -> property:
+    return property(lambda view: view._columns[name][view._index], doc=f"{name} 列的值")
+
+
+def _unpack_value(value: Any) -> Any:
+    """列中保存的值转回数据类字段的类型（元组转为列表，字典复制一份）"""
+    if isinstance(value, tuple):
+        return list(value)
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+class ColumnarRecords:
+    """按列保存数据类记录的集合
+
+    每个字段一列，取值种类很少的字符串字段（interned）经 sys.intern 共享同一对象，
+    列表字段保存为元组，字典的键也被驻留。按下标或迭代得到的是 RecordView 视图，
+    只在需要时（to_records / to_dicts）才还原成数据类或字典。
+    """
+
+    record_type: type = None
+    view_type: type = RecordView
+    interned: Tuple[str, ...] = ()
+
+    __slots__ = ("_columns",)
+
+    def __init__(self, records: Iterable[Any] = ()):
+        self._columns: Dict[str, list] = {field.name: [] for field in fields(self.record_type)}
+        self.extend(records)
+
+    def _pack(self, name: str, value: Any) -> Any:
+        if isinstance(value, str):
+            return sys.intern(value) if name in self.interned else value
+        if isinstance(value, list):
+            return tuple(value)
+        if isinstance(value, dict):
+            return {sys.intern(key) if isinstance(key, str) else key: item for key, item in value.items()}
+        return value
+
+    def append(self, record: Any):
+        """追加一条记录（数据类对象或字段字典；缺少字段的字典按数据类的默认值补全）"""
+        if isinstance(record, dict):
+            if len(record) != len(self._columns) or not all(name in record for name in self._columns):
+                record = self.record_type(**record)
+            else:
+                for name, column in self._columns.items():
+                    column.append(self._pack(name, record[name]))
+                return
+        for name, column in self._columns.items():
+            column.append(self._pack(name, getattr(record, name)))
+
+    def extend(self, records: Iterable[Any]):
+        for record in records:
+            self.append(record)
+
+    def column(self, name: str) -> list:
+        """整列数据（只读，不要修改返回的列表）"""
+        return self._columns[name]
+
+    def __len__(self) -> int:
+        return len(self._columns["id"])
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self.view_type(self._columns, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.view_type(self._columns, index)
+
+    def __iter__(self) -> Iterator[RecordView]:
+        for i in range(len(self)):
+            yield self.view_type(self._columns, i)
+
+    @classmethod
+    def from_rows(cls, names: List[str], rows: Iterable[list]) -> "ColumnarRecords":
+        """从按行保存的字段值构造（names 为各列的字段名，见 rows()）"""
+        records = cls()
+        names = list(names)
+        if names != list(records._columns):
+            records.extend(dict(zip(names, row)) for row in rows)
+            return records
+        columns = list(records._columns.items())
+        for row in rows:
+            for (name, column), value in zip(columns, row):
+                column.append(records._pack(name, value))
+        return records
+
+    def field_names(self) -> List[str]:
+        return list(self._columns)
+
+    def rows(self) -> Iterator[tuple]:
+        """按行产出各字段的值（顺序同 field_names()），列表字段为元组"""
+        return zip(*self._columns.values())
+
+    def to_records(self) -> list:
+        return [self.record_type(**view.to_dict()) for view in self]
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [view.to_dict() for view in self]
+
+
+class KnowledgePointView(RecordView):
+    """KnowledgeBase 中一个知识点的只读视图"""
+    __slots__ = ()
+
+
+class QuestionView(RecordView):
+    """QuestionSet 中一道题的只读视图"""
+    __slots__ = ()
+
+
+for _record_type, _view_type in ((KnowledgePoint, KnowledgePointView), (Question, QuestionView)):
+    for _field in fields(_record_type):
+        setattr(_view_type, _field.name, _column_property(_field.name))
+
+
+class KnowledgeBase(ColumnarRecords):
+    """列式保存的知识点集合"""
+
+    record_type = KnowledgePoint
+    view_type = KnowledgePointView
+    interned = ("difficulty_level", "knowledge_type")
+    __slots__ = ("_positions",)
+
+    def __init__(self, records: Iterable[Any] = ()):
+        self._positions: Optional[Dict[int, int]] = None
+        super().__init__(records)
+
+    def append(self, record: Any):
+        super().append(record)
+        self._positions = None
+
+    def get(self, kp_id: int) -> Optional[KnowledgePointView]:
+        """按知识点编号查找"""
+        if self._positions is None:
+            self._positions = {kp_id: i for i, kp_id in enumerate(self._columns["id"])}
+        index = self._positions.get(kp_id)
+        return self.view_type(self._columns, index) if index is not None else None
+
+
+class QuestionSet(ColumnarRecords):
+    """列式保存的题目集合"""
+
+    record_type = Question
+    view_type = QuestionView
+    interned = ("difficulty", "question_type", "correct_answer")
+    __slots__ = ()
+
+def _extract_pdf_page_range(file_path: str, start: int, stop: int) -> List[str]:
+    """提取PDF第 [start, stop) 页的文本（在进程池中执行，需为模块级函数）"""
+    texts = []
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page_num in range(start, stop):
+            try:
+                texts.append(pdf_reader.pages[page_num].extract_text() or "")
+            except Exception as e:
+                print(f"PDF第 {page_num + 1} 页解析错误: {e}")
+                texts.append("")
+    return texts
+
+
+def _chunk_document(file_path: str, quality_level: str, by_tokens: bool = False,
+                    tokenizer_path: Optional[str] = None) -> List[Tuple[str, Dict[str, Any]]]:
+    """解析并分块整个文档（在进程池中执行，参数和返回值都是可pickle的基本类型）"""
+    chunker = TextChunker(quality_level, token_counter=TokenCounter(tokenizer_path), by_tokens=by_tokens)
+    return list(chunker.chunk_stream(DocumentParser.iter_document(file_path, pdf_workers=1)))
+
+
+def _merge_knowledge_point_dicts(quality_level: str, kp_dicts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """批量合并知识点（在进程池中执行，知识点以字典传递）"""
+    merger = KnowledgePointMerger(quality_level)
+    merged = merger.merge_knowledge_points([KnowledgePoint(**data) for data in kp_dicts])
+    return [asdict(kp) for kp in merged]
+
+
+_process_merger: Optional["KnowledgePointMerger"] = None
+
+
+def _merger_process_init(quality_level: str):
+    global _process_merger
+    _process_merger = KnowledgePointMerger(quality_level)
+
+
+def _merger_process_add(kp_data: Dict[str, Any], source: Optional[str]) -> Optional[Dict[str, Any]]:
+    accepted = _process_merger.add(KnowledgePoint(**kp_data), source=source)
+    return asdict(accepted) if accepted is not None else None
+
+
+def _merger_process_finalize() -> Tuple[List[Dict[str, Any]], List[List[str]], List[List[Dict[str, Any]]]]:
+    knowledge_points = _process_merger.finalize()
+    return ([asdict(kp) for kp in knowledge_points],
+            [_process_merger.sources(kp.id) for kp in knowledge_points],
+            [[asdict(duplicate) for duplicate in _process_merger.duplicates(kp.id)] for kp in knowledge_points])
+
+
+def _process_context():
+    """子进程的启动方式
+
+    Web进程中有工作线程和后台事件循环线程，fork 会把其他线程持有的锁原样复制进子进程，
+    因此优先使用 forkserver（服务进程预先导入本模块，之后启动子进程很快），否则使用 spawn。
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        if __name__ != "__main__":
+            context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def resolve_cpu_workers(workers: Optional[int]) -> int:
+    """CPU进程数：None表示按CPU核数选择（最多4个）"""
+    return min(4, os.cpu_count() or 1) if workers is None else workers
+
+
+_cpu_executors: Dict[int, ProcessPoolExecutor] = {}
+_cpu_executors_pid: Optional[int] = None
+_cpu_executors_lock = threading.Lock()
+
+
+def get_cpu_executor(workers: Optional[int] = None) -> Optional[ProcessPoolExecutor]:
+    """进程内共享的CPU任务进程池（解析文档、提取PDF页、批量合并知识点）
+
+    进程数不超过1时返回None，由调用方在当前进程中执行。进程池按pid创建，
+    兼容gunicorn的fork模式。
+    """
+    global _cpu_executors_pid
+    workers = resolve_cpu_workers(workers)
+    if workers <= 1:
+        return None
+    with _cpu_executors_lock:
+        if _cpu_executors_pid != os.getpid():
+            _cpu_executors.clear()
+            _cpu_executors_pid = os.getpid()
+        executor = _cpu_executors.get(workers)
+        # 子进程异常退出后进程池不再可用，重新创建
+        if executor is None or getattr(executor, "_broken", False):
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=_process_context())
+            _cpu_executors[workers] = executor
+        return executor
+
+
 class DocumentParser:
     """文档解析器，支持PDF和Word"""
 
+    # 每个进程池任务处理的页数；页数不足两个任务时直接在当前进程解析
+    PDF_PAGES_PER_TASK = 32
+
     @staticmethod
-    def extract_text_from_pdf(file_path: str) -> str:
-        """从PDF中提取文本"""
-        text = ""
+    def iter_pdf_pages(file_path: str, workers: Optional[int] = None,
+                       pages_per_task: Optional[int] = None,
+                       executor: Optional[ProcessPoolExecutor] = None) -> Iterator[str]:
+        """按页顺序逐页产出PDF文本
+
+        页数较多时按页段分发到进程池并行提取，同时在途的页段数有上限，
+        调用方可以边消费前面的页边等待后面的页。传入 executor 时使用该（共享的）
+        进程池，否则临时创建一个。
+        """
+        pages_per_task = pages_per_task or DocumentParser.PDF_PAGES_PER_TASK
         try:
             with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
+                page_count = len(PyPDF2.PdfReader(file).pages)
         except Exception as e:
             print(f"PDF解析错误: {e}")
-        return text
+            return
+
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        ranges = [(start, min(start + pages_per_task, page_count))
+                  for start in range(0, page_count, pages_per_task)]
+
+        if (workers <= 1 and executor is None) or len(ranges) < 2:
+            for start, stop in ranges:
+                yield from _extract_pdf_page_range(file_path, start, stop)
+            return
+
+        owns_executor = executor is None
+        if owns_executor:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=_process_context())
+        workers = max(workers, 2)
+        pending = deque()
+        try:
+            ranges_iter = iter(ranges)
+            for start, stop in ranges_iter:
+                pending.append(executor.submit(_extract_pdf_page_range, file_path, start, stop))
+                if len(pending) >= workers * 2:
+                    break
+            while pending:
+                texts = pending.popleft().result()
+                next_range = next(ranges_iter, None)
+                if next_range is not None:
+                    pending.append(executor.submit(_extract_pdf_page_range, file_path, *next_range))
+                yield from texts
+        finally:
+            if owns_executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+            else:
+                for future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def extract_text_from_pdf(file_path: str) -> str:
+        """从PDF中提取文本"""
+        return "".join(page + "\n" for page in DocumentParser.iter_pdf_pages(file_path))
 
     @staticmethod
     def extract_text_from_docx(file_path: str) -> str:
@@ -87,6 +410,19 @@ class DocumentParser:
             print(f"Word文档解析错误: {e}")
         return text
 
+    @staticmethod
+    def iter_document(file_path: str, pdf_workers: Optional[int] = None,
+                      executor: Optional[ProcessPoolExecutor] = None) -> Iterator[str]:
+        """按顺序产出文档的文本片段（PDF逐页产出，其他格式整篇产出）
+
+        所有片段拼接起来与 parse_document 的结果相同。
+        """
+        if file_path.lower().endswith('.pdf'):
+            for page in DocumentParser.iter_pdf_pages(file_path, workers=pdf_workers, executor=executor):
+                yield page + "\n"
+        else:
+            yield DocumentParser.parse_document(file_path)
+
     @staticmethod
     def parse_document(file_path: str) -> str:
         """根据文件类型解析文档"""
@@ -108,9 +444,14 @@ class DocumentParser:
             raise ValueError("不支持的文件格式。请使用PDF、Word、TXT或Markdown文档。")
 
 class TextChunker:
-    """文本分块器"""
+    """文本分块器
 
-    def __init__(self, quality_level: str = "中等"):
+    默认按字符数分块；by_tokens=True 时改用 token_counter 计数，按各档位的token预算装箱，
+    重叠长度仍按字符计。每块的 metadata 中都带有 token_count。
+    """
+
+    def __init__(self, quality_level: str = "中等", token_counter: Optional["TokenCounter"] = None,
+                 by_tokens: bool = False):
         quality_configs = {
             "简约": {"max_chunk_size": 8000, "overlap_size": 200, "min_chunk_size": 3000},
             "中等": {"max_chunk_size": 4000, "overlap_size": 500, "min_chunk_size": 1500},
@@ -125,105 +466,197 @@ class TextChunker:
         self.min_chunk_size = config["min_chunk_size"]  # 新增：最小分块大小
         self.quality_level = quality_level
 
+        # 按token分块时每块的预算（上限/下限），纯中文文本下与按字符分块的块大小相当
+        token_budgets = {
+            "简约": {"max_chunk_tokens": 4800, "min_chunk_tokens": 1800},
+            "中等": {"max_chunk_tokens": 2400, "min_chunk_tokens": 900},
+            "较细致": {"max_chunk_tokens": 1500, "min_chunk_tokens": 600},
+            "细致": {"max_chunk_tokens": 1100, "min_chunk_tokens": 480},
+            "精细": {"max_chunk_tokens": 720, "min_chunk_tokens": 360},
+        }
+        budget = token_budgets.get(quality_level, token_budgets["中等"])
+        self.max_chunk_tokens = budget["max_chunk_tokens"]
+        self.min_chunk_tokens = budget["min_chunk_tokens"]
+
+        self.token_counter = token_counter or TokenCounter()
+        self.by_tokens = by_tokens
+        if by_tokens:
+            self._measure = self.token_counter.count
+            self._max_size, self._min_size = self.max_chunk_tokens, self.min_chunk_tokens
+        else:
+            self._measure = len
+            self._max_size, self._min_size = self.max_chunk_size, self.min_chunk_size
+        self._paragraph_sep_size = self._measure("\n\n")
+        self._sentence_sep_size = self._measure("。")
+
+    _PARAGRAPH_SPLIT = re.compile(r'\n\n')
+    _SENTENCE_SPLIT = re.compile(r'[。！？；\n]+')
+
+    def worker_args(self) -> Tuple[str, bool, Optional[str]]:
+        """在子进程中重建相同分块器所需的参数（见 _chunk_document）"""
+        return self.quality_level, self.by_tokens, self.token_counter.tokenizer_path
+
     def chunk_text(self, text: str) -> List[Tuple[str, Dict[str, Any]]]:
         """
         将文本分块，保持语义完整性
         返回: [(chunk_text, metadata), ...]
         """
+        return list(self.chunk_stream([text]))
+
+    def chunk_stream(self, segments: Iterable[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """对按顺序到达的文本片段（如逐页解析的PDF、逐段读取的文件）增量分块
+
+        结果与对所有片段拼接后的文本调用 chunk_text 相同，但每凑满一块就立即产出，
+        内存只保留当前块。metadata 中的 start_char/end_char 是块在拼接后文本中的字符位置。
+        """
         if self.quality_level in ["简约", "中等"]:
-            return self._chunk_by_paragraphs(text)
+            return self._chunk_by_paragraphs(self._iter_units(segments, self._PARAGRAPH_SPLIT))
         else:
-            return self._chunk_by_sentences(text)  
+            return self._chunk_by_sentences(self._iter_units(segments, self._SENTENCE_SPLIT))
 
-    def _chunk_by_paragraphs(self, text: str) -> List[Tuple[str, Dict[str, Any]]]:
-        """按段落分块（适用于简约和中等档位）"""
-        paragraphs = text.split('\n\n')
-        chunks = []
-        current_chunk = ""
+    @staticmethod
+    def _iter_units(segments: Iterable[str], separator: re.Pattern) -> Iterator[Tuple[str, int]]:
+        """把片段流切分为 (段落/句子, 起始字符位置) 流
+
+        最后一个可能未完整的单元暂存起来，直到后续片段中出现分隔符才切分，
+        每个字符最多被扫描两次。
+        """
+        pending: List[str] = []
+        offset = 0
+        for segment in segments:
+            if not segment:
+                continue
+            # 分隔符可能跨越片段边界，带上暂存内容的最后一个字符一起判断
+            tail = pending[-1][-1:] if pending else ""
+            if not separator.search(tail + segment):
+                pending.append(segment)
+                continue
+            pending.append(segment)
+            text = "".join(pending)
+            start = 0
+            for match in separator.finditer(text):
+                yield text[start:match.start()], offset + start
+                start = match.end()
+            pending = [text[start:]]
+            offset += start
+        yield "".join(pending), offset
+
+    def _chunk_by_paragraphs(self, paragraphs: Iterable[Tuple[str, int]]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """按段落分块（适用于简约和中等档位）
+
+        当前块始终是原文中连续的一段，只记录其片段、长度和起点，不重复拼接与切分。
+        """
+        pieces: List[str] = []
+        length = 0
+        chunk_start = 0
+        starts: deque = deque()  # 当前块中各段落的 (起始位置, 段落序号)
         chunk_index = 0
+        last_index = -1
+
+        for i, (para, offset) in enumerate(paragraphs):
+            para_size = self._measure(para)
+            if length + para_size < self._max_size:
+                if not pieces:
+                    chunk_start = offset
+                pieces.append(para + "\n\n")
+                length += para_size + self._paragraph_sep_size
+                starts.append((offset, i))
+                last_index = i
+                continue
 
-        for i, para in enumerate(paragraphs):
-            if len(current_chunk) + len(para) < self.max_chunk_size:
-                current_chunk += para + "\n\n"
+            text = "".join(pieces)
+            if text and length >= self._min_size:
+                yield self._paragraph_chunk(text, chunk_start, starts, last_index, chunk_index)
+                chunk_index += 1
+
+            overlap_start = self._overlap_start(text)
+            overlap = text[overlap_start:]
+            if overlap:
+                chunk_start += overlap_start
+                while len(starts) > 1 and starts[1][0] <= chunk_start:
+                    starts.popleft()
             else:
-                if current_chunk and len(current_chunk) >= self.min_chunk_size:
-                    chunks.append((
-                        current_chunk.strip(),
-                        {
-                            "chunk_index": chunk_index,
-                            "chunk_type": "paragraph_based",
-                            "start_paragraph": i - len(current_chunk.split('\n\n')) + 1,
-                            "end_paragraph": i - 1
-                        }
-                    ))
-                    chunk_index += 1
-
-                overlap_text = self._get_overlap_text(current_chunk)
-                current_chunk = overlap_text + para + "\n\n"
-
-        if current_chunk and len(current_chunk) >= self.min_chunk_size:
-            chunks.append((
-                current_chunk.strip(),
-                {
-                    "chunk_index": chunk_index,
-                    "chunk_type": "paragraph_based",
-                    "start_paragraph": len(paragraphs) - len(current_chunk.split('\n\n')),
-                    "end_paragraph": len(paragraphs) - 1
-                }
-            ))
-
-        return chunks
-
-    def _chunk_by_sentences(self, text: str) -> List[Tuple[str, Dict[str, Any]]]:
-        """按句子分块（适用于较细致、细致、精细档位）"""
-        import re
-        # 更精细的句子分割
-        sentences = re.split(r'[。！？；\n]+', text)
-        sentences = [s.strip() for s in sentences if s.strip()]
-
-        chunks = []
-        current_chunk = ""
+                chunk_start = offset
+                starts.clear()
+            pieces = [overlap, para + "\n\n"]
+            length = self._measure(overlap) + para_size + self._paragraph_sep_size
+            starts.append((offset, i))
+            last_index = i
+
+        if pieces and length >= self._min_size:
+            yield self._paragraph_chunk("".join(pieces), chunk_start, starts, last_index, chunk_index)
+
+    def _paragraph_chunk(self, text: str, chunk_start: int, starts: deque, last_index: int,
+                         chunk_index: int) -> Tuple[str, Dict[str, Any]]:
+        stripped = text.strip()
+        start_char = chunk_start + len(text) - len(text.lstrip())
+        return (
+            stripped,
+            {
+                "chunk_index": chunk_index,
+                "chunk_type": "paragraph_based",
+                "start_paragraph": starts[0][1],
+                "end_paragraph": last_index,
+                "start_char": start_char,
+                "end_char": start_char + len(stripped),
+                "token_count": self.token_counter.count(stripped)
+            }
+        )
+
+    def _chunk_by_sentences(self, pieces: Iterable[Tuple[str, int]]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """按句子分块（适用于较细致、细致、精细档位）
+
+        块由若干句子拼接而成（分隔符统一为"。"），缓冲区保存 (句子, 起始位置, 句子序号, 长度)，
+        长度增量维护。重叠部分保留上一块的最后两句和一个空句，与原有的拼接方式一致。
+        """
+        sentences = ((piece.strip(), offset + len(piece) - len(piece.lstrip()))
+                     for piece, offset in pieces if piece.strip())
+
+        buffer: deque = deque()
+        length = 0
         chunk_index = 0
 
-        for i, sentence in enumerate(sentences):
-            if len(current_chunk) + len(sentence) < self.max_chunk_size:
-                current_chunk += sentence + "。"
-            else:
-                if current_chunk and len(current_chunk) >= self.min_chunk_size:
-                    chunks.append((
-                        current_chunk.strip(),
-                        {
-                            "chunk_index": chunk_index,
-                            "chunk_type": "sentence_based",
-                            "start_sentence": i - current_chunk.count('。') + 1,
-                            "end_sentence": i - 1,
-                            "granularity": "fine"
-                        }
-                    ))
-                    chunk_index += 1
-
-                # 保留更多重叠内容以保持语义连贯性
-                overlap_sentences = current_chunk.split('。')[-3:]  # 保留最后3句
-                current_chunk = '。'.join(overlap_sentences) + "。" + sentence + "。"
-
-        if current_chunk and len(current_chunk) >= self.min_chunk_size:
-            chunks.append((
-                current_chunk.strip(),
-                {
-                    "chunk_index": chunk_index,
-                    "chunk_type": "sentence_based",
-                    "start_sentence": len(sentences) - current_chunk.count('。'),
-                    "end_sentence": len(sentences) - 1,
-                    "granularity": "fine"
-                }
-            ))
-
-        return chunks
+        for i, (sentence, offset) in enumerate(sentences):
+            size = self._measure(sentence) + self._sentence_sep_size
+            if length + size - self._sentence_sep_size < self._max_size:
+                buffer.append((sentence, offset, i, size))
+                length += size
+                continue
 
-    def _get_overlap_text(self, text: str) -> str:
-        """获取重叠文本"""
+            if buffer and length >= self._min_size:
+                yield self._sentence_chunk(buffer, chunk_index)
+                chunk_index += 1
+
+            # 保留更多重叠内容以保持语义连贯性
+            overlap = list(buffer)[-2:]
+            buffer = deque(overlap + [("", None, None, self._sentence_sep_size), (sentence, offset, i, size)])
+            length = sum(entry[3] for entry in buffer)
+
+        if buffer and length >= self._min_size:
+            yield self._sentence_chunk(buffer, chunk_index)
+
+    def _sentence_chunk(self, buffer: deque, chunk_index: int) -> Tuple[str, Dict[str, Any]]:
+        located = [entry for entry in buffer if entry[1] is not None]
+        first, last = located[0], located[-1]
+        text = "".join(entry[0] + "。" for entry in buffer).strip()
+        return (
+            text,
+            {
+                "chunk_index": chunk_index,
+                "chunk_type": "sentence_based",
+                "start_sentence": first[2],
+                "end_sentence": last[2],
+                "start_char": first[1],
+                "end_char": last[1] + len(last[0]),
+                "token_count": self.token_counter.count(text),
+                "granularity": "fine"
+            }
+        )
+
+    def _overlap_start(self, text: str) -> int:
+        """重叠文本在 text 中的起始位置（从句子边界开始，跳过开头空白）"""
         if len(text) <= self.overlap_size:
-            return text
+            return 0
 
         # 从后往前找，保持完整的句子
         overlap_start = max(0, len(text) - self.overlap_size)
@@ -231,66 +664,970 @@ class TextChunker:
         while overlap_start > 0 and text[overlap_start] not in '.。!！?？':
             overlap_start -= 1
 
-        return text[overlap_start:].lstrip()
+        return len(text) - len(text[overlap_start:].lstrip())
 
-class LLMClient:
-    """大模型API客户端"""
+    def _get_overlap_text(self, text: str) -> str:
+        """获取重叠文本"""
+        return text[self._overlap_start(text):]
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数（中文约0.6 token/字，其他字符约0.3 token/字符）"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return int(cjk_count * 0.6 + (len(text) - cjk_count) * 0.3) + 1
+
+
+@functools.lru_cache(maxsize=4)
+def _load_tokenizer(path: str):
+    from tokenizers import Tokenizer
+    return Tokenizer.from_file(path)
+
+
+class TokenCounter:
+    """token计数器
+
+    提供本地分词器文件（HuggingFace tokenizers 格式的 tokenizer.json，例如模型发布的分词器）
+    时按实际分词计数；未安装 tokenizers 或加载失败时退回 estimate_tokens 估算。
+    同一文件在进程内只加载一次。
+    """
+
+    def __init__(self, tokenizer_path: Optional[str] = None):
+        self.tokenizer_path = tokenizer_path
+        self.tokenizer = None
+        if tokenizer_path:
+            try:
+                self.tokenizer = _load_tokenizer(tokenizer_path)
+            except ImportError:
+                print("⚠️ 未安装 tokenizers，使用估算的token数")
+            except Exception as e:
+                print(f"⚠️ 加载分词器失败（{tokenizer_path}）: {e}，使用估算的token数")
+
+    @property
+    def backend(self) -> str:
+        return "tokenizer" if self.tokenizer is not None else "estimate"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return estimate_tokens(text)
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+class TokenBucket:
+    """令牌桶，按固定速率补充令牌，用于限制每分钟请求数或token数"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        """取出令牌，不足时等待（持锁等待，保证先到先得）"""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def refund(self, amount: float):
+        """按实际消耗修正令牌数（amount为负时表示补扣）"""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class RateLimiter:
+    """共享限流器：AIMD自适应并发 + 每分钟请求数/token数令牌桶
+
+    - 成功响应时并发上限每个窗口加1（加性增）
+    - 遇到429/5xx时并发上限减半（乘性减），冷却期内只减一次
+    """
+
+    def __init__(self, max_concurrency: int = 5, min_concurrency: int = 1,
+                 requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 decrease_factor: float = 0.5, decrease_cooldown: float = 1.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+        self._limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def concurrency(self) -> int:
+        """当前允许的并发数"""
+        return max(self.min_concurrency, int(self._limit))
+
+    async def acquire(self, estimated_tokens: int = 0):
+        """等待并发槽位和令牌"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.concurrency)
+            self._in_flight += 1
+
+        try:
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.request_bucket:
+                await self.request_bucket.acquire(1)
+            if self.token_bucket and estimated_tokens:
+                await self.token_bucket.acquire(estimated_tokens)
+        except BaseException:
+            await self.release()
+            raise
+
+    async def release(self, throttled: bool = False, success: bool = False):
+        """释放并发槽位，并根据结果调整并发上限"""
+        async with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    self._limit = max(float(self.min_concurrency), self._limit * self.decrease_factor)
+                    self._last_decrease = now
+            elif success:
+                self._limit = min(float(self.max_concurrency), self._limit + 1.0 / self._limit)
+            self._condition.notify_all()
+
+    def pause(self, seconds: float):
+        """服务端要求等待（Retry-After）时，暂停所有新请求"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def settle_tokens(self, estimated_tokens: int, actual_tokens: int):
+        """用响应中的实际token用量修正令牌桶"""
+        if self.token_bucket and actual_tokens:
+            self.token_bucket.refund(estimated_tokens - actual_tokens)
+
+
+class LLMAPIError(Exception):
+    """LLM API调用失败（不可重试的错误，或重试次数/时限耗尽）"""
+
+    def __init__(self, message: str, status: Optional[int] = None, retryable: bool = False,
+                 retry_after: Optional[float] = None, attempts: int = 1):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.attempts = attempts
+
+    def __str__(self):
+        status = f"状态码 {self.status}, " if self.status else ""
+        return f"{self.args[0]} ({status}尝试 {self.attempts} 次)"
+
+
+@dataclass
+class RetryPolicy:
+    """API重试策略：指数退避 + 随机抖动，并限制单次请求和总耗时"""
+    max_attempts: int = 4
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    jitter: float = 0.5  # 退避时间的随机抖动比例 (0~1)
+    request_timeout: float = 120.0  # 单次请求超时（秒）
+    total_timeout: float = 600.0  # 含重试在内的总时限（秒）
+    retry_statuses: Tuple[int, ...] = (408, 409, 429, 500, 502, 503, 504)
+
+    def backoff(self, attempt: int) -> float:
+        """第attempt次失败后的等待时间"""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay * (1 - self.jitter * random.random())
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After头（秒数或HTTP日期）"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ResponseCache:
+    """LLM响应的本地持久化缓存（SQLite）
+
+    以请求内容（模型、消息、max_tokens、temperature）的哈希为键；超过容量上限时
+    按最近访问时间淘汰（LRU），超过TTL的条目视为失效。
+    """
+
+    def __init__(self, path: str = "cache/llm_responses.sqlite3",
+                 max_bytes: int = 256 * 1024 * 1024, ttl: float = 7 * 24 * 3600):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """根据请求内容生成缓存键"""
+        keyed = {k: payload.get(k) for k in ("model", "messages", "max_tokens", "temperature")}
+        raw = json.dumps(keyed, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, size, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, size, created_at = row
+            if self.ttl and now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return response
+
+    def set(self, key: str, response: str):
+        """写入缓存，必要时淘汰最久未使用的条目"""
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            # 覆盖已有条目时只按大小差值调整总量
+            row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._total_bytes += size - (row[0] if row else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """淘汰到容量上限的90%以下（调用方需持有锁）"""
+        if self.ttl:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        excess = self._total_bytes - self.max_bytes * 0.9
+        if excess <= 0:
+            return
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            victims.append((key,))
+            excess -= size
+            self._total_bytes -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计（计数器在锁内一起读取，彼此一致）"""
+        with self._lock:
+            hits, misses, total_bytes = self.hits, self.misses, self._total_bytes
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": entries,
+            "bytes": total_bytes
+        }
 
-    def __init__(self, api_key: str, base_url: str = "https://api.deepseek.com"):
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_response_caches: Dict[str, ResponseCache] = {}
+_response_caches_lock = threading.Lock()
+
+
+def get_response_cache(path: str, max_bytes: int, ttl: float) -> ResponseCache:
+    """获取进程内共享的响应缓存（同一路径只打开一个连接）"""
+    with _response_caches_lock:
+        cache = _response_caches.get(path)
+        if cache is None:
+            cache = ResponseCache(path, max_bytes=max_bytes, ttl=ttl)
+            _response_caches[path] = cache
+        return cache
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：统一全半角（NFKC）并合并空白，排版上的改动不影响指纹"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def content_fingerprint(*parts: str) -> str:
+    """对若干段规范化文本计算稳定的内容指纹"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(normalize_text(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def knowledge_point_fingerprint(kp: KnowledgePoint) -> str:
+    """知识点的内容指纹（只包含会写入出题提示词的字段，与ID无关）"""
+    return content_fingerprint(kp.title, kp.summary, "\n".join(kp.key_formulas),
+                               kp.difficulty_level, kp.knowledge_type)
+
+
+class FingerprintStore:
+    """按内容指纹保存的中间结果（SQLite）
+
+    重新上传修改过的文档时，内容未变的文本块直接复用已提取的知识点，内容未变的
+    知识点直接复用已生成的题目。kind 区分结果类型（"chunk"/"question"），值为JSON；
+    超过TTL的条目在读取时视为失效，并在打开时清理。
+    """
+
+    def __init__(self, path: str = "cache/fingerprints.sqlite3", ttl: float = 30 * 24 * 3600):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (kind, key))"
+        )
+        if self.ttl:
+            self._conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl,))
+
+    def get_many(self, kind: str, keys: List[str]) -> Dict[str, Any]:
+        """批量读取，返回命中的 {key: value}"""
+        if not keys:
+            return {}
+        min_created = time.time() - self.ttl if self.ttl else 0
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM results WHERE kind = ? AND created_at >= ? "
+                    f"AND key IN ({','.join('?' * len(batch))})",
+                    (kind, min_created, *batch)
+                ).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def get(self, kind: str, key: str) -> Optional[Any]:
+        return self.get_many(kind, [key]).get(key)
+
+    def set_many(self, kind: str, items: List[Tuple[str, Any]]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results (kind, key, value, created_at) VALUES (?, ?, ?, ?)",
+                [(kind, key, json.dumps(value, ensure_ascii=False), now) for key, value in items]
+            )
+
+    def set(self, kind: str, key: str, value: Any):
+        self.set_many(kind, [(key, value)])
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_fingerprint_stores: Dict[str, FingerprintStore] = {}
+_fingerprint_stores_lock = threading.Lock()
+
+
+def get_fingerprint_store(path: str, ttl: float) -> FingerprintStore:
+    """获取进程内共享的指纹存储（同一路径只打开一个连接）"""
+    with _fingerprint_stores_lock:
+        store = _fingerprint_stores.get(path)
+        if store is None:
+            store = FingerprintStore(path, ttl=ttl)
+            _fingerprint_stores[path] = store
+        return store
+
+
+class IncrementalJSONParser:
+    """增量JSON解析器
+
+    逐段喂入模型输出的文本，当位于指定嵌套深度的对象闭合时立即解析并返回，
+    无需等待完整响应。item_depth=0 表示顶层对象；
+    {"knowledge_points": [{...}, ...]} 中的每个元素位于 item_depth=2。
+    """
+
+    _STRUCTURAL = re.compile(r'[{}\[\]"]')
+    _STRING_SPECIAL = re.compile(r'["\\]')
+
+    def __init__(self, item_depth: int, loads: Callable[[str], Any] = json.loads):
+        self.item_depth = item_depth
+        self.loads = loads
+        self.errors = 0
+        self._depth = 0
+        self._in_string = False
+        self._pending = ""
+        self._capturing = False
+        self._skip = 0
+
+    def feed(self, text: str) -> List[Any]:
+        """喂入一段文本，返回本段中新闭合并解析成功的对象"""
+        items = []
+        buf = self._pending + text
+        pos = len(self._pending) + self._skip
+        start = 0 if self._capturing else None
+
+        while pos < len(buf):
+            if self._in_string:
+                m = self._STRING_SPECIAL.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                pos = m.end()
+                if m.group() == '\\':
+                    pos += 1  # 跳过被转义的字符
+                else:
+                    self._in_string = False
+                continue
+
+            m = self._STRUCTURAL.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+            ch = m.group()
+            pos = m.end()
+            if ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                if ch == '{' and start is None and self._depth == self.item_depth:
+                    start = m.start()
+                self._depth += 1
+            else:
+                self._depth = max(0, self._depth - 1)
+                if start is not None and self._depth == self.item_depth:
+                    try:
+                        items.append(self.loads(buf[start:pos]))
+                    except (ValueError, KeyError, TypeError) as e:
+                        self.errors += 1
+                        print(f"增量解析对象失败: {e}")
+                    start = None
+
+        self._skip = max(0, pos - len(buf))
+        self._capturing = start is not None
+        self._pending = buf[start:] if start is not None else ""
+        return items
+
+    @property
+    def balanced(self) -> bool:
+        """已喂入的文本是否括号配平、没有停在字符串中间（截断的输出不满足）"""
+        return self._depth == 0 and not self._in_string
+
+
+class UsageStats:
+    """API用量统计（token数与提供方的提示词前缀缓存命中情况）
+
+    DeepSeek 在 usage 中返回 prompt_cache_hit_tokens / prompt_cache_miss_tokens，
+    OpenAI 兼容接口返回 prompt_tokens_details.cached_tokens，两种格式都会统计。
+    local_cache_hits 为命中本地响应缓存、未发出请求的次数。
+    """
+
+    FIELDS = ("requests", "prompt_tokens", "completion_tokens", "prompt_cache_hit_tokens",
+              "prompt_cache_miss_tokens", "local_cache_hits")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = dict.fromkeys(self.FIELDS, 0)
+
+    def record(self, usage: Dict[str, Any]):
+        """记录一次请求的 usage 字段"""
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        hit_tokens = usage.get("prompt_cache_hit_tokens")
+        if hit_tokens is None:
+            hit_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        miss_tokens = usage.get("prompt_cache_miss_tokens")
+        if miss_tokens is None:
+            miss_tokens = max(0, prompt_tokens - hit_tokens)
+
+        with self._lock:
+            totals = self._totals
+            totals["requests"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += usage.get("completion_tokens") or 0
+            totals["prompt_cache_hit_tokens"] += hit_tokens
+            totals["prompt_cache_miss_tokens"] += miss_tokens
+
+    def record_local_hit(self):
+        with self._lock:
+            self._totals["local_cache_hits"] += 1
+
+    def add(self, usage: Dict[str, Any]):
+        """累加另一份统计（如已关闭客户端的 snapshot）"""
+        with self._lock:
+            for key in self.FIELDS:
+                self._totals[key] += usage.get(key, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前累计值，附带前缀缓存命中率"""
+        with self._lock:
+            return self._summarize(dict(self._totals))
+
+    def since(self, before: Dict[str, Any]) -> Dict[str, Any]:
+        """自 before（之前的 snapshot）以来的增量"""
+        with self._lock:
+            return self._summarize({key: self._totals[key] - before.get(key, 0) for key in self.FIELDS})
+
+    @staticmethod
+    def _summarize(totals: Dict[str, Any]) -> Dict[str, Any]:
+        cacheable = totals["prompt_cache_hit_tokens"] + totals["prompt_cache_miss_tokens"]
+        totals["prompt_cache_hit_rate"] = totals["prompt_cache_hit_tokens"] / cacheable if cacheable else 0.0
+        return totals
+
+    @staticmethod
+    def describe(usage: Dict[str, Any]) -> str:
+        return (f"{usage['requests']} 次请求，输入 {usage['prompt_tokens']} tokens"
+                f"（前缀缓存命中 {usage['prompt_cache_hit_tokens']}，命中率 {usage['prompt_cache_hit_rate']:.0%}），"
+                f"输出 {usage['completion_tokens']} tokens，本地缓存命中 {usage['local_cache_hits']} 次")
+
+
+class LLMClient:
+    """大模型API客户端
+
+    持有一个长生命周期的连接池（keep-alive + DNS缓存），所有请求复用同一个
+    ClientSession。需在事件循环中使用 `async with LLMClient(...)` 或在结束时
+    调用 `aclose()` 释放连接。
+
+    提示词分为固定的 system 消息和可变的用户消息：system 放在最前面且各请求相同，
+    提供方的前缀缓存才能命中。用量统计见 usage。
+    """
+
+    def __init__(self, api_key: str, base_url: str = "https://api.deepseek.com",
+                 max_connections: int = 100, max_connections_per_host: int = 20,
+                 dns_cache_ttl: int = 300, keepalive_timeout: float = 30.0,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 cache: Optional[ResponseCache] = None,
+                 model: str = "deepseek-chat", temperature: float = 0.7):
         self.api_key = api_key
         self.base_url = base_url
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.cache = cache
+        self.model = model
+        self.temperature = temperature
+        self.usage = UsageStats()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "LLMClient":
+        await self._get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """获取（必要时创建）共享的连接池会话"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+        return self._session
 
-    async def call_api(self, prompt: str, max_tokens: int = 2000) -> str:
-      """异步调用API"""
-      async with aiohttp.ClientSession() as session:
-          data = {
-              "model": "deepseek-chat",
-              "messages": [{"role": "user", "content": prompt}],
-              "max_tokens": max_tokens,
-              "temperature": 0.7
-          }
-
-          try:
-
-              async with session.post(
-                  f"{self.base_url}/v1/chat/completions",
-                  headers=self.headers,
-                  json=data
-              ) as response:
-                  if response.status != 200:
-                      error_text = await response.text()
-                      print(f"API错误 (状态码 {response.status}): {error_text}")
-                      return ""
-
-                  result = await response.json()
-
-                  # 检查是否有错误
-                  if 'error' in result:
-                      print(f"API返回错误: {result['error']}")
-                      return ""
-
-                  # 检查是否有正确的响应格式
-                  if 'choices' not in result or len(result['choices']) == 0:
-                      print(f"API响应格式错误: {result}")
-                      return ""
-
-                  return result['choices'][0]['message']['content']
-          except Exception as e:
-              print(f"API调用错误: {e}")
-              import traceback
-              traceback.print_exc()
-              return ""
+    async def aclose(self):
+        """关闭连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @staticmethod
+    def _build_messages(prompt: str, system: Optional[str]) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": system}] if system else []
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    async def call_api(self, prompt: str, max_tokens: int = 2000, system: Optional[str] = None) -> str:
+        """异步调用API，瞬时错误按重试策略自动重试
+
+        失败时抛出 LLMAPIError，而不是返回空字符串。配置了缓存时，相同请求（包括
+        system 消息）直接返回本地缓存的响应。
+        """
+        data = {
+            "model": self.model,
+            "messages": self._build_messages(prompt, system),
+            "max_tokens": max_tokens,
+            "temperature": self.temperature
+        }
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResponseCache.make_key(data)
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                self.usage.record_local_hit()
+                return cached
+
+        estimated_tokens = estimate_tokens(prompt) + estimate_tokens(system or "") + max_tokens
+        content = await self._call_with_retry(data, estimated_tokens)
+        if cache_key is not None and content:
+            await asyncio.to_thread(self.cache.set, cache_key, content)
+        return content
+
+    async def stream_api(self, prompt: str, max_tokens: int = 2000,
+                         system: Optional[str] = None,
+                         finish: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """以流式（SSE）方式调用API，逐段产出模型输出的文本
+
+        尚未产出任何内容时的瞬时错误会按重试策略重试；输出中途断开则抛出
+        LLMAPIError。正常结束（finish_reason 为 stop）的输出会写入缓存，命中缓存时
+        一次性产出缓存内容。传入 finish 字典时，结束后其中的 "reason" 为模型返回的
+        finish_reason（因 max_tokens 截断时为 "length"）。
+        """
+        if finish is None:
+            finish = {}
+        data = {
+            "model": self.model,
+            "messages": self._build_messages(prompt, system),
+            "max_tokens": max_tokens,
+            "temperature": self.temperature,
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResponseCache.make_key(data)
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                self.usage.record_local_hit()
+                finish["reason"] = "stop"
+                yield cached
+                return
+
+        policy = self.retry_policy
+        estimated_tokens = estimate_tokens(prompt) + estimate_tokens(system or "") + max_tokens
+        deadline = time.monotonic() + policy.total_timeout
+        attempt = 0
+        parts: List[str] = []
+
+        while True:
+            attempt += 1
+            try:
+                async for delta in self._stream_request(data, estimated_tokens, deadline, finish):
+                    parts.append(delta)
+                    yield delta
+                break
+            except LLMAPIError as e:
+                e.attempts = attempt
+                if parts or not e.retryable or attempt >= policy.max_attempts:
+                    raise
+                delay = e.retry_after if e.retry_after is not None else policy.backoff(attempt)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                print(f"流式API调用失败，{delay:.1f}秒后重试 ({attempt}/{policy.max_attempts}): {e.args[0]}")
+                await asyncio.sleep(delay)
+
+        if cache_key is not None and parts and finish.get("reason") == "stop":
+            await asyncio.to_thread(self.cache.set, cache_key, "".join(parts))
+
+    async def _stream_request(self, data: Dict[str, Any], estimated_tokens: int,
+                              deadline: float, finish: Dict[str, Any]) -> AsyncIterator[str]:
+        """发送单次流式请求并解析SSE事件（finish_reason 记录到 finish["reason"]）"""
+        session = await self._get_session()
+        await self.rate_limiter.acquire(estimated_tokens)
+        throttled = success = False
+
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMAPIError("API调用超过总时限")
+            # 流式响应只限制连接和两次数据之间的间隔，不限制总时长
+            timeout = aiohttp.ClientTimeout(
+                total=remaining,
+                sock_connect=min(self.retry_policy.request_timeout, remaining),
+                sock_read=min(self.retry_policy.request_timeout, remaining)
+            )
+
+            async with session.post(
+                f"{self.base_url}/v1/chat/completions",
+                json=data,
+                timeout=timeout
+            ) as response:
+                if response.status != 200:
+                    throttled = response.status == 429 or response.status >= 500
+                    error_text = await response.text()
+                    retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+                    if retry_after:
+                        self.rate_limiter.pause(retry_after)
+                    raise LLMAPIError(
+                        f"API错误: {error_text[:500]}",
+                        status=response.status,
+                        retryable=response.status in self.retry_policy.retry_statuses,
+                        retry_after=retry_after
+                    )
+
+                async for raw_line in response.content:
+                    line = raw_line.decode('utf-8', errors='replace').strip()
+                    if not line.startswith('data:'):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == '[DONE]':
+                        break
+                    try:
+                        event = json.loads(payload)
+                    except ValueError:
+                        continue
+                    if 'error' in event:
+                        raise LLMAPIError(f"API返回错误: {event['error']}", status=response.status)
+                    usage = event.get('usage')
+                    if usage:
+                        self.rate_limiter.settle_tokens(estimated_tokens, usage.get('total_tokens', 0))
+                        self.usage.record(usage)
+                    for choice in event.get('choices') or []:
+                        if choice.get('finish_reason'):
+                            finish["reason"] = choice['finish_reason']
+                        delta = (choice.get('delta') or {}).get('content')
+                        if delta:
+                            yield delta
+                success = True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            throttled = True
+            raise LLMAPIError(f"API调用错误: {e!r}", retryable=True) from e
+        finally:
+            await self.rate_limiter.release(throttled=throttled, success=success)
+
+    async def _call_with_retry(self, data: Dict[str, Any], estimated_tokens: int) -> str:
+        """按重试策略发送请求"""
+        policy = self.retry_policy
+        deadline = time.monotonic() + policy.total_timeout
+        attempt = 0
+
+        while True:
+            attempt += 1
+            try:
+                return await self._request(data, estimated_tokens, deadline)
+            except LLMAPIError as e:
+                e.attempts = attempt
+                if not e.retryable or attempt >= policy.max_attempts:
+                    raise
+                delay = e.retry_after if e.retry_after is not None else policy.backoff(attempt)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                print(f"API调用失败，{delay:.1f}秒后重试 ({attempt}/{policy.max_attempts}): {e.args[0]}")
+                await asyncio.sleep(delay)
+
+    async def _request(self, data: Dict[str, Any], estimated_tokens: int, deadline: float) -> str:
+        """发送单次请求（经过共享限流器）"""
+        session = await self._get_session()
+        await self.rate_limiter.acquire(estimated_tokens)
+        throttled = success = False
+
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMAPIError("API调用超过总时限")
+            timeout = aiohttp.ClientTimeout(total=min(self.retry_policy.request_timeout, remaining))
+
+            async with session.post(
+                f"{self.base_url}/v1/chat/completions",
+                json=data,
+                timeout=timeout
+            ) as response:
+                if response.status != 200:
+                    throttled = response.status == 429 or response.status >= 500
+                    error_text = await response.text()
+                    retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+                    if retry_after:
+                        self.rate_limiter.pause(retry_after)
+                    raise LLMAPIError(
+                        f"API错误: {error_text[:500]}",
+                        status=response.status,
+                        retryable=response.status in self.retry_policy.retry_statuses,
+                        retry_after=retry_after
+                    )
+
+                try:
+                    result = await response.json(content_type=None)
+                except ValueError as e:
+                    raise LLMAPIError(f"API响应不是有效JSON: {e}", status=response.status, retryable=True)
+
+                # 检查是否有错误
+                if 'error' in result:
+                    raise LLMAPIError(f"API返回错误: {result['error']}", status=response.status)
+
+                # 检查是否有正确的响应格式
+                if not result.get('choices'):
+                    raise LLMAPIError(f"API响应格式错误: {str(result)[:500]}", status=response.status, retryable=True)
+
+                success = True
+                usage = result.get('usage') or {}
+                self.rate_limiter.settle_tokens(estimated_tokens, usage.get('total_tokens', 0))
+                self.usage.record(usage)
+                return result['choices'][0]['message']['content'] or ""
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            throttled = True
+            raise LLMAPIError(f"API调用错误: {e!r}", retryable=True) from e
+        finally:
+            await self.rate_limiter.release(throttled=throttled, success=success)
+
+class ProgressReporter:
+    """处理进度汇报
+
+    记录各阶段（提取、出题……）的完成数与总数，以及合并后的知识点数等计数。
+    设置了 callback 时按 min_interval 节流推送 snapshot()（阶段结束时立即推送）；
+    未设置时退回到终端的tqdm进度条。
+    """
+
+    def __init__(self, callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 min_interval: float = 0.5):
+        self.callback = callback
+        self.min_interval = min_interval
+        self._phases: Dict[str, Dict[str, Any]] = {}
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._bars: Dict[str, tqdm] = {}
+        self._last_emit = 0.0
+
+    def start(self, phase: str, total: int = 0, desc: str = ""):
+        """开始（或重新开始）一个阶段"""
+        self._phases[phase] = {"desc": desc or phase, "done": 0, "total": total,
+                               "started_at": time.time(), "finished": False}
+        if self.callback is None:
+            if phase in self._bars:
+                self._bars[phase].close()
+            self._bars[phase] = tqdm(total=total, desc=desc or phase)
+        self._emit(force=True)
+
+    def add_total(self, phase: str, n: int = 1):
+        self._phases[phase]["total"] += n
+        if phase in self._bars:
+            self._bars[phase].total = self._phases[phase]["total"]
+            self._bars[phase].refresh()
+        self._emit()
+
+    def advance(self, phase: str, n: int = 1):
+        self._phases[phase]["done"] += n
+        if phase in self._bars:
+            self._bars[phase].update(n)
+        self._emit()
+
+    def count(self, name: str, n: int = 1):
+        """累加计数（如合并后的知识点数、各类题目数）"""
+        self._counters[name] += n
+        self._emit()
+
+    def finish(self, phase: str):
+        if phase not in self._phases:
+            return
+        self._phases[phase]["finished"] = True
+        bar = self._bars.pop(phase, None)
+        if bar is not None:
+            bar.close()
+        self._emit(force=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前进度：各阶段的完成数、总数、已用时间与预计剩余时间（秒）"""
+        now = time.time()
+        phases = {}
+        for phase, state in self._phases.items():
+            elapsed = now - state["started_at"]
+            done, total = state["done"], state["total"]
+            eta = None
+            if not state["finished"] and 0 < done < total:
+                eta = round(elapsed / done * (total - done), 1)
+            phases[phase] = {"desc": state["desc"], "done": done, "total": total,
+                             "elapsed": round(elapsed, 1), "eta": eta, "finished": state["finished"]}
+        return {"phases": phases, "counters": dict(self._counters), "updated_at": now}
+
+    def _emit(self, force: bool = False):
+        if self.callback is None:
+            return
+        now = time.time()
+        if not force and now - self._last_emit < self.min_interval:
+            return
+        self._last_emit = now
+        try:
+            self.callback(self.snapshot())
+        except Exception as e:
+            print(f"⚠️ 推送进度失败: {e}")
 
 class KnowledgeExtractor:
     """知识点提取器"""
 
-    def __init__(self, llm_client: LLMClient, quality_level: str = "中等"):
+    def __init__(self, llm_client: LLMClient, quality_level: str = "中等", streaming: bool = False):
         self.llm_client = llm_client
         self.quality_level = quality_level
+        self.streaming = streaming
+        self.progress = ProgressReporter()
+        # 设置后，内容未变的文本块直接复用之前提取的知识点
+        self.fingerprints: Optional[FingerprintStore] = None
 
         # 根据质量档位设置不同的提取策略
         self.extraction_strategies = {
@@ -328,17 +1665,16 @@ class KnowledgeExtractor:
 
         self.strategy = self.extraction_strategies.get(quality_level, self.extraction_strategies["中等"])
 
-        self.extraction_prompt_template = """你是一个高级学习辅助AI，任务是分析用户提供的学习资料，将其分解成核心知识点并结构化输出。
+        # 固定的指令部分作为system消息（同一档位下每次请求完全相同，可命中提供方的前缀缓存），
+        # 文本块等可变内容放在用户消息中
+        self.extraction_system_template = """你是一个高级学习辅助AI，任务是分析用户提供的学习资料，将其分解成核心知识点并结构化输出。
 
 **质量档位：** {quality_level}
 **提取策略：** {extraction_focus}
 **细节要求：** {detail_level}
 **预期知识点类型：** {knowledge_types}
 
-**注意：** 你正在处理文档的第 {chunk_index} 部分。
-
-**输入：**
-{chunk_text}
+用户会提供文档的某一部分作为输入。
 
 **你的任务：**
 1. **深入理解内容：** 仔细阅读并理解输入文档的核心主题、逻辑结构和关键信息。
@@ -375,6 +1711,19 @@ class KnowledgeExtractor:
 }}
 ```"""
 
+        self.extraction_prompt_template = """**注意：** 你正在处理文档的第 {chunk_index} 部分。
+
+**输入：**
+{chunk_text}"""
+
+        self.system_prompt = self.extraction_system_template.format(
+            quality_level=self.quality_level,
+            extraction_focus=self.strategy["focus"],
+            detail_level=self.strategy["detail_level"],
+            knowledge_types='", "'.join(self.strategy["knowledge_types"]),
+            specific_instructions=self._get_specific_instructions(self.quality_level)
+        )
+
     def _get_specific_instructions(self, quality_level: str) -> str:
         """根据质量档位生成具体的识别指令"""
         instructions = {
@@ -417,23 +1766,29 @@ class KnowledgeExtractor:
         }
         return instructions.get(quality_level, instructions["中等"])
 
-    async def extract_from_chunk(self, chunk_text: str, chunk_metadata: Dict) -> List[KnowledgePoint]:
-        """从单个文本块中提取知识点"""
-        specific_instructions = self._get_specific_instructions(self.quality_level)
-        knowledge_types_str = '", "'.join(self.strategy["knowledge_types"])
-
-        prompt = self.extraction_prompt_template.format(
-            quality_level=self.quality_level,
-            extraction_focus=self.strategy["focus"],
-            detail_level=self.strategy["detail_level"],
-            knowledge_types=knowledge_types_str,
+    def _build_prompt(self, chunk_text: str, chunk_metadata: Dict) -> str:
+        """构建知识点提取的用户消息（指令部分见 system_prompt）"""
+        return self.extraction_prompt_template.format(
             chunk_index=chunk_metadata['chunk_index'] + 1,
-            chunk_text=chunk_text,
-            specific_instructions=specific_instructions
+            chunk_text=chunk_text
         )
 
-        response = await self.llm_client.call_api(prompt, max_tokens=4000)  # 增加token数
+    @staticmethod
+    def _to_knowledge_point(kp_data: Dict[str, Any]) -> KnowledgePoint:
+        """将模型输出的字典转换为知识点"""
+        return KnowledgePoint(
+            id=kp_data['id'],
+            title=kp_data['title'],
+            summary=kp_data['summary'],
+            context_ref=kp_data.get('context_ref', ''),
+            key_formulas=kp_data.get('key_formulas', []),
+            key_terms=kp_data.get('key_terms', []),
+            difficulty_level=kp_data.get('difficulty_level', '基础'),
+            knowledge_type=kp_data.get('knowledge_type', '概念定义')
+        )
 
+    def _parse_knowledge_points(self, response: str) -> List[KnowledgePoint]:
+        """解析完整响应中的知识点"""
         try:
             json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
             if json_match:
@@ -442,47 +1797,407 @@ class KnowledgeExtractor:
                 json_str = response
 
             data = json.loads(json_str)
-            knowledge_points = []
-
-            for kp_data in data.get('knowledge_points', []):
-                kp = KnowledgePoint(
-                    id=kp_data['id'],
-                    title=kp_data['title'],
-                    summary=kp_data['summary'],
-                    context_ref=kp_data.get('context_ref', ''),
-                    key_formulas=kp_data.get('key_formulas', []),
-                    key_terms=kp_data.get('key_terms', []),
-                    difficulty_level=kp_data.get('difficulty_level', '基础'),
-                    knowledge_type=kp_data.get('knowledge_type', '概念定义')
-                )
-                knowledge_points.append(kp)
-
-            return knowledge_points
+            return [self._to_knowledge_point(kp_data) for kp_data in data.get('knowledge_points', [])]
         except Exception as e:
             print(f"解析知识点时出错: {e}")
             return []
 
+    async def iter_chunk(self, chunk_text: str, chunk_metadata: Dict) -> AsyncIterator[KnowledgePoint]:
+        """从单个文本块中提取知识点，流式模式下每个知识点一闭合就产出
+
+        配置了 fingerprints 时按 (提示词, 规范化文本) 的指纹复用之前的提取结果，
+        与块的位置无关，文档前面的修改不会让后面未变的块失效。
+        """
+        key = None
+        if self.fingerprints is not None:
+            key = content_fingerprint(self.system_prompt, chunk_text)
+            cached = await asyncio.to_thread(self.fingerprints.get, "chunk", key)
+            if cached is not None:
+                self.progress.count("reused_chunks")
+                for kp_data in cached:
+                    yield KnowledgePoint(**kp_data)
+                return
+
+        extracted = []
+        outcome: Dict[str, Any] = {}
+        try:
+            async for kp in self._request_knowledge_points(self._build_prompt(chunk_text, chunk_metadata), outcome):
+                extracted.append(asdict(kp))
+                yield kp
+        except LLMAPIError as e:
+            print(f"提取第 {chunk_metadata['chunk_index'] + 1} 块知识点失败: {e}")
+            return
+
+        # 只保存完整的提取结果：被截断或有对象解析失败时，下次重新提取
+        if key is not None and extracted and outcome.get("complete"):
+            await asyncio.to_thread(self.fingerprints.set, "chunk", key, extracted)
+
+    async def _request_knowledge_points(self, prompt: str,
+                                        outcome: Optional[Dict[str, Any]] = None) -> AsyncIterator[KnowledgePoint]:
+        """请求模型提取知识点；失败时抛出 LLMAPIError
+
+        传入 outcome 字典时，结束后其中的 "complete" 表示输出是否完整：流式输出需
+        正常结束（finish_reason 为 stop）、JSON配平且没有解析失败的对象。
+        """
+        if outcome is None:
+            outcome = {}
+        if not self.streaming:
+            response = await self.llm_client.call_api(prompt, max_tokens=4000,  # 增加token数
+                                                      system=self.system_prompt)
+            knowledge_points = self._parse_knowledge_points(response)
+            # 截断的响应整体解析失败，不会有知识点
+            outcome["complete"] = bool(knowledge_points)
+            for kp in knowledge_points:
+                yield kp
+            return
+
+        parser = IncrementalJSONParser(item_depth=2, loads=lambda text: self._to_knowledge_point(json.loads(text)))
+        parts = []
+        emitted = 0
+        finish: Dict[str, Any] = {}
+        async for delta in self.llm_client.stream_api(prompt, max_tokens=4000, system=self.system_prompt,
+                                                      finish=finish):
+            parts.append(delta)
+            for kp in parser.feed(delta):
+                emitted += 1
+                yield kp
+        outcome["complete"] = finish.get("reason") == "stop" and parser.balanced and parser.errors == 0
+
+        # 输出结构与预期不符（例如直接输出数组）时，回退为整体解析
+        if emitted == 0:
+            for kp in self._parse_knowledge_points("".join(parts)):
+                yield kp
+
+    async def extract_from_chunk(self, chunk_text: str, chunk_metadata: Dict) -> List[KnowledgePoint]:
+        """从单个文本块中提取知识点"""
+        return [kp async for kp in self.iter_chunk(chunk_text, chunk_metadata)]
+
+    async def iter_extract(self, chunks: Union[List[Tuple[str, Dict]], AsyncIterator[Tuple[str, Dict]]],
+                           with_metadata: bool = False) -> AsyncIterator[KnowledgePoint]:
+        """并发处理所有文本块，按到达顺序逐个产出知识点
+
+        chunks 可以是列表，也可以是异步迭代器（如边解析边分块的文档）：每到达
+        一个文本块就立即开始提取。with_metadata=True 时产出 (知识点, 所在块的metadata)。
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        chunk_done = object()
+
+        async def worker(chunk_text: str, chunk_metadata: Dict):
+            try:
+                async for kp in self.iter_chunk(chunk_text, chunk_metadata):
+                    queue.put_nowait((kp, chunk_metadata) if with_metadata else kp)
+            except Exception as e:
+                print(f"提取第 {chunk_metadata['chunk_index'] + 1} 块知识点时出错: {e}")
+            finally:
+                queue.put_nowait(chunk_done)
+
+        tasks: List[asyncio.Future] = []
+        streaming_chunks = hasattr(chunks, '__aiter__')
+        self.progress.start("extract", total=0 if streaming_chunks else len(chunks), desc="提取知识点")
+
+        async def feed():
+            if streaming_chunks:
+                async for chunk_text, chunk_metadata in chunks:
+                    tasks.append(asyncio.ensure_future(worker(chunk_text, chunk_metadata)))
+                    self.progress.add_total("extract")
+            else:
+                for chunk_text, chunk_metadata in chunks:
+                    tasks.append(asyncio.ensure_future(worker(chunk_text, chunk_metadata)))
+
+        feeder = asyncio.ensure_future(feed())
+        feeder.add_done_callback(queue.put_nowait)
+        feeder_done = False
+        completed = 0
+
+        try:
+            while not feeder_done or completed < len(tasks):
+                item = await queue.get()
+                if item is feeder:
+                    feeder_done = True
+                    item.result()
+                    continue
+                if item is chunk_done:
+                    completed += 1
+                    self.progress.advance("extract")
+                    continue
+                self.progress.count("raw_knowledge_points")
+                yield item
+        finally:
+            self.progress.finish("extract")
+            feeder.cancel()
+            for task in tasks:
+                task.cancel()
+
     async def extract_all(self, chunks: List[Tuple[str, Dict]]) -> List[KnowledgePoint]:
         """从所有文本块中提取知识点"""
-        all_knowledge_points = []
-
-        # 并发处理多个块
-        tasks = []
-        for chunk_text, chunk_metadata in chunks:
-            task = self.extract_from_chunk(chunk_text, chunk_metadata)
-            tasks.append(task)
+        return [kp async for kp in self.iter_extract(chunks)]
+
+class NgramIndex:
+    """增量字符n-gram倒排索引
+
+    每个条目表示为L2归一化的字符n-gram稀疏向量；查询时只考察与之共享至少一个
+    非高频n-gram的条目。倒排表长度超过 max_postings 的高频n-gram不再参与召回，
+    因此单次插入/查询的开销与索引规模基本无关，内存随条目数线性增长。
+    """
+
+    def __init__(self, ngram_sizes: Tuple[int, ...] = (2,), max_postings: int = 256):
+        self.ngram_sizes = ngram_sizes
+        self.max_postings = max_postings
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._saturated: set = set()
+        self._vectors: Dict[int, Dict[str, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def vectorize(self, text: str) -> Dict[str, float]:
+        """文本 -> 字符n-gram稀疏向量（次线性词频，L2归一化）"""
+        text = re.sub(r'\s+', '', text.lower())
+        counts: Dict[str, int] = defaultdict(int)
+        for n in self.ngram_sizes:
+            if len(text) < n:
+                continue
+            for i in range(len(text) - n + 1):
+                counts[text[i:i + n]] += 1
+        if not counts and text:
+            counts[text] = 1
+
+        vector = {gram: 1.0 + math.log(count) for gram, count in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {gram: w / norm for gram, w in vector.items()} if norm else vector
+
+    def add(self, key: int, text: str):
+        """加入条目；同一key重复加入时合并两次的n-gram"""
+        vector = self.vectorize(text)
+        existing = self._vectors.get(key)
+        if existing is not None:
+            vector = {**existing, **vector}
+        self._vectors[key] = vector
+
+        for gram in vector:
+            if gram in self._saturated or (existing is not None and gram in existing):
+                continue
+            postings = self._postings[gram]
+            postings.append(key)
+            if len(postings) > self.max_postings:
+                self._saturated.add(gram)
+                del self._postings[gram]
+
+    def query(self, text: str, threshold: float) -> List[Tuple[int, float]]:
+        """返回余弦相似度超过阈值的条目 [(key, similarity)]，按相似度降序"""
+        vector = self.vectorize(text)
+        found = set()
+        for gram in vector:
+            postings = self._postings.get(gram)
+            if postings:
+                found.update(postings)
 
-        # 使用进度条
         results = []
-        for f in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="提取知识点"):
-            result = await f
-            results.extend(result)
-
+        for key in found:
+            other = self._vectors[key]
+            if len(other) < len(vector):
+                similarity = sum(w * vector.get(g, 0.0) for g, w in other.items())
+            else:
+                similarity = sum(w * other.get(g, 0.0) for g, w in vector.items())
+            if similarity > threshold:
+                results.append((key, similarity))
+        results.sort(key=lambda item: (-item[1], item[0]))
         return results
 
+
+def is_near_duplicate(text1: str, text2: str, threshold: float) -> bool:
+    """SequenceMatcher相似度是否超过阈值（先用长度上界快速排除）"""
+    total = len(text1) + len(text2)
+    # 相似度上界为 2*min(len)/总长度，长度差距过大时无需逐字比较
+    if total and 2 * min(len(text1), len(text2)) / total <= threshold:
+        return False
+    return SequenceMatcher(None, text1, text2).ratio() > threshold
+
+
+def similar_pairs(matrix, threshold: float, block_size: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """分块稀疏矩阵乘法找出相似度大于阈值的所有行对 (i < j)
+
+    matrix 的各行需已L2归一化（TfidfVectorizer的默认输出），此时点积即余弦相似度。
+    每次只计算 block_size 行与全体的乘积并立即按阈值剪枝，不生成 n×n 稠密矩阵。
+    """
+    matrix = matrix.tocsr()
+    transposed = matrix.T.tocsc()
+    rows, cols = [], []
+    for begin in range(0, matrix.shape[0], block_size):
+        block = (matrix[begin:begin + block_size] @ transposed).tocoo()
+        block_rows = block.row + begin
+        mask = (block.data > threshold) & (block.col > block_rows)
+        rows.append(block_rows[mask])
+        cols.append(block.col[mask])
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+class UnionFind:
+    """并查集（路径压缩 + 按大小合并）"""
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+
+    def groups(self) -> List[List[int]]:
+        """按各组最小成员的顺序返回所有分组（组内升序）"""
+        members: Dict[int, List[int]] = {}
+        for x in range(len(self.parent)):
+            members.setdefault(self.find(x), []).append(x)
+        return sorted(members.values(), key=lambda group: group[0])
+
+
+class MinHashLSH:
+    """基于字符shingle的MinHash签名 + 分段LSH（NumPy向量化）
+
+    shingle为带出现序号的单字（"函#0"、"数#0"、"数#1"……），其Jaccard相似度即
+    字符多重集的Jaccard相似度。SequenceMatcher相似度为 2M/(la+lb)，而匹配字符数
+    M 不超过多重集交集大小，因此 ratio > t 的两段文本 Jaccard 必然不低于
+    t/(2-t)。for_threshold() 据此选择分段方式，使这类文本漏召回的概率不超过
+    max_miss。
+
+    签名批量计算：一批文本的shingle哈希拼接后一次性求值，再用
+    np.minimum.reduceat 按文本分段取最小值；分段桶键同样按批计算。
+    """
+
+    _PRIME = (1 << 31) - 1
+    _BATCH_SIZE = 2048
+
+    def __init__(self, num_perm: int = 128, bands: int = 32, seed: int = 42):
+        if num_perm % bands:
+            raise ValueError("num_perm必须能被bands整除")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, self._PRIME, size=num_perm).astype(np.int64)
+        self._b = rng.randint(0, self._PRIME, size=num_perm).astype(np.int64)
+        # 每段的各行合并为一个桶键
+        self._band_weights = rng.randint(1, self._PRIME, size=self.rows).astype(np.int64)
+        self._buckets: List[Dict[int, List[int]]] = [defaultdict(list) for _ in range(bands)]
+
+    @classmethod
+    def for_threshold(cls, threshold: float, num_perm: int = 128, max_miss: float = 1e-3,
+                      seed: int = 42) -> "MinHashLSH":
+        """按SequenceMatcher阈值选择分段：在漏召回概率不超过max_miss的前提下每段行数尽量多"""
+        min_jaccard = threshold / (2 - threshold)
+        best_rows = 1
+        for rows in range(1, num_perm + 1):
+            if num_perm % rows:
+                continue
+            bands = num_perm // rows
+            if (1 - min_jaccard ** rows) ** bands <= max_miss:
+                best_rows = rows
+        return cls(num_perm=num_perm, bands=num_perm // best_rows, seed=seed)
+
+    def _shingle_hashes(self, text: str) -> List[int]:
+        """带出现序号的单字shingle哈希"""
+        seen: Dict[str, int] = defaultdict(int)
+        hashes = []
+        for ch in text:
+            hashes.append(zlib.crc32(f"{ch}#{seen[ch]}".encode('utf-8')) % self._PRIME)
+            seen[ch] += 1
+        return hashes or [0]
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """批量计算MinHash签名，返回形状为 (len(texts), num_perm) 的数组"""
+        result = np.empty((len(texts), self.num_perm), dtype=np.int64)
+        for begin in range(0, len(texts), self._BATCH_SIZE):
+            hashes = [self._shingle_hashes(text) for text in texts[begin:begin + self._BATCH_SIZE]]
+            offsets = np.zeros(len(hashes), dtype=np.int64)
+            np.cumsum([len(h) for h in hashes[:-1]], out=offsets[1:])
+            flat = np.fromiter((h for group in hashes for h in group), dtype=np.int64)
+
+            permuted = (flat[:, None] * self._a[None, :] + self._b[None, :]) % self._PRIME
+            result[begin:begin + len(hashes)] = np.minimum.reduceat(permuted, offsets, axis=0)
+        return result
+
+    def band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """签名 -> 每段的桶键，形状为 (n, bands)"""
+        signatures = np.atleast_2d(signatures)
+        grouped = signatures.reshape(len(signatures), self.bands, self.rows)
+        return (grouped * self._band_weights).sum(axis=2)
+
+    def insert(self, key: int, band_keys: np.ndarray):
+        for band, bucket_key in enumerate(band_keys.tolist()):
+            self._buckets[band][bucket_key].append(key)
+
+    def query(self, band_keys: np.ndarray) -> set:
+        """至少在一个段上落入同一个桶的所有key"""
+        candidates = set()
+        for band, bucket_key in enumerate(band_keys.tolist()):
+            bucket = self._buckets[band].get(bucket_key)
+            if bucket:
+                candidates.update(bucket)
+        return candidates
+
+
+class NearDuplicateIndex:
+    """近似重复文本索引：MinHash-LSH召回候选，再用SequenceMatcher按原阈值校验
+
+    判定语义与逐一比较一致（相似度 > threshold），只是候选集由LSH给出。
+    批量处理时先用 prepare() 一次性计算所有文本的桶键。
+    """
+
+    def __init__(self, threshold: float, lsh: Optional[MinHashLSH] = None):
+        self.threshold = threshold
+        self.lsh = lsh or MinHashLSH.for_threshold(threshold)
+        self._texts: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def prepare(self, texts: List[str]) -> np.ndarray:
+        """批量计算桶键，返回形状为 (len(texts), bands) 的数组"""
+        if not texts:
+            return np.empty((0, self.lsh.bands), dtype=np.int64)
+        return self.lsh.band_keys(self.lsh.signatures(texts))
+
+    def find(self, text: str, band_keys: Optional[np.ndarray] = None) -> Optional[int]:
+        """返回最早加入的、与text近似重复的条目key，没有则返回None"""
+        if band_keys is None:
+            band_keys = self.prepare([text])[0]
+        for key in sorted(self.lsh.query(band_keys)):
+            if is_near_duplicate(text, self._texts[key], self.threshold):
+                return key
+        return None
+
+    def add(self, text: str, band_keys: Optional[np.ndarray] = None) -> int:
+        """加入条目，返回其key（按加入顺序从0编号）"""
+        if band_keys is None:
+            band_keys = self.prepare([text])[0]
+        key = len(self._texts)
+        self._texts.append(text)
+        self.lsh.insert(key, band_keys)
+        return key
+
+
 class KnowledgePointMerger:
     """知识点合并器"""
 
+    # 句子数不超过该值时直接两两比较，LSH的建索引开销反而更大
+    SMALL_SENTENCE_SET = 16
+
     def __init__(self, quality_level: str = "中等"):
         # 根据质量档位设置不同的相似度阈值和去重策略
         configs = {
@@ -498,6 +2213,105 @@ class KnowledgePointMerger:
         self.title_threshold = config["title_threshold"]
         self.aggressive_merge = config["aggressive_merge"]
         self.quality_level = quality_level
+        self.reset()
+
+    def reset(self):
+        """清空增量合并状态"""
+        self._accepted: List[KnowledgePoint] = []
+        self._sources: List[List[str]] = []
+        self._duplicates: List[List[KnowledgePoint]] = []
+        self._raw_count = 0
+        # 标题索引用于召回标题重复的候选项，内容索引用于相似度合并（仅激进合并时）
+        self._title_index = NearDuplicateIndex(self.title_threshold)
+        self._content_index = NgramIndex(ngram_sizes=(2,))
+
+    def add(self, kp: KnowledgePoint, source: Optional[str] = None) -> Optional[KnowledgePoint]:
+        """增量合并单个知识点
+
+        质量过低时丢弃并返回None；否则作为新知识点接收、分配编号并返回，可立即用于
+        生成题目。只与索引召回的候选项比较，单次插入的开销基本恒定。
+        source（如文档路径）用于跨文档合并时记录知识点的来源，见 sources()。
+
+        与已接收知识点标题重复（或激进合并时内容相似）时返回None，记录为该知识点的
+        重复项（见 duplicates()）和来源。已接收的知识点可能已经用于出题，这里不修改它，
+        重复项的摘要、公式和术语到 finalize() 时才并入结果（编号不变）。与批量的
+        merge_knowledge_points 相比，内容相似只与已接收的知识点比较，不做传递性的聚类。
+        """
+        self._raw_count += 1
+
+        # 先清理标题再计算桶键，索引中的标题与桶键一致
+        optimized = self._optimize_knowledge_points([kp])
+        if not optimized:
+            return None
+        kp = optimized[0]
+
+        title_keys = self._title_index.prepare([kp.title])[0]
+        index = self._title_index.find(kp.title, title_keys)
+        if index is not None:
+            self._add_duplicate(index, kp, source)
+            return None
+
+        content = self._content_text(kp)
+        if self.aggressive_merge:
+            for index, _ in self._content_index.query(content, self.similarity_threshold):
+                if self._are_types_compatible(self._accepted[index].knowledge_type, kp.knowledge_type):
+                    self._add_duplicate(index, kp, source)
+                    return None
+
+        index = self._title_index.add(kp.title, title_keys)
+        kp.id = index + 1
+        self._accepted.append(kp)
+        self._sources.append([])
+        self._duplicates.append([])
+        self._add_source(index, source)
+        if self.aggressive_merge:
+            self._content_index.add(index, content)
+        return kp
+
+    def _add_duplicate(self, index: int, kp: KnowledgePoint, source: Optional[str]):
+        self._duplicates[index].append(kp)
+        self._add_source(index, source)
+
+    def _add_source(self, index: int, source: Optional[str]):
+        if source is not None and source not in self._sources[index]:
+            self._sources[index].append(source)
+
+    def sources(self, kp_id: int) -> List[str]:
+        """已接收知识点的来源（包括被合并进来的重复知识点的来源）"""
+        return list(self._sources[kp_id - 1])
+
+    def duplicates(self, kp_id: int) -> List[KnowledgePoint]:
+        """被判为该知识点重复项的原始知识点（按到达顺序）"""
+        return list(self._duplicates[kp_id - 1])
+
+    def finalize(self) -> List[KnowledgePoint]:
+        """返回增量合并的结果
+
+        各知识点的重复项内容并入其副本后返回：编号不变，已生成的题目仍对应合并后的
+        知识点（内容包含出题时的版本）；已交给出题的原对象不被修改。
+        """
+        merged = []
+        for kp, duplicates in zip(self._accepted, self._duplicates):
+            kp = replace(kp, key_formulas=list(kp.key_formulas), key_terms=list(kp.key_terms))
+            for duplicate in duplicates:
+                self._absorb(kp, duplicate)
+            merged.append(kp)
+
+        duplicate_count = sum(len(duplicates) for duplicates in self._duplicates)
+        print(f"🔄 知识点增量合并完成 (质量档位: {self.quality_level})")
+        print(f"   原始知识点数: {self._raw_count}, 合并后: {len(merged)}, 并入的重复项: {duplicate_count}")
+        return merged
+
+    @staticmethod
+    def _content_text(kp: KnowledgePoint) -> str:
+        """用于内容相似度比较的文本"""
+        return f"{kp.title} {kp.summary} {' '.join(kp.key_terms)}"
+
+    def _absorb(self, existing_kp: KnowledgePoint, kp: KnowledgePoint):
+        """将重复知识点的内容合并到已有知识点"""
+        existing_kp.summary = self._merge_summaries(existing_kp.summary, kp.summary)
+        existing_kp.key_formulas = list(dict.fromkeys(existing_kp.key_formulas + kp.key_formulas))
+        existing_kp.key_terms = list(dict.fromkeys(existing_kp.key_terms + kp.key_terms))
 
     def merge_knowledge_points(self, knowledge_points: List[KnowledgePoint]) -> List[KnowledgePoint]:
         """合并相似的知识点，使用多层去重策略"""
@@ -526,71 +2340,52 @@ class KnowledgePointMerger:
         return optimized_kps
 
     def _deduplicate_by_title(self, kps: List[KnowledgePoint]) -> List[KnowledgePoint]:
-        """基于标题的精确去重"""
-        from difflib import SequenceMatcher
+        """基于标题的精确去重（MinHash-LSH召回候选，SequenceMatcher校验）"""
+        index = NearDuplicateIndex(self.title_threshold)
+        all_band_keys = index.prepare([kp.title for kp in kps])
 
         unique_kps = []
-        for kp in kps:
-            is_duplicate = False
-            for existing_kp in unique_kps:
-                # 计算标题相似度
-                title_sim = SequenceMatcher(None, kp.title, existing_kp.title).ratio()
-                if title_sim > self.title_threshold:
-                    # 合并到现有知识点
-                    existing_kp.summary = self._merge_summaries(existing_kp.summary, kp.summary)
-                    existing_kp.key_formulas = list(set(existing_kp.key_formulas + kp.key_formulas))
-                    existing_kp.key_terms = list(set(existing_kp.key_terms + kp.key_terms))
-                    is_duplicate = True
-                    break
-
-            if not is_duplicate:
+        for kp, band_keys in zip(kps, all_band_keys):
+            match = index.find(kp.title, band_keys)
+            if match is not None:
+                # 合并到现有知识点
+                self._absorb(unique_kps[match], kp)
+            else:
+                index.add(kp.title, band_keys)
                 unique_kps.append(kp)
 
         return unique_kps
 
     def _merge_by_similarity(self, kps: List[KnowledgePoint]) -> List[KnowledgePoint]:
-        """基于内容相似度的合并"""
-        if len(kps) <= 1:
+        """基于内容相似度的合并（稀疏阈值近邻 + 并查集聚类）"""
+        # 只有激进合并模式才会真正合并，其余档位无需计算相似度
+        if len(kps) <= 1 or not self.aggressive_merge:
             return kps
 
         # 构建文本向量
-        texts = [f"{kp.title} {kp.summary} {' '.join(kp.key_terms)}" for kp in kps]
+        texts = [self._content_text(kp) for kp in kps]
 
         try:
             vectorizer = TfidfVectorizer(max_features=200, stop_words=None)
             tfidf_matrix = vectorizer.fit_transform(texts)
-            similarity_matrix = cosine_similarity(tfidf_matrix)
-        except:
-            # 如果向量化失败，返回原始列表
+        except ValueError:
+            # 如果向量化失败（如词表为空），返回原始列表
             return kps
 
-        # 标记已合并的知识点
-        merged = [False] * len(kps)
-        merged_kps = []
+        rows, cols = similar_pairs(tfidf_matrix, self.similarity_threshold)
 
-        for i in range(len(kps)):
-            if merged[i]:
-                continue
+        clusters = UnionFind(len(kps))
+        for i, j in zip(rows.tolist(), cols.tolist()):
+            # 额外检查：确保知识点类型相同或相关
+            if self._are_types_compatible(kps[i].knowledge_type, kps[j].knowledge_type):
+                clusters.union(i, j)
 
-            # 找到相似的知识点
-            similar_indices = []
-            for j in range(i + 1, len(kps)):
-                if not merged[j] and similarity_matrix[i][j] > self.similarity_threshold:
-                    # 额外检查：确保知识点类型相同或相关
-                    if self._are_types_compatible(kps[i].knowledge_type, kps[j].knowledge_type):
-                        similar_indices.append(j)
-
-            # 合并知识点
-            if similar_indices and self.aggressive_merge:
-                merged_kp = self._merge_multiple([kps[i]] + [kps[j] for j in similar_indices])
-                merged_kps.append(merged_kp)
-                merged[i] = True
-                for j in similar_indices:
-                    merged[j] = True
+        merged_kps = []
+        for group in clusters.groups():
+            if len(group) == 1:
+                merged_kps.append(kps[group[0]])
             else:
-                merged_kps.append(kps[i])
-                merged[i] = True
-
+                merged_kps.append(self._merge_multiple([kps[i] for i in group]))
         return merged_kps
 
     def _are_types_compatible(self, type1: str, type2: str) -> bool:
@@ -622,10 +2417,18 @@ class KnowledgePointMerger:
         unique_sentences = []
         all_sentences = sentences1 + sentences2
 
-        for sentence in all_sentences:
-            if sentence and not any(self._sentence_similarity(sentence, existing) > 0.8
-                                  for existing in unique_sentences):
-                unique_sentences.append(sentence)
+        if len(all_sentences) <= self.SMALL_SENTENCE_SET:
+            for sentence in all_sentences:
+                if sentence and not any(self._sentence_similarity(sentence, existing) > 0.8
+                                      for existing in unique_sentences):
+                    unique_sentences.append(sentence)
+        else:
+            # 句子较多时用LSH召回候选，避免两两比较
+            index = NearDuplicateIndex(0.8)
+            for sentence, band_keys in zip(all_sentences, index.prepare(all_sentences)):
+                if index.find(sentence, band_keys) is None:
+                    index.add(sentence, band_keys)
+                    unique_sentences.append(sentence)
 
         # 限制长度，优先保留更有信息量的句子
         if len(unique_sentences) > 5:
@@ -635,7 +2438,6 @@ class KnowledgePointMerger:
 
     def _sentence_similarity(self, sent1: str, sent2: str) -> float:
         """计算两个句子的相似度"""
-        from difflib import SequenceMatcher
         return SequenceMatcher(None, sent1, sent2).ratio()
 
     def _optimize_knowledge_points(self, kps: List[KnowledgePoint]) -> List[KnowledgePoint]:
@@ -688,104 +2490,211 @@ class KnowledgePointMerger:
             knowledge_type=kps[0].knowledge_type  # 使用第一个的类型
         )
 
+class InlineMerger:
+    """在当前进程中运行的增量合并器，接口与 MergerProcess 相同"""
+
+    def __init__(self, merger: KnowledgePointMerger):
+        self.merger = merger
+        merger.reset()
+
+    async def add(self, kp: KnowledgePoint, source: Optional[str] = None) -> Optional[KnowledgePoint]:
+        return self.merger.add(kp, source=source)
+
+    async def finalize(self) -> List[KnowledgePoint]:
+        return self.merger.finalize()
+
+    def sources(self, kp_id: int) -> List[str]:
+        return self.merger.sources(kp_id)
+
+    def duplicates(self, kp_id: int) -> List[KnowledgePoint]:
+        return self.merger.duplicates(kp_id)
+
+    def close(self):
+        pass
+
+
+class MergerProcess:
+    """在独立子进程中运行的增量合并器
+
+    合并器的索引和已接收的知识点都留在子进程中，每次只传递一个知识点的字典，
+    相似度计算既不阻塞事件循环，也不与Web线程争用GIL。
+    """
+
+    def __init__(self, quality_level: str):
+        self._executor = ProcessPoolExecutor(max_workers=1, mp_context=_process_context(),
+                                             initializer=_merger_process_init, initargs=(quality_level,))
+        self._sources: Dict[int, List[str]] = {}
+        self._duplicates: Dict[int, List[KnowledgePoint]] = {}
+
+    async def _call(self, func: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def add(self, kp: KnowledgePoint, source: Optional[str] = None) -> Optional[KnowledgePoint]:
+        accepted = await self._call(_merger_process_add, asdict(kp), source)
+        return KnowledgePoint(**accepted) if accepted is not None else None
+
+    async def finalize(self) -> List[KnowledgePoint]:
+        kp_dicts, sources, duplicates = await self._call(_merger_process_finalize)
+        knowledge_points = [KnowledgePoint(**data) for data in kp_dicts]
+        self._sources = {kp.id: kp_sources for kp, kp_sources in zip(knowledge_points, sources)}
+        self._duplicates = {kp.id: [KnowledgePoint(**data) for data in kp_duplicates]
+                            for kp, kp_duplicates in zip(knowledge_points, duplicates)}
+        return knowledge_points
+
+    def sources(self, kp_id: int) -> List[str]:
+        return list(self._sources.get(kp_id, []))
+
+    def duplicates(self, kp_id: int) -> List[KnowledgePoint]:
+        return list(self._duplicates.get(kp_id, []))
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
 class QuestionGenerator:
     """增强版题目生成器"""
 
     def __init__(self, llm_client: LLMClient, quality_level: str = "中等"):
         self.llm_client = llm_client
+        self.progress = ProgressReporter()
         self.quality_level = quality_level
 
-        # 根据质量档位配置题目生成策略
+        # 根据质量档位配置题目生成策略（batch_size：每次请求生成的基础题/高难度题数量）
         self.question_configs = {
-            "简约": {"basic_per_kp": 1, "fusion_ratio": 0.1, "advanced_ratio": 0.1},
-            "中等": {"basic_per_kp": 1, "fusion_ratio": 0.2, "advanced_ratio": 0.2},
-            "较细致": {"basic_per_kp": 1, "fusion_ratio": 0.3, "advanced_ratio": 0.3},
-            "细致": {"basic_per_kp": 1, "fusion_ratio": 0.4, "advanced_ratio": 0.4},
-            "精细": {"basic_per_kp": 1, "fusion_ratio": 0.5, "advanced_ratio": 0.5}
+            "简约": {"basic_per_kp": 1, "fusion_ratio": 0.1, "advanced_ratio": 0.1, "batch_size": 10},
+            "中等": {"basic_per_kp": 1, "fusion_ratio": 0.2, "advanced_ratio": 0.2, "batch_size": 8},
+            "较细致": {"basic_per_kp": 1, "fusion_ratio": 0.3, "advanced_ratio": 0.3, "batch_size": 6},
+            "细致": {"basic_per_kp": 1, "fusion_ratio": 0.4, "advanced_ratio": 0.4, "batch_size": 5},
+            "精细": {"basic_per_kp": 1, "fusion_ratio": 0.5, "advanced_ratio": 0.5, "batch_size": 4}
         }
+        # 覆盖档位默认的批量大小；1表示每道题单独请求
+        self.batch_size: Optional[int] = None
+        # 知识点逐个到达时，未凑满的一批最多等待的秒数（超时后按已有的知识点发出请求）
+        self.batch_delay = 1.0
+        # 设置后，内容未变的知识点直接复用之前生成的基础题和高难度题（融合题总是重新生成）
+        self.fingerprints: Optional[FingerprintStore] = None
 
-        self.basic_question_template = """请严格根据以下提供的单一知识点摘要，生成一道高质量四选项单项选择题。
-
-知识点信息:
-- 标题: {title}
-- 难度: {difficulty_level}
-- 类型: {knowledge_type}
-- 核心摘要: {summary}
-{formulas_text}
+        # 固定的指令和输出格式作为system消息（各次请求完全相同，可命中提供方的前缀缓存），
+        # 知识点、题型、难度等可变内容放在用户消息中
+        self.basic_question_system = """你是一名出题专家。请严格根据用户提供的单一知识点摘要，生成一道高质量四选项单项选择题。
 
 题目要求:
-1. 题目要准确测试对该知识点的{test_focus}
+1. 题目要准确测试对该知识点的理解，测试重点见知识点信息中的说明
 2. 正确答案必须完全基于摘要内容
 3. 三个错误选项要有迷惑性但明显错误
-4. 题目难度为: {target_difficulty}
+4. 题目难度按知识点信息中给出的目标难度（easy/medium/hard）
 5. 如果涉及公式，使用LaTeX格式 $formula$
 6. **重要：正确答案随机分布在A、B、C、D中**
 
 输出格式（严格JSON）:
 ```json
-{{
+{
   "question": "题目内容",
-  "options": {{
+  "options": {
     "A": "选项A内容",
     "B": "选项B内容",
     "C": "选项C内容",
     "D": "选项D内容"
-  }},
+  },
   "correct_answer": "A/B/C/D",
   "explanation": "答案解释",
-  "difficulty": "{target_difficulty}",
+  "difficulty": "目标难度",
   "question_type": "基础理解"
-}}
+}
 ```"""
 
-        self.fusion_question_template = """请根据以下多个相关知识点，生成一道融合性四选项单项选择题，要求综合运用多个知识点。
+        self.basic_question_template = """知识点信息:
+- 标题: {title}
+- 难度: {difficulty_level}
+- 类型: {knowledge_type}
+- 核心摘要: {summary}
+{formulas_text}- 测试重点: {test_focus}
+- 目标难度: {target_difficulty}"""
 
-相关知识点:
-{knowledge_points_info}
+        self.fusion_question_system = """你是一名出题专家。请根据用户提供的多个相关知识点，生成一道融合性四选项单项选择题，要求综合运用多个知识点。
 
 题目要求:
-1. 题目需要综合运用上述多个知识点才能正确回答
-2. 题型为: {question_type}
-3. 难度等级: {target_difficulty}
-4. 三个错误选项要基于部分知识点但结论错误
-5. 正确答案随机分布在A、B、C、D中
+1. 题目需要综合运用所给的多个知识点才能正确回答
+2. 题型和难度等级按用户消息中的要求
+3. 三个错误选项要基于部分知识点但结论错误
+4. 正确答案随机分布在A、B、C、D中
 
 输出格式（严格JSON）:
 ```json
-{{
+{
   "question": "题目内容",
-  "options": {{
+  "options": {
     "A": "选项A内容",
     "B": "选项B内容",
     "C": "选项C内容",
     "D": "选项D内容"
-  }},
+  },
   "correct_answer": "A/B/C/D",
   "explanation": "综合解释，说明涉及的多个知识点",
-  "difficulty": "{target_difficulty}",
-  "question_type": "{question_type}",
-  "related_knowledge_points": {related_kp_ids}
-}}
+  "difficulty": "难度等级",
+  "question_type": "题型",
+  "related_knowledge_points": [相关知识点ID列表]
+}
 ```"""
 
+        self.fusion_question_template = """相关知识点:
+{knowledge_points_info}
+
+题型: {question_type}
+难度等级: {target_difficulty}
+相关知识点ID: {related_kp_ids}"""
+
+        self.batch_question_system = """你是一名出题专家。请严格根据用户提供的多个知识点摘要，为每个知识点各生成一道高质量四选项单项选择题。
+
+题目要求:
+1. 每道题只测试对应的单一知识点，测试重点和题目难度见该知识点的说明
+2. 正确答案必须完全基于该知识点的摘要内容
+3. 三个错误选项要有迷惑性但明显错误
+4. 如果涉及公式，使用LaTeX格式 $formula$
+5. **重要：正确答案随机分布在A、B、C、D中**
+6. 每个知识点恰好一道题，kp_index 填写知识点编号
+
+输出格式（严格JSON）:
+```json
+{
+  "questions": [
+    {
+      "kp_index": 1,
+      "question": "题目内容",
+      "options": {
+        "A": "选项A内容",
+        "B": "选项B内容",
+        "C": "选项C内容",
+        "D": "选项D内容"
+      },
+      "correct_answer": "A/B/C/D",
+      "explanation": "答案解释",
+      "difficulty": "easy/medium/hard",
+      "question_type": "基础理解"
+    }
+  ]
+}
+```"""
+
+        self.batch_question_template = """共{count}个知识点:
+{knowledge_points_info}"""
+
+    # 根据知识点类型确定测试重点
+    TEST_FOCUS_MAP = {
+        "概念定义": "概念理解和定义记忆",
+        "原理方法": "原理理解和方法应用",
+        "公式计算": "公式理解和计算能力",
+        "实例应用": "实际应用和案例分析",
+        "注意事项": "注意事项和限制条件的理解"
+    }
+
     async def generate_basic_question(self, kp: KnowledgePoint, question_id: int, target_difficulty: str = "medium") -> Optional[Question]:
         """为单个知识点生成基础题目"""
-        import random
-
-        # 根据知识点类型确定测试重点
-        test_focus_map = {
-            "概念定义": "概念理解和定义记忆",
-            "原理方法": "原理理解和方法应用",
-            "公式计算": "公式理解和计算能力",
-            "实例应用": "实际应用和案例分析",
-            "注意事项": "注意事项和限制条件的理解"
-        }
-
-        test_focus = test_focus_map.get(kp.knowledge_type, "核心理解")
+        test_focus = self.TEST_FOCUS_MAP.get(kp.knowledge_type, "核心理解")
 
         formulas_text = ""
         if kp.key_formulas:
-            formulas_text = f"相关公式: {', '.join(kp.key_formulas)}"
+            formulas_text = f"- 相关公式: {', '.join(kp.key_formulas)}\n"
 
         prompt = self.basic_question_template.format(
             title=kp.title,
@@ -797,9 +2706,107 @@ class QuestionGenerator:
             target_difficulty=target_difficulty
         )
 
-        response = await self.llm_client.call_api(prompt)
+        try:
+            response = await self.llm_client.call_api(prompt, system=self.basic_question_system)
+        except LLMAPIError as e:
+            print(f"生成题目 {question_id} 失败: {e}")
+            return None
         return self._parse_question_response(response, question_id, kp.id)
 
+    async def generate_basic_batch(self, items: List[Tuple[KnowledgePoint, int, str]]) -> List[Question]:
+        """一次请求为多个知识点各生成一道基础题
+
+        items 为 (知识点, 题目ID, 目标难度)。返回的题目逐个解析，格式错误或缺失的条目
+        单独重新请求，不会因为一道题出错丢失整批。
+        """
+        if len(items) == 1:
+            question = await self.generate_basic_question(*items[0])
+            return [question] if question else []
+
+        kp_info_list = []
+        for i, (kp, _, target_difficulty) in enumerate(items, 1):
+            kp_info = (f"[{i}] 标题: {kp.title}\n"
+                       f"    难度: {kp.difficulty_level}  类型: {kp.knowledge_type}\n"
+                       f"    核心摘要: {kp.summary}\n")
+            if kp.key_formulas:
+                kp_info += f"    相关公式: {', '.join(kp.key_formulas)}\n"
+            kp_info += (f"    测试重点: {self.TEST_FOCUS_MAP.get(kp.knowledge_type, '核心理解')}"
+                        f"  题目难度: {target_difficulty}")
+            kp_info_list.append(kp_info)
+
+        prompt = self.batch_question_template.format(
+            count=len(items),
+            knowledge_points_info="\n".join(kp_info_list)
+        )
+
+        try:
+            response = await self.llm_client.call_api(prompt, max_tokens=500 * len(items) + 500,
+                                                      system=self.batch_question_system)
+        except LLMAPIError as e:
+            print(f"批量生成题目 {items[0][1]}-{items[-1][1]} 失败: {e}")
+            return []
+
+        questions: Dict[int, Question] = {}
+        for position, data in enumerate(self._parse_question_items(response)):
+            try:
+                index = int(data.get('kp_index', position + 1)) - 1
+            except (TypeError, ValueError):
+                index = position
+            if not 0 <= index < len(items) or index in questions:
+                continue
+            kp, question_id, target_difficulty = items[index]
+            data.setdefault('difficulty', target_difficulty)
+            question = self._build_question(data, question_id, kp.id)
+            if question:
+                questions[index] = question
+
+        missing = [item for i, item in enumerate(items) if i not in questions]
+        if missing:
+            print(f"⚠️ 批量生成缺少 {len(missing)}/{len(items)} 道题，单独重新生成")
+            retried = await asyncio.gather(*(self.generate_basic_question(*item) for item in missing))
+            questions.update((items.index(item), q) for item, q in zip(missing, retried) if q)
+
+        return [questions[i] for i in sorted(questions)]
+
+    async def _generate_basic_items(self, items: List[Tuple[KnowledgePoint, int, str]],
+                                    keys: List[str]) -> List[Question]:
+        """生成一批基础题：先按知识点指纹复用已有题目，其余请求生成后保存"""
+        if self.fingerprints is None:
+            return await self.generate_basic_batch(items)
+
+        cached = await asyncio.to_thread(self.fingerprints.get_many, "question", keys)
+        questions = []
+        missing: List[Tuple[KnowledgePoint, int, str]] = []
+        missing_keys: Dict[int, str] = {}
+        for (kp, question_id, target_difficulty), key in zip(items, keys):
+            data = cached.get(key)
+            if data is None:
+                missing.append((kp, question_id, target_difficulty))
+                missing_keys[question_id] = key
+                continue
+            questions.append(Question(id=question_id, knowledge_point_id=kp.id, **data))
+        if questions:
+            self.progress.count("reused_questions", len(questions))
+
+        if missing:
+            generated = await self.generate_basic_batch(missing)
+            await asyncio.to_thread(self.fingerprints.set_many, "question", [
+                (missing_keys[q.id], {field: value for field, value in asdict(q).items()
+                                      if field not in ("id", "knowledge_point_id", "related_knowledge_points")})
+                for q in generated
+            ])
+            questions.extend(generated)
+        return questions
+
+    def _parse_question_items(self, response: str) -> List[Dict[str, Any]]:
+        """逐个解析批量响应中的题目对象：{"questions": [...]}，也兼容直接返回的数组"""
+        for depth in (2, 1):
+            parser = IncrementalJSONParser(item_depth=depth, loads=self._loads_question_json)
+            items = [item for item in parser.feed(response) if isinstance(item, dict) and 'question' in item]
+            if items:
+                return items
+        return []
+
     async def generate_fusion_question(self, kps: List[KnowledgePoint], question_id: int, question_type: str) -> Optional[Question]:
         """生成融合多个知识点的题目"""
 
@@ -824,7 +2831,11 @@ class QuestionGenerator:
             related_kp_ids=related_kp_ids
         )
 
-        response = await self.llm_client.call_api(prompt)
+        try:
+            response = await self.llm_client.call_api(prompt, system=self.fusion_question_system)
+        except LLMAPIError as e:
+            print(f"生成融合题目 {question_id} 失败: {e}")
+            return None
         question = self._parse_question_response(response, question_id, kps[0].id)
 
         if question:
@@ -832,9 +2843,19 @@ class QuestionGenerator:
 
         return question
 
+    @staticmethod
+    def _loads_question_json(json_str: str) -> Dict[str, Any]:
+        """清理控制字符和LaTeX反斜杠后解析题目JSON"""
+        json_str = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', json_str)
+
+        json_str = json_str.replace('\b', '').replace('\f', '').replace('\v', '')
+
+        json_str = json_str.replace('\\', '\\\\').replace('\\"', '"')
+
+        return json.loads(json_str)
+
     def _parse_question_response(self, response: str, question_id: int, kp_id: int) -> Optional[Question]:
         """解析题目生成响应"""
-        import random
         try:
             # 提取JSON内容
             json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
@@ -843,14 +2864,16 @@ class QuestionGenerator:
             else:
                 json_str = response
 
-            json_str = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', json_str)
-
-            json_str = json_str.replace('\b', '').replace('\f', '').replace('\v', '')
-
-            json_str = json_str.replace('\\', '\\\\').replace('\\"', '"')
+            data = self._loads_question_json(json_str)
+        except Exception as e:
+            print(f"生成题目时出错: {e}")
+            return None
 
-            data = json.loads(json_str)
+        return self._build_question(data, question_id, kp_id)
 
+    def _build_question(self, data: Dict[str, Any], question_id: int, kp_id: int) -> Optional[Question]:
+        """由解析后的题目字典构建题目，并随机化答案位置"""
+        try:
             # 随机化答案位置
             options = data['options']
             correct_answer = data['correct_answer']
@@ -887,74 +2910,151 @@ class QuestionGenerator:
             print(f"生成题目时出错: {e}")
             return None
 
-    async def generate_all(self, knowledge_points: List[KnowledgePoint]) -> List[Question]:
-        """为所有知识点生成完整的题目集"""
-        config = self.question_configs.get(self.quality_level, self.question_configs["中等"])
-        questions = []
-        question_id = 1
-
-        print(f"📊 题目生成策略 - 基础题:{config['basic_per_kp']}题/知识点, 融合题比例:{config['fusion_ratio']:.0%}, 高难度比例:{config['advanced_ratio']:.0%}")
-
-        # 1. 为每个知识点生成基础题目
-        basic_tasks = []
-        for kp in knowledge_points:
-            for _ in range(config['basic_per_kp']):
-                difficulty = "hard" if kp.difficulty_level == "高级" else "medium" if kp.difficulty_level == "进阶" else "easy"
-                task = self.generate_basic_question(kp, question_id, difficulty)
-                basic_tasks.append(task)
-                question_id += 1
-
-        # 生成基础题目
-        for f in tqdm(asyncio.as_completed(basic_tasks), total=len(basic_tasks), desc="生成基础题目"):
-            question = await f
-            if question:
-                questions.append(question)
-
-        # 2. 生成融合题目
-        fusion_count = int(len(knowledge_points) * config['fusion_ratio'])
-        fusion_types = [
-            "因果推理型", "综合关联型", "最优方案型", "情景应用题",
-            "对比分析型", "综合判断型", "系统分析型"
-        ]
-
-        fusion_tasks = []
-        for _ in range(fusion_count):
-            # 随机选择2-4个相关知识点
-            import random
-            selected_kps = random.sample(knowledge_points, min(random.randint(2, 4), len(knowledge_points)))
-            question_type = random.choice(fusion_types)
+    @staticmethod
+    def _basic_difficulty(kp: KnowledgePoint) -> str:
+        """根据知识点难度确定基础题难度"""
+        return "hard" if kp.difficulty_level == "高级" else "medium" if kp.difficulty_level == "进阶" else "easy"
 
-            task = self.generate_fusion_question(selected_kps, question_id, question_type)
-            fusion_tasks.append(task)
-            question_id += 1
+    async def iter_generate(self, knowledge_points: Union[Iterable[KnowledgePoint], AsyncIterator[KnowledgePoint]]) -> AsyncIterator[Question]:
+        """为知识点生成题目，按完成顺序逐道产出
 
-        # 生成融合题目
-        for f in tqdm(asyncio.as_completed(fusion_tasks), total=len(fusion_tasks), desc="生成融合题目"):
-            question = await f
-            if question:
-                questions.append(question)
+        knowledge_points 可以是列表，也可以是异步迭代器：每到达一个知识点就立即
+        开始生成它的基础题；知识点全部到达后再安排融合题和高难度题，三类题目
+        之间没有互相等待的屏障。
+        """
+        config = self.question_configs.get(self.quality_level, self.question_configs["中等"])
+        print(f"📊 题目生成策略 - 基础题:{config['basic_per_kp']}题/知识点, 融合题比例:{config['fusion_ratio']:.0%}, 高难度比例:{config['advanced_ratio']:.0%}, 每批:{self.batch_size or config['batch_size']}题")
+
+        finished: asyncio.Queue = asyncio.Queue()
+        tasks: List[asyncio.Future] = []
+        kps: List[KnowledgePoint] = []
+        next_question_id = 1
+        kinds: Dict[asyncio.Future, Tuple[str, int]] = {}
+        batch_size = max(1, self.batch_size or config['batch_size'])
+        batch: List[Tuple[KnowledgePoint, int, str]] = []
+        batch_keys: List[str] = []
+        # 同一知识点的第几道同类题，作为复用键的一部分，避免重复选中时复用成同一道题
+        occurrences: Dict[Tuple[str, str], int] = defaultdict(int)
+        prompt_version = content_fingerprint(self.basic_question_system, self.batch_question_system)[:16]
+        loop = asyncio.get_running_loop()
+        batch_timer: Optional[asyncio.TimerHandle] = None
+        self.progress.start("generate", desc="生成题目")
+
+        def schedule(coro, kind: str, count: int = 1):
+            task = asyncio.ensure_future(coro)
+            task.add_done_callback(finished.put_nowait)
+            tasks.append(task)
+            kinds[task] = (kind, count)
+            self.progress.add_total("generate", count)
+
+        def take_question_id() -> int:
+            nonlocal next_question_id
+            next_question_id += 1
+            return next_question_id - 1
+
+        def flush_batch(kind: str):
+            nonlocal batch_timer
+            if batch_timer is not None:
+                batch_timer.cancel()
+                batch_timer = None
+            if batch:
+                schedule(self._generate_basic_items(list(batch), list(batch_keys)), kind, len(batch))
+                batch.clear()
+                batch_keys.clear()
+
+        def schedule_basic(kp: KnowledgePoint, target_difficulty: str, kind: str):
+            # 基础题和高难度题凑满一批再请求；batch_size为1时逐题请求。知识点逐个到达时，
+            # 批中第一道题等待 batch_delay 秒后不论是否凑满都发出请求
+            nonlocal batch_timer
+            batch.append((kp, take_question_id(), target_difficulty))
+            if self.fingerprints is not None:
+                kp_fingerprint = knowledge_point_fingerprint(kp)
+                occurrence = occurrences[(kp_fingerprint, kind)]
+                occurrences[(kp_fingerprint, kind)] += 1
+                batch_keys.append(f"{prompt_version}:{kp_fingerprint}:{kind}:{target_difficulty}:{occurrence}")
+            if len(batch) >= batch_size:
+                flush_batch(kind)
+            elif batch_timer is None and self.batch_delay is not None:
+                batch_timer = loop.call_later(self.batch_delay, flush_batch, kind)
+
+        async def feed():
+            # 1. 每到达一个知识点就生成基础题目
+            if hasattr(knowledge_points, '__aiter__'):
+                async for kp in knowledge_points:
+                    kps.append(kp)
+                    for _ in range(config['basic_per_kp']):
+                        schedule_basic(kp, self._basic_difficulty(kp), "basic")
+            else:
+                for kp in knowledge_points:
+                    kps.append(kp)
+                    for _ in range(config['basic_per_kp']):
+                        schedule_basic(kp, self._basic_difficulty(kp), "basic")
+            flush_batch("basic")
+
+            if not kps:
+                return
+
+            # 2. 融合题目：随机选择2-4个相关知识点
+            fusion_count = int(len(kps) * config['fusion_ratio'])
+            fusion_types = [
+                "因果推理型", "综合关联型", "最优方案型", "情景应用题",
+                "对比分析型", "综合判断型", "系统分析型"
+            ]
+            for _ in range(fusion_count):
+                selected_kps = random.sample(kps, min(random.randint(2, 4), len(kps)))
+                question_type = random.choice(fusion_types)
+                schedule(self.generate_fusion_question(selected_kps, take_question_id(), question_type), "fusion")
+
+            # 3. 额外的高难度题目，优先选择难度较高的知识点
+            advanced_count = int(len(kps) * config['advanced_ratio'])
+            advanced_kps = [kp for kp in kps if kp.difficulty_level in ["进阶", "高级"]] or kps
+            for _ in range(advanced_count):
+                kp = random.choice(advanced_kps)
+                schedule_basic(kp, "hard", "advanced")
+            flush_batch("advanced")
+
+        feeder = asyncio.ensure_future(feed())
+        feeder.add_done_callback(finished.put_nowait)
+        feeder_done = False
+        completed = 0
 
-        # 3. 生成额外的高难度题目
-        advanced_count = int(len(knowledge_points) * config['advanced_ratio'])
-        advanced_tasks = []
-
-        # 选择难度较高的知识点
-        advanced_kps = [kp for kp in knowledge_points if kp.difficulty_level in ["进阶", "高级"]]
-        if not advanced_kps:
-            advanced_kps = knowledge_points  # 如果没有高难度知识点，使用所有知识点
-
-        for _ in range(advanced_count):
-            import random
-            kp = random.choice(advanced_kps)
-            task = self.generate_basic_question(kp, question_id, "hard")
-            advanced_tasks.append(task)
-            question_id += 1
-
-        # 生成高难度题目
-        for f in tqdm(asyncio.as_completed(advanced_tasks), total=len(advanced_tasks), desc="生成高难度题目"):
-            question = await f
-            if question:
-                questions.append(question)
+        try:
+            while not feeder_done or completed < len(tasks):
+                task = await finished.get()
+                if task is feeder:
+                    feeder_done = True
+                    task.result()
+                    continue
+
+                completed += 1
+                kind, count = kinds[task]
+                self.progress.advance("generate", count)
+                if task.cancelled():
+                    continue
+                if task.exception() is not None:
+                    print(f"生成题目时出错: {task.exception()}")
+                    continue
+                result = task.result()
+                for question in (result if isinstance(result, list) else [result]):
+                    if question:
+                        self.progress.count(f"{kind}_questions")
+                        yield question
+        finally:
+            if batch_timer is not None:
+                batch_timer.cancel()
+            self.progress.finish("generate")
+            feeder.cancel()
+            for task in tasks:
+                task.cancel()
+
+    async def generate_all(self, knowledge_points: List[KnowledgePoint],
+                           on_question: Optional[Callable[[Question], Any]] = None) -> List[Question]:
+        """为所有知识点生成完整的题目集；on_question 在每道题生成后立即被调用"""
+        questions = []
+        async for question in self.iter_generate(knowledge_points):
+            questions.append(question)
+            if on_question is not None:
+                on_question(question)
 
         # 按ID排序
         questions.sort(key=lambda q: q.id)
@@ -963,65 +3063,199 @@ class QuestionGenerator:
 class NoteToQuizGenerator:
     """笔记生题器主类"""
 
-    def __init__(self, api_key: str, quality_level: str = "中等"):
-        self.llm_client = LLMClient(api_key)
+    def __init__(self, api_key: str, quality_level: str = "中等", llm_client: Optional[LLMClient] = None):
+        # 外部传入的客户端可能被多个生成器共享，由创建者负责关闭
+        self.owns_client = llm_client is None
+        self.llm_client = llm_client or LLMClient(api_key)
         self.chunker = TextChunker(quality_level)
         self.extractor = KnowledgeExtractor(self.llm_client, quality_level)
         self.merger = KnowledgePointMerger(quality_level)
         self.generator = QuestionGenerator(self.llm_client, quality_level)
+        self.pipeline_queue_size = 64
+        self.pdf_workers: Optional[int] = None
+        # CPU密集阶段（解析）的进程数（None表示按CPU核数自动选择，1表示在当前进程中执行）
+        self.cpu_workers: Optional[int] = None
+        # 在独立子进程中增量合并知识点（见 open_merger）
+        self.merge_in_process = False
+        self.set_progress(ProgressReporter())
+        # 最近一次 process_document 期间的API用量（客户端被多个任务共享时包含其他任务的请求）
+        self.last_usage: Optional[Dict[str, Any]] = None
+
+    async def __aenter__(self) -> "NoteToQuizGenerator":
+        return self
+
+    @property
+    def cpu_executor(self) -> Optional[ProcessPoolExecutor]:
+        """CPU密集阶段使用的共享进程池，进程数不超过1时为None"""
+        return get_cpu_executor(self.cpu_workers)
+
+    def open_merger(self) -> Union[InlineMerger, MergerProcess]:
+        """本次运行使用的增量合并器
+
+        默认在当前进程中合并：有索引召回候选，单个知识点的合并只需零点几毫秒，
+        而子进程每次运行都要启动、每个知识点都要序列化往返一次，常见规模的文档
+        反而更慢（见 benchmarks/bench_merger.py）。merge_in_process 为True且有多个
+        CPU进程可用时才在独立进程中合并。
+        """
+        if self.merge_in_process and resolve_cpu_workers(self.cpu_workers) > 1:
+            return MergerProcess(self.merger.quality_level)
+        return InlineMerger(self.merger)
 
-    async def process_document(self, file_path: str) -> Tuple[List[KnowledgePoint], List[Question]]:
-        """处理文档并生成题目"""
-        print("📄 正在解析文档...")
-        text = DocumentParser.parse_document(file_path)
+    async def iter_chunks(self, file_path: str) -> AsyncIterator[Tuple[str, Dict]]:
+        """逐块产出文档分块，不阻塞事件循环
 
-        print("✂️ 正在分块处理...")
-        chunks = self.chunker.chunk_text(text)
-        print(f"文档被分成 {len(chunks)} 个块")
+        有CPU进程池时，PDF各页由进程池并行提取、线程中只做分块，其他格式整篇在进程池中
+        解析并分块；否则在线程中解析（PDF页仍按 pdf_workers 并行提取）。
+        """
+        executor = self.cpu_executor
+        if executor is not None and not file_path.lower().endswith('.pdf'):
+            loop = asyncio.get_running_loop()
+            for chunk in await loop.run_in_executor(executor, _chunk_document, file_path,
+                                                    *self.chunker.worker_args()):
+                yield chunk
+            return
+
+        segments = DocumentParser.iter_document(file_path, pdf_workers=self.pdf_workers, executor=executor)
+        chunks = self.chunker.chunk_stream(segments)
+        finished = object()
+        try:
+            while (chunk := await asyncio.to_thread(next, chunks, finished)) is not finished:
+                yield chunk
+        finally:
+            try:
+                chunks.close()
+            except ValueError:
+                # 取消时生成器可能仍在线程中执行，交给垃圾回收关闭
+                pass
+
+    def set_progress(self, progress: ProgressReporter):
+        """让提取、合并、出题各阶段共用同一个进度汇报器"""
+        self.progress = progress
+        self.extractor.progress = progress
+        self.generator.progress = progress
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """释放自己创建的LLM客户端持有的连接池"""
+        if self.owns_client:
+            await self.llm_client.aclose()
+
+    async def process_document(self, file_path: str,
+                               on_question: Optional[Callable[[Question], Any]] = None
+                               ) -> Tuple[List[KnowledgePoint], List[Question]]:
+        """处理文档并生成题目
+
+        提取、合并、出题三个阶段以流水线方式运行：知识点一被提取出来就进入增量
+        合并器，新知识点一被接收就开始生成题目，阶段之间用有界队列衔接。
+        on_question 在每道题生成后立即被调用（如逐题保存，供用户提前开始答题）。
+        """
+        print("📄 正在解析文档并分块...")
+        usage_before = self.llm_client.usage.snapshot()
+        chunk_count = 0
+        chunk_tokens = 0
+
+        async def document_chunks():
+            # 边解析边分块：第一块凑满就开始提取，后面的页仍在解析
+            nonlocal chunk_count, chunk_tokens
+            async for chunk in self.iter_chunks(file_path):
+                chunk_count += 1
+                chunk_tokens += chunk[1].get("token_count", 0)
+                yield chunk
+
+        print("🚀 正在流水线提取知识点、合并并生成题目...")
+        raw_queue: asyncio.Queue = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        kp_queue: asyncio.Queue = asyncio.Queue(maxsize=self.pipeline_queue_size)
+
+        async def extract_stage():
+            try:
+                async for kp in self.extractor.iter_extract(document_chunks()):
+                    await raw_queue.put(kp)
+            except Exception:
+                await raw_queue.put(None)
+                raise
+            await raw_queue.put(None)
 
-        print("🔍 正在提取知识点...")
-        raw_knowledge_points = await self.extractor.extract_all(chunks)
-        print(f"提取到 {len(raw_knowledge_points)} 个原始知识点")
+        merger = self.open_merger()
 
-        print("🔗 正在合并相似知识点...")
-        merged_knowledge_points = self.merger.merge_knowledge_points(raw_knowledge_points)
-        print(f"合并后剩余 {len(merged_knowledge_points)} 个知识点")
+        async def merge_stage():
+            try:
+                while (kp := await raw_queue.get()) is not None:
+                    accepted = await merger.add(kp)
+                    if accepted is not None:
+                        self.progress.count("knowledge_points")
+                        await kp_queue.put(accepted)
+            except Exception:
+                await kp_queue.put(None)
+                raise
+            await kp_queue.put(None)
+
+        async def accepted_knowledge_points():
+            while (kp := await kp_queue.get()) is not None:
+                yield kp
+
+        stages = [asyncio.ensure_future(extract_stage()), asyncio.ensure_future(merge_stage())]
+        questions = []
+        try:
+            async for question in self.generator.iter_generate(accepted_knowledge_points()):
+                questions.append(question)
+                if on_question is not None:
+                    on_question(question)
+            await asyncio.gather(*stages)
+            merged_knowledge_points = await merger.finalize()
+        finally:
+            for stage in stages:
+                stage.cancel()
+            merger.close()
 
-        print("📝 正在生成题目...")
-        questions = await self.generator.generate_all(merged_knowledge_points)
+        questions.sort(key=lambda q: q.id)
+        print(f"文档被分成 {chunk_count} 个块，共约 {chunk_tokens} tokens")
+        print(f"合并后剩余 {len(merged_knowledge_points)} 个知识点")
         print(f"成功生成 {len(questions)} 道题目")
 
+        if self.llm_client.cache is not None:
+            stats = self.llm_client.cache.stats()
+            print(f"响应缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次")
+
+        counters = self.progress.snapshot()["counters"]
+        if counters.get("reused_chunks") or counters.get("reused_questions"):
+            print(f"♻️ 复用未变化的内容: {counters.get('reused_chunks', 0)} 个文本块, "
+                  f"{counters.get('reused_questions', 0)} 道题目")
+
+        self.last_usage = self.llm_client.usage.since(usage_before)
+        print(f"📈 API用量: {UsageStats.describe(self.last_usage)}")
+
         return merged_knowledge_points, questions
 
+    def save_archive(self, knowledge_points: Iterable[KnowledgePoint], questions: Iterable[Question],
+                     output_dir: str = "output", compression: str = "auto") -> "ResultArchive":
+        """只写入紧凑的结果存档，各种导出格式在需要时由存档生成"""
+        return ResultArchive.write(os.path.join(output_dir, ResultArchive.FILENAME),
+                                   knowledge_points, questions, compression=compression)
+
     def save_results(self, knowledge_points: List[KnowledgePoint],
                     questions: List[Question],
-                    output_dir: str = "output"):
-        """保存结果"""
+                    output_dir: str = "output",
+                    readable: bool = False):
+        """保存结果存档；readable 为True时另外写出知识点、题目的JSON和可打印的题目文档"""
         os.makedirs(output_dir, exist_ok=True)
+        self.save_archive(knowledge_points, questions, output_dir)
 
-        # 保存知识点
-        kp_data = [asdict(kp) for kp in knowledge_points]
-        with open(f"{output_dir}/knowledge_points.json", 'w', encoding='utf-8') as f:
-            json.dump(kp_data, f, ensure_ascii=False, indent=2)
-
-        # 保存题目
-        q_data = [asdict(q) for q in questions]
-        with open(f"{output_dir}/questions.json", 'w', encoding='utf-8') as f:
-            json.dump(q_data, f, ensure_ascii=False, indent=2)
-
-        # 生成可打印的题目文档
-        with open(f"{output_dir}/quiz.txt", 'w', encoding='utf-8') as f:
-            f.write("=== 生成的测验题目 ===\n\n")
-            for q in questions:
-                f.write(f"题目 {q.id}. {q.question}\n")
-                for opt, content in q.options.items():
-                    f.write(f"  {opt}. {content}\n")
-                f.write(f"\n")
-
-            f.write("\n\n=== 答案和解释 ===\n\n")
-            for q in questions:
-                f.write(f"题目 {q.id}: {q.correct_answer}\n")
-                f.write(f"解释: {q.explanation}\n\n")
+        if readable:
+            # 保存知识点
+            kp_data = [asdict(kp) for kp in knowledge_points]
+            with open(f"{output_dir}/knowledge_points.json", 'w', encoding='utf-8') as f:
+                json.dump(kp_data, f, ensure_ascii=False, indent=2)
+
+            # 保存题目
+            q_data = [asdict(q) for q in questions]
+            with open(f"{output_dir}/questions.json", 'w', encoding='utf-8') as f:
+                json.dump(q_data, f, ensure_ascii=False, indent=2)
+
+            # 生成可打印的题目文档
+            with open(f"{output_dir}/quiz.txt", 'w', encoding='utf-8') as f:
+                f.writelines(QuizFormatter.iter_text(questions))
 
         print(f"✅ 结果已保存到 {output_dir} 目录")
 
@@ -1068,35 +3302,180 @@ class InteractiveReviewer:
 # ========== 批量处理功能 ==========
 
 class BatchProcessor:
-    """批量处理多个文档"""
+    """批量处理多个文档
 
-    def __init__(self, generator: NoteToQuizGenerator):
-        self.generator = generator
+    各文档在进程池中并行解析和分块，所有文本块共用生成器的LLM客户端（连接池和限流器）
+    并发提取；知识点进入同一个全局合并器跨文档去重，被接收的知识点立即开始出题。
+    结果按来源拆分回各文档：被多个文档共有的知识点及其题目会出现在每个来源文档中。
+    """
 
-    async def process_multiple_documents(self, file_paths: List[str]) -> Dict[str, Tuple[List[KnowledgePoint], List[Question]]]:
-        """批量处理多个文档"""
-        results = {}
+    def __init__(self, generator: NoteToQuizGenerator, parse_workers: Optional[int] = None):
+        self.generator = generator
+        # 解析文档的进程数（None表示使用生成器的CPU进程池，1表示在线程中逐个解析）
+        self.parse_workers = parse_workers
+        self.knowledge_points: List[KnowledgePoint] = []
+        self.questions: List[Question] = []
+        self.stats: Dict[str, Any] = {}
+
+    async def _iter_document_chunks(self, file_paths: List[str], doc_stats: Dict[str, Dict[str, Any]]
+                                    ) -> AsyncIterator[Tuple[str, Dict]]:
+        """并行解析所有文档，按解析完成的顺序产出文本块（metadata中带有来源文档）"""
+        args = self.generator.chunker.worker_args()
+        loop = asyncio.get_running_loop()
+        if self.parse_workers is None:
+            pool = self.generator.cpu_executor
+        else:
+            pool = get_cpu_executor(min(self.parse_workers, len(file_paths)))
 
-        for file_path in file_paths:
-            print(f"\n处理文档: {file_path}")
+        async def parse(file_path: str):
+            start = time.perf_counter()
             try:
-                kps, questions = await self.generator.process_document(file_path)
-                results[file_path] = (kps, questions)
+                if pool is not None:
+                    chunks = await loop.run_in_executor(pool, _chunk_document, file_path, *args)
+                else:
+                    chunks = await asyncio.to_thread(_chunk_document, file_path, *args)
             except Exception as e:
-                print(f"处理 {file_path} 时出错: {e}")
-                results[file_path] = ([], [])
+                print(f"解析 {file_path} 时出错: {e}")
+                doc_stats[file_path]["error"] = str(e)
+                chunks = []
+            doc_stats[file_path]["parse_seconds"] = time.perf_counter() - start
+            return file_path, chunks
+
+        tasks = [asyncio.ensure_future(parse(file_path)) for file_path in file_paths]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                file_path, chunks = await next_done
+                stats = doc_stats[file_path]
+                stats["chunks"] = len(chunks)
+                stats["characters"] = sum(len(chunk_text) for chunk_text, _ in chunks)
+                print(f"📄 {file_path}: {len(chunks)} 个块 (解析用时 {stats['parse_seconds']:.2f} 秒)")
+                for chunk_text, chunk_metadata in chunks:
+                    yield chunk_text, dict(chunk_metadata, source=file_path)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def process_multiple_documents(self, file_paths: List[str],
+                                         on_question: Optional[Callable[[Question], Any]] = None
+                                         ) -> Dict[str, Tuple[List[KnowledgePoint], List[Question]]]:
+        """批量处理多个文档，返回 {文档路径: (知识点, 题目)}；全局结果见 knowledge_points / questions"""
+        generator = self.generator
+        merger = generator.open_merger()
+        file_paths = list(dict.fromkeys(file_paths))
+        doc_stats: Dict[str, Dict[str, Any]] = {
+            file_path: {"chunks": 0, "characters": 0, "raw_knowledge_points": 0, "parse_seconds": 0.0}
+            for file_path in file_paths
+        }
+        usage_before = generator.llm_client.usage.snapshot()
+        start = time.perf_counter()
+
+        print(f"🚀 并行处理 {len(file_paths)} 个文档，跨文档合并知识点...")
+        kp_queue: asyncio.Queue = asyncio.Queue(maxsize=generator.pipeline_queue_size)
 
+        async def extract_and_merge():
+            # 合并只在这一个协程中进行，全局合并器不需要加锁
+            try:
+                chunks = self._iter_document_chunks(file_paths, doc_stats)
+                async for kp, chunk_metadata in generator.extractor.iter_extract(chunks, with_metadata=True):
+                    source = chunk_metadata["source"]
+                    doc_stats[source]["raw_knowledge_points"] += 1
+                    accepted = await merger.add(kp, source=source)
+                    if accepted is not None:
+                        generator.progress.count("knowledge_points")
+                        await kp_queue.put(accepted)
+            finally:
+                await kp_queue.put(None)
+
+        async def accepted_knowledge_points():
+            while (kp := await kp_queue.get()) is not None:
+                yield kp
+
+        stage = asyncio.ensure_future(extract_and_merge())
+        questions = []
+        try:
+            async for question in generator.generator.iter_generate(accepted_knowledge_points()):
+                questions.append(question)
+                if on_question is not None:
+                    on_question(question)
+            await stage
+            self.knowledge_points = await merger.finalize()
+        finally:
+            stage.cancel()
+            merger.close()
+
+        questions.sort(key=lambda q: q.id)
+        self.questions = questions
+
+        # 按来源把全局结果拆分回各文档
+        doc_kp_ids: Dict[str, set] = {file_path: set() for file_path in file_paths}
+        for kp in self.knowledge_points:
+            for source in merger.sources(kp.id):
+                doc_kp_ids[source].add(kp.id)
+
+        results = {}
+        for file_path in file_paths:
+            kp_ids = doc_kp_ids[file_path]
+            doc_questions = [q for q in questions
+                             if q.knowledge_point_id in kp_ids or kp_ids.intersection(q.related_knowledge_points)]
+            results[file_path] = ([kp for kp in self.knowledge_points if kp.id in kp_ids], doc_questions)
+            doc_stats[file_path]["knowledge_points"] = len(kp_ids)
+            doc_stats[file_path]["shared_knowledge_points"] = sum(
+                1 for kp_id in kp_ids if len(merger.sources(kp_id)) > 1)
+            doc_stats[file_path]["questions"] = len(doc_questions)
+
+        elapsed = time.perf_counter() - start
+        total_characters = sum(stats["characters"] for stats in doc_stats.values())
+        self.stats = {
+            "documents": doc_stats,
+            "total": {
+                "documents": len(file_paths),
+                "chunks": sum(stats["chunks"] for stats in doc_stats.values()),
+                "characters": total_characters,
+                "raw_knowledge_points": sum(stats["raw_knowledge_points"] for stats in doc_stats.values()),
+                "knowledge_points": len(self.knowledge_points),
+                "questions": len(questions),
+                "elapsed_seconds": elapsed,
+                "documents_per_minute": len(file_paths) / elapsed * 60 if elapsed else 0.0,
+                "characters_per_second": total_characters / elapsed if elapsed else 0.0,
+                "questions_per_minute": len(questions) / elapsed * 60 if elapsed else 0.0,
+                "usage": generator.llm_client.usage.since(usage_before)
+            }
+        }
         return results
 
+    def print_stats(self):
+        """打印各文档和总体的吞吐统计"""
+        if not self.stats:
+            return
+        print(f"\n{'文档':<32} {'块数':>6} {'字符数':>10} {'解析(s)':>8} {'原始知识点':>10} {'知识点':>8} {'共有':>6} {'题目':>6}")
+        for file_path, stats in self.stats["documents"].items():
+            name = os.path.basename(file_path)
+            print(f"{name[:32]:<32} {stats['chunks']:>6} {stats['characters']:>10} {stats['parse_seconds']:>8.2f} "
+                  f"{stats['raw_knowledge_points']:>10} {stats.get('knowledge_points', 0):>8} "
+                  f"{stats.get('shared_knowledge_points', 0):>6} {stats.get('questions', 0):>6}"
+                  + (f"  ❌ {stats['error']}" if "error" in stats else ""))
+
+        total = self.stats["total"]
+        print(f"\n📊 共 {total['documents']} 个文档, {total['chunks']} 个块, {total['characters']} 字符")
+        print(f"   知识点: 原始 {total['raw_knowledge_points']} → 跨文档合并后 {total['knowledge_points']}")
+        print(f"   题目: {total['questions']} 道")
+        print(f"⏱️ 总用时 {total['elapsed_seconds']:.2f} 秒: {total['documents_per_minute']:.1f} 文档/分钟, "
+              f"{total['characters_per_second']:.0f} 字符/秒, {total['questions_per_minute']:.1f} 题/分钟")
+        print(f"📈 API用量: {UsageStats.describe(total['usage'])}")
+
 # ========== 题目格式化输出 ==========
 
 class QuizFormatter:
-    """题目格式化器"""
+    """题目格式化器
+
+    iter_* 方法逐段产出文档内容，可以直接写入响应或文件，不必先拼出整个文档；
+    to_* 方法返回完整的字符串。
+    """
 
     @staticmethod
-    def to_html(questions: List[Question], knowledge_points: List[KnowledgePoint]) -> str:
-        """生成HTML格式的测验"""
-        html = """
+    def iter_html(questions: Iterable[Question], knowledge_points: Iterable[KnowledgePoint]) -> Iterator[str]:
+        """逐段生成HTML格式的测验"""
+        yield """
 <!DOCTYPE html>
 <html>
 <head>
@@ -1159,14 +3538,14 @@ class QuizFormatter:
 
         # 添加知识点概览
         for kp in knowledge_points:
-            html += f"""
+            yield f"""
         <div class="knowledge-point">
             <h3>{kp.id}. {kp.title}</h3>
             <p>{kp.summary}</p>
         </div>
 """
 
-        html += """
+        yield """
     </div>
 
     <h2>测验题目</h2>
@@ -1175,21 +3554,21 @@ class QuizFormatter:
 
         
         for q in questions:
-            html += f"""
+            yield f"""
         <div class="question">
             <div class="question-number">题目 {q.id}</div>
             <p>{q.question}</p>
             <div class="options">
 """
             for opt, content in q.options.items():
-                html += f'                <div class="option">{opt}. {content}</div>\n'
+                yield f'                <div class="option">{opt}. {content}</div>\n'
 
-            html += """            </div>
+            yield """            </div>
         </div>
 """
 
         
-        html += """
+        yield """
     </div>
 
     <div class="answer-section">
@@ -1197,46 +3576,277 @@ class QuizFormatter:
 """
 
         for q in questions:
-            html += f"""
+            yield f"""
         <div class="answer">
             <strong>题目 {q.id}:</strong> {q.correct_answer}<br>
             <strong>解析:</strong> {q.explanation}
         </div>
 """
 
-        html += """
+        yield """
     </div>
 </body>
 </html>
 """
-        return html
 
     @staticmethod
-    def to_markdown(questions: List[Question], knowledge_points: List[KnowledgePoint]) -> str:
-        """生成Markdown格式的测验"""
-        md = "# 知识点测验\n\n"
+    def to_html(questions: List[Question], knowledge_points: List[KnowledgePoint]) -> str:
+        """生成HTML格式的测验"""
+        return "".join(QuizFormatter.iter_html(questions, knowledge_points))
+
+    @staticmethod
+    def iter_markdown(questions: Iterable[Question], knowledge_points: Iterable[KnowledgePoint]) -> Iterator[str]:
+        """逐段生成Markdown格式的测验"""
+        yield "# 知识点测验\n\n"
 
-        md += "## 知识点概览\n\n"
+        yield "## 知识点概览\n\n"
         for kp in knowledge_points:
-            md += f"### {kp.id}. {kp.title}\n\n"
-            md += f"{kp.summary}\n\n"
+            yield f"### {kp.id}. {kp.title}\n\n"
+            yield f"{kp.summary}\n\n"
             if kp.key_formulas:
-                md += f"**关键公式：** {', '.join(kp.key_formulas)}\n\n"
+                yield f"**关键公式：** {', '.join(kp.key_formulas)}\n\n"
 
-        md += "## 测验题目\n\n"
+        yield "## 测验题目\n\n"
         for q in questions:
-            md += f"### 题目 {q.id}\n\n"
-            md += f"{q.question}\n\n"
+            yield f"### 题目 {q.id}\n\n"
+            yield f"{q.question}\n\n"
             for opt, content in q.options.items():
-                md += f"- {opt}. {content}\n"
-            md += "\n"
+                yield f"- {opt}. {content}\n"
+            yield "\n"
 
-        md += "## 答案与解析\n\n"
+        yield "## 答案与解析\n\n"
+        for q in questions:
+            yield f"**题目 {q.id}:** {q.correct_answer}\n\n"
+            yield f"**解析：** {q.explanation}\n\n"
+
+    @staticmethod
+    def to_markdown(questions: List[Question], knowledge_points: List[KnowledgePoint]) -> str:
+        """生成Markdown格式的测验"""
+        return "".join(QuizFormatter.iter_markdown(questions, knowledge_points))
+
+    @staticmethod
+    def iter_text(questions: Iterable[Question]) -> Iterator[str]:
+        """逐段生成可打印的纯文本测验"""
+        yield "=== 生成的测验题目 ===\n\n"
         for q in questions:
-            md += f"**题目 {q.id}:** {q.correct_answer}\n\n"
-            md += f"**解析：** {q.explanation}\n\n"
+            yield f"题目 {q.id}. {q.question}\n"
+            for opt, content in q.options.items():
+                yield f"  {opt}. {content}\n"
+            yield "\n"
+
+        yield "\n\n=== 答案和解释 ===\n\n"
+        for q in questions:
+            yield f"题目 {q.id}: {q.correct_answer}\n"
+            yield f"解释: {q.explanation}\n\n"
+
+    @staticmethod
+    def to_text(questions: List[Question]) -> str:
+        """生成可打印的纯文本测验"""
+        return "".join(QuizFormatter.iter_text(questions))
+
+
+@functools.lru_cache(maxsize=None)
+def _optional_module(name: str):
+    """导入可选依赖，未安装时返回None"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def _write_atomic(path: str, data: bytes):
+    """先写临时文件再替换，其他进程不会读到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ResultArchive:
+    """知识点和题目的紧凑结果存档
+
+    每次运行只写一次。文件由定长头部和负载组成，头部依次为魔数、格式版本、编码
+    （安装了 msgpack 时用 msgpack，否则用紧凑JSON）、压缩方式（zstd/gzip/不压缩）
+    和负载的sha256摘要；负载按列名+行保存，不重复字段名。JSON、HTML、Markdown 等
+    导出文件在第一次请求时由存档生成，按摘要缓存在 exports/<摘要> 目录下，
+    之后的下载直接发送已有文件；内容变化后摘要改变，旧的导出文件被清理。
+    """
 
-        return md
+    FILENAME = "results.nqr"
+    MAGIC = b"NQRA"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBBBx32s")
+    ENCODINGS = {"json": 0, "msgpack": 1}
+    COMPRESSIONS = {"none": 0, "gzip": 1, "zstd": 2}
+    # 导出格式 -> 文件扩展名
+    EXPORT_FORMATS = {"json": "zip", "html": "html", "markdown": "md", "txt": "txt"}
+
+    def __init__(self, path: str):
+        self.path = path
+        self._header: Optional[Tuple[int, int, str]] = None
+
+    @classmethod
+    def write(cls, path: str, knowledge_points: Iterable[KnowledgePoint], questions: Iterable[Question],
+              compression: str = "auto") -> "ResultArchive":
+        """写入存档（已是列式集合的结果直接按行写出）"""
+        if not isinstance(knowledge_points, KnowledgeBase):
+            knowledge_points = KnowledgeBase(knowledge_points)
+        if not isinstance(questions, QuestionSet):
+            questions = QuestionSet(questions)
+        payload = {
+            "knowledge_points": {"fields": knowledge_points.field_names(),
+                                 "rows": [list(row) for row in knowledge_points.rows()]},
+            "questions": {"fields": questions.field_names(), "rows": [list(row) for row in questions.rows()]}
+        }
+
+        msgpack = _optional_module("msgpack")
+        if msgpack is not None:
+            encoding, data = "msgpack", msgpack.packb(payload, use_bin_type=True)
+        else:
+            encoding = "json"
+            data = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(data).digest()
+
+        if compression == "auto":
+            compression = "zstd" if _optional_module("zstandard") is not None else "gzip"
+        if compression == "zstd":
+            data = _optional_module("zstandard").ZstdCompressor(level=6).compress(data)
+        elif compression == "gzip":
+            data = gzip.compress(data, compresslevel=6, mtime=0)
+        elif compression != "none":
+            raise ValueError(f"不支持的压缩方式: {compression}")
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, cls.ENCODINGS[encoding],
+                                 cls.COMPRESSIONS[compression], digest)
+        _write_atomic(path, header + data)
+
+        archive = cls(path)
+        archive._prune_exports(digest.hex())
+        return archive
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _read_header(self, f) -> Tuple[int, int, str]:
+        raw = f.read(self.HEADER.size)
+        if len(raw) != self.HEADER.size:
+            raise ValueError(f"结果存档不完整: {self.path}")
+        magic, version, encoding, compression, digest = self.HEADER.unpack(raw)
+        if magic != self.MAGIC or version > self.VERSION:
+            raise ValueError(f"无法识别的结果存档: {self.path}（版本 {version}）")
+        return encoding, compression, digest.hex()
+
+    @property
+    def digest(self) -> str:
+        """负载的sha256摘要（只读取头部）"""
+        if self._header is None:
+            with open(self.path, 'rb') as f:
+                self._header = self._read_header(f)
+        return self._header[2]
+
+    def load(self) -> Tuple[KnowledgeBase, QuestionSet]:
+        """读取存档中的知识点和题目"""
+        with open(self.path, 'rb') as f:
+            encoding, compression, digest = self._read_header(f)
+            data = f.read()
+        self._header = (encoding, compression, digest)
+
+        if compression == self.COMPRESSIONS["gzip"]:
+            data = gzip.decompress(data)
+        elif compression == self.COMPRESSIONS["zstd"]:
+            zstandard = _optional_module("zstandard")
+            if zstandard is None:
+                raise ValueError("读取该结果存档需要安装 zstandard")
+            data = zstandard.ZstdDecompressor().decompress(data)
+
+        if encoding == self.ENCODINGS["msgpack"]:
+            msgpack = _optional_module("msgpack")
+            if msgpack is None:
+                raise ValueError("读取该结果存档需要安装 msgpack")
+            payload = msgpack.unpackb(data, raw=False)
+        else:
+            payload = json.loads(data)
+
+        kp_part, q_part = payload["knowledge_points"], payload["questions"]
+        return (KnowledgeBase.from_rows(kp_part["fields"], kp_part["rows"]),
+                QuestionSet.from_rows(q_part["fields"], q_part["rows"]))
+
+    @property
+    def exports_dir(self) -> str:
+        return os.path.join(os.path.dirname(self.path), "exports")
+
+    def _prune_exports(self, keep: str):
+        """删除其他内容版本的导出文件"""
+        if not os.path.isdir(self.exports_dir):
+            return
+        for name in os.listdir(self.exports_dir):
+            if name != keep[:16]:
+                shutil.rmtree(os.path.join(self.exports_dir, name), ignore_errors=True)
+
+    def export_path(self, format_type: str, base_name: str = "quiz") -> str:
+        """该内容版本的导出文件路径（可能尚未生成）"""
+        if format_type not in self.EXPORT_FORMATS:
+            raise ValueError(f"不支持的格式: {format_type}")
+        return os.path.join(self.exports_dir, self.digest[:16], f"{base_name}.{self.EXPORT_FORMATS[format_type]}")
+
+    def _render(self, format_type: str, base_name: str, block_size: int = 64 * 1024) -> Iterator[bytes]:
+        """逐块产出导出文件的内容（文本格式按 block_size 合并小片段后编码）"""
+        knowledge_points, questions = self.load()
+        if format_type == "json":
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                zipf.writestr(f"{base_name}_knowledge_points.json",
+                              json.dumps(knowledge_points.to_dicts(), ensure_ascii=False, indent=2))
+                zipf.writestr(f"{base_name}_questions.json",
+                              json.dumps(questions.to_dicts(), ensure_ascii=False, indent=2))
+            yield buffer.getvalue()
+            return
+
+        if format_type == "html":
+            fragments = QuizFormatter.iter_html(questions, knowledge_points)
+        elif format_type == "markdown":
+            fragments = QuizFormatter.iter_markdown(questions, knowledge_points)
+        else:
+            fragments = QuizFormatter.iter_text(questions)
+        pending: List[str] = []
+        size = 0
+        for fragment in fragments:
+            pending.append(fragment)
+            size += len(fragment)
+            if size >= block_size:
+                yield "".join(pending).encode('utf-8')
+                pending, size = [], 0
+        if pending:
+            yield "".join(pending).encode('utf-8')
+
+    def stream_export(self, format_type: str, base_name: str = "quiz") -> Iterator[bytes]:
+        """逐块产出导出文件的内容，同时写入该内容版本的缓存文件
+
+        全部产出后缓存文件才生效；中途停止（如客户端断开）时丢弃写了一半的文件。
+        """
+        path = self.export_path(format_type, base_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for block in self._render(format_type, base_name):
+                    f.write(block)
+                    yield block
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def export(self, format_type: str, base_name: str = "quiz") -> str:
+        """返回导出文件的路径；该内容版本尚未导出过该格式时先生成"""
+        path = self.export_path(format_type, base_name)
+        if not os.path.exists(path):
+            for _ in self.stream_export(format_type, base_name):
+                pass
+        return path
 
 class Config:
     """配置管理类"""
@@ -1248,6 +3858,61 @@ class Config:
 
     MAX_CONCURRENT_REQUESTS = 5
 
+    # 限流配置（AIMD自适应并发的下限；每分钟请求数/token数，0表示不限制）
+    MIN_CONCURRENT_REQUESTS = 1
+    REQUESTS_PER_MINUTE = 0
+    TOKENS_PER_MINUTE = 0
+
+    # 重试配置（最大尝试次数、退避时间、单次请求超时与总时限，单位秒）
+    MAX_RETRIES = 4
+    RETRY_BASE_DELAY = 1.0
+    RETRY_MAX_DELAY = 30.0
+    REQUEST_TIMEOUT = 120.0
+    TOTAL_TIMEOUT = 600.0
+
+    # 知识点提取使用流式输出，边生成边解析
+    STREAMING = True
+
+    # 流水线各阶段之间的队列容量
+    PIPELINE_QUEUE_SIZE = 64
+
+    # PDF逐页并行提取的进程数（None表示按CPU核数自动选择，1表示不使用进程池）
+    PDF_WORKERS = None
+
+    # 解析文档等CPU密集阶段的进程数（None表示按CPU核数自动选择，1表示不使用进程池）
+    CPU_WORKERS = None
+    # 在独立子进程中合并知识点（总耗时更长，只减少合并占用事件循环的时间，见 benchmarks/bench_merger.py）
+    MERGE_IN_PROCESS = False
+
+    # 按token预算分块（False时按字符数）；分词器为本地的tokenizer.json，不提供时估算token数
+    CHUNK_BY_TOKENS = os.getenv("CHUNK_BY_TOKENS", "") == "1"
+    TOKENIZER_PATH = os.getenv("TOKENIZER_PATH", "")
+
+    # 每次请求生成的基础题数量（None表示按质量档位选择，1表示逐题请求）
+    QUESTION_BATCH_SIZE = None
+    # 未凑满的一批基础题最多等待的秒数，避免第一道题要等到提取出一整批知识点
+    QUESTION_BATCH_DELAY = 1.0
+
+    # 响应缓存配置（容量上限单位字节，TTL单位秒）
+    CACHE_ENABLED = True
+    CACHE_PATH = os.path.join("cache", "llm_responses.sqlite3")
+    CACHE_MAX_BYTES = 256 * 1024 * 1024
+    CACHE_TTL = 7 * 24 * 3600
+
+    # 按内容指纹复用文本块的知识点和知识点的题目（重新上传修改过的文档时只处理变化的部分）
+    REUSE_ENABLED = True
+    REUSE_PATH = os.path.join("cache", "fingerprints.sqlite3")
+    REUSE_TTL = 30 * 24 * 3600
+
+    # 结果存档的压缩方式（auto表示安装了zstandard时用zstd，否则用gzip；也可以是 zstd/gzip/none）
+    RESULT_COMPRESSION = "auto"
+
+    # 连接池配置
+    MAX_CONNECTIONS = 100
+    MAX_CONNECTIONS_PER_HOST = 20
+    DNS_CACHE_TTL = 300
+    KEEPALIVE_TIMEOUT = 30.0
+
     OUTPUT_DIR = "output"
 
     @classmethod
@@ -1265,29 +3930,117 @@ class Config:
             "API_BASE_URL": cls.API_BASE_URL,
             "QUALITY_LEVEL": cls.QUALITY_LEVEL,
             "MAX_CONCURRENT_REQUESTS": cls.MAX_CONCURRENT_REQUESTS,
+            "MIN_CONCURRENT_REQUESTS": cls.MIN_CONCURRENT_REQUESTS,
+            "REQUESTS_PER_MINUTE": cls.REQUESTS_PER_MINUTE,
+            "TOKENS_PER_MINUTE": cls.TOKENS_PER_MINUTE,
+            "MAX_RETRIES": cls.MAX_RETRIES,
+            "RETRY_BASE_DELAY": cls.RETRY_BASE_DELAY,
+            "RETRY_MAX_DELAY": cls.RETRY_MAX_DELAY,
+            "REQUEST_TIMEOUT": cls.REQUEST_TIMEOUT,
+            "TOTAL_TIMEOUT": cls.TOTAL_TIMEOUT,
+            "STREAMING": cls.STREAMING,
+            "PIPELINE_QUEUE_SIZE": cls.PIPELINE_QUEUE_SIZE,
+            "PDF_WORKERS": cls.PDF_WORKERS,
+            "CPU_WORKERS": cls.CPU_WORKERS,
+            "MERGE_IN_PROCESS": cls.MERGE_IN_PROCESS,
+            "CHUNK_BY_TOKENS": cls.CHUNK_BY_TOKENS,
+            "TOKENIZER_PATH": cls.TOKENIZER_PATH,
+            "QUESTION_BATCH_SIZE": cls.QUESTION_BATCH_SIZE,
+            "QUESTION_BATCH_DELAY": cls.QUESTION_BATCH_DELAY,
+            "CACHE_ENABLED": cls.CACHE_ENABLED,
+            "CACHE_PATH": cls.CACHE_PATH,
+            "CACHE_MAX_BYTES": cls.CACHE_MAX_BYTES,
+            "CACHE_TTL": cls.CACHE_TTL,
+            "REUSE_ENABLED": cls.REUSE_ENABLED,
+            "REUSE_PATH": cls.REUSE_PATH,
+            "REUSE_TTL": cls.REUSE_TTL,
+            "RESULT_COMPRESSION": cls.RESULT_COMPRESSION,
+            "MAX_CONNECTIONS": cls.MAX_CONNECTIONS,
+            "MAX_CONNECTIONS_PER_HOST": cls.MAX_CONNECTIONS_PER_HOST,
+            "DNS_CACHE_TTL": cls.DNS_CACHE_TTL,
+            "KEEPALIVE_TIMEOUT": cls.KEEPALIVE_TIMEOUT,
             "OUTPUT_DIR": cls.OUTPUT_DIR
         }
 
 class EnhancedNoteToQuizGenerator(NoteToQuizGenerator):
     """笔记生题器"""
 
-    def __init__(self, config: Config = None):
+    def __init__(self, config: Config = None, llm_client: Optional[LLMClient] = None):
         if config is None:
             config = Config()
 
-        super().__init__(config.API_KEY, config.QUALITY_LEVEL)  
+        # 未传入共享客户端时按配置创建，并由本生成器负责关闭
+        owns_client = llm_client is None
+        if owns_client:
+            llm_client = self.build_llm_client(config)
+        super().__init__(config.API_KEY, config.QUALITY_LEVEL, llm_client=llm_client)
+        self.owns_client = owns_client
         self.config = config
-        self.chunker = TextChunker(quality_level=config.QUALITY_LEVEL)
+        self.chunker = TextChunker(quality_level=config.QUALITY_LEVEL,
+                                   token_counter=TokenCounter(config.TOKENIZER_PATH),
+                                   by_tokens=config.CHUNK_BY_TOKENS)
         self.merger = KnowledgePointMerger(quality_level=config.QUALITY_LEVEL)
+        self.generator.batch_size = config.QUESTION_BATCH_SIZE
+        self.generator.batch_delay = config.QUESTION_BATCH_DELAY
+        if config.REUSE_ENABLED:
+            fingerprints = get_fingerprint_store(config.REUSE_PATH, config.REUSE_TTL)
+            self.extractor.fingerprints = fingerprints
+            self.generator.fingerprints = fingerprints
+        self.extractor.streaming = config.STREAMING
+        self.pipeline_queue_size = config.PIPELINE_QUEUE_SIZE
+        self.pdf_workers = config.PDF_WORKERS
+        self.cpu_workers = config.CPU_WORKERS
+        self.merge_in_process = config.MERGE_IN_PROCESS
         self.reviewer = InteractiveReviewer()
         self.formatter = QuizFormatter()
 
+    @staticmethod
+    def build_llm_client(config: Config) -> LLMClient:
+        """按配置创建LLM客户端（连接池、限流、重试与响应缓存）"""
+        return LLMClient(
+            config.API_KEY,
+            base_url=config.API_BASE_URL,
+            max_connections=config.MAX_CONNECTIONS,
+            max_connections_per_host=config.MAX_CONNECTIONS_PER_HOST,
+            dns_cache_ttl=config.DNS_CACHE_TTL,
+            keepalive_timeout=config.KEEPALIVE_TIMEOUT,
+            rate_limiter=RateLimiter(
+                max_concurrency=config.MAX_CONCURRENT_REQUESTS,
+                min_concurrency=config.MIN_CONCURRENT_REQUESTS,
+                requests_per_minute=config.REQUESTS_PER_MINUTE,
+                tokens_per_minute=config.TOKENS_PER_MINUTE
+            ),
+            retry_policy=RetryPolicy(
+                max_attempts=config.MAX_RETRIES,
+                base_delay=config.RETRY_BASE_DELAY,
+                max_delay=config.RETRY_MAX_DELAY,
+                request_timeout=config.REQUEST_TIMEOUT,
+                total_timeout=config.TOTAL_TIMEOUT
+            ),
+            cache=get_response_cache(
+                config.CACHE_PATH, config.CACHE_MAX_BYTES, config.CACHE_TTL
+            ) if config.CACHE_ENABLED else None
+        )
+
+    def save_archive(self, knowledge_points: Iterable[KnowledgePoint], questions: Iterable[Question],
+                     output_dir: str = "output", compression: Optional[str] = None) -> "ResultArchive":
+        """写入结果存档，默认使用配置中的压缩方式"""
+        return super().save_archive(knowledge_points, questions, output_dir,
+                                    compression=compression or self.config.RESULT_COMPRESSION)
+
     async def process_with_review(self, file_path: str, enable_review: bool = True) -> Tuple[List[KnowledgePoint], List[Question]]:
         """处理文档并可选地进行人工审核"""
-        text = DocumentParser.parse_document(file_path)
-        chunks = self.chunker.chunk_text(text)
+        chunks = [chunk async for chunk in self.iter_chunks(file_path)]
         raw_knowledge_points = await self.extractor.extract_all(chunks)
-        merged_knowledge_points = self.merger.merge_knowledge_points(raw_knowledge_points)
+        executor = self.cpu_executor
+        if executor is not None:
+            kp_dicts = await asyncio.get_running_loop().run_in_executor(
+                executor, _merge_knowledge_point_dicts, self.merger.quality_level,
+                [asdict(kp) for kp in raw_knowledge_points])
+            merged_knowledge_points = [KnowledgePoint(**data) for data in kp_dicts]
+        else:
+            merged_knowledge_points = await asyncio.to_thread(self.merger.merge_knowledge_points,
+                                                              raw_knowledge_points)
 
         if enable_review:
             merged_knowledge_points = self.reviewer.review_knowledge_points(merged_knowledge_points)
@@ -1304,17 +4057,15 @@ class EnhancedNoteToQuizGenerator(NoteToQuizGenerator):
         os.makedirs(output_dir, exist_ok=True)
 
         # JSON格式
-        self.save_results(knowledge_points, questions, output_dir)
+        self.save_results(knowledge_points, questions, output_dir, readable=True)
 
         # HTML格式
-        html_content = self.formatter.to_html(questions, knowledge_points)
         with open(f"{output_dir}/{base_name}.html", 'w', encoding='utf-8') as f:
-            f.write(html_content)
+            f.writelines(self.formatter.iter_html(questions, knowledge_points))
 
         # Markdown格式
-        md_content = self.formatter.to_markdown(questions, knowledge_points)
         with open(f"{output_dir}/{base_name}.md", 'w', encoding='utf-8') as f:
-            f.write(md_content)
+            f.writelines(self.formatter.iter_markdown(questions, knowledge_points))
 
         print(f"✅ 已保存为多种格式到 {output_dir} 目录")
 
@@ -1333,6 +4084,10 @@ class ColabHelper:
 
         print("✅ 依赖安装完成")
 
+        # notebook中已经有运行中的事件循环，允许嵌套运行
+        import nest_asyncio
+        nest_asyncio.apply()
+
     @staticmethod
     def upload_file():
         """上传文件到Colab"""
@@ -1425,9 +4180,10 @@ async def colab_main():
         print("\n🚀 开始处理文档...")
         start_time = time.time()
 
-        knowledge_points, questions = await generator.process_with_review(
-            file_path, enable_review
-        )
+        async with generator:
+            knowledge_points, questions = await generator.process_with_review(
+                file_path, enable_review
+            )
 
         # 7. 保存结果
         generator.save_all_formats(knowledge_points, questions,
@@ -1448,6 +4204,93 @@ async def colab_main():
         traceback.print_exc()
 
 
+def _document_output_names(file_paths: List[str]) -> Dict[str, str]:
+    """各文档结果目录的名称：默认为不带扩展名的文件名
+
+    文件名相同（如不同目录下的 notes.pdf，或同目录下的 notes.pdf 与 notes.md）时
+    改用相对于公共目录的路径（含扩展名，路径分隔符换成 "_"），仍重复时再加序号，
+    保证不同文档的结果不会互相覆盖。
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in file_paths]
+    counts = Counter(stems)
+    absolute = [os.path.abspath(path) for path in file_paths]
+    common = os.path.commonpath([os.path.dirname(path) for path in absolute]) if absolute else ""
+
+    names: Dict[str, str] = {}
+    used = set()
+    for path, abs_path, stem in zip(file_paths, absolute, stems):
+        name = stem
+        if counts[stem] > 1:
+            name = os.path.relpath(abs_path, common).replace(os.sep, "_")
+        candidate, index = name, 1
+        while candidate in used:
+            index += 1
+            candidate = f"{name}_{index}"
+        used.add(candidate)
+        names[path] = candidate
+    return names
+
+
+async def main(argv: Optional[List[str]] = None):
+    """命令行入口：批量处理文档，跨文档合并知识点并输出吞吐统计
+
+    用法: python -m core.generator 讲义1.pdf 讲义2.docx notes/ -q 中等 -o output
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="笔记生题器：批量处理文档，跨文档合并知识点并生成题目")
+    parser.add_argument("files", nargs="+", help="文档路径（pdf/docx/txt/md），目录会展开为其中的文档")
+    parser.add_argument("-q", "--quality", default=Config.QUALITY_LEVEL,
+                        choices=["简约", "中等", "较细致", "细致", "精细"], help="质量档位")
+    parser.add_argument("-o", "--output", default=Config.OUTPUT_DIR, help="输出目录")
+    parser.add_argument("--api-key", default=Config.API_KEY, help="API密钥（默认读取环境变量 DEEPSEEK_API_KEY）")
+    parser.add_argument("--parse-workers", type=int, default=None, help="解析文档的进程数")
+    parser.add_argument("--max-concurrent", type=int, default=Config.MAX_CONCURRENT_REQUESTS,
+                        help="最大并发API请求数")
+    args = parser.parse_args(argv)
+
+    extensions = ('.pdf', '.docx', '.doc', '.txt', '.md', '.markdown')
+    file_paths = []
+    for path in args.files:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                file_paths.extend(os.path.join(root, name) for name in sorted(names)
+                                  if name.lower().endswith(extensions))
+        elif os.path.exists(path):
+            file_paths.append(path)
+        else:
+            print(f"⚠️ 文件不存在，已跳过: {path}")
+    if not file_paths:
+        print("❌ 没有可处理的文档")
+        return
+    if not args.api_key:
+        print("❌ 请通过 --api-key 或环境变量 DEEPSEEK_API_KEY 提供API密钥")
+        return
+
+    config = Config()
+    config.API_KEY = args.api_key
+    config.QUALITY_LEVEL = args.quality
+    config.OUTPUT_DIR = args.output
+    config.MAX_CONCURRENT_REQUESTS = args.max_concurrent
+
+    async with EnhancedNoteToQuizGenerator(config) as generator:
+        processor = BatchProcessor(generator, parse_workers=args.parse_workers)
+        results = await processor.process_multiple_documents(file_paths)
+
+    # 全局结果输出多种格式，各文档的结果单独保存JSON
+    generator.save_all_formats(processor.knowledge_points, processor.questions, base_name="quiz")
+    output_names = _document_output_names(list(results))
+    for file_path, (knowledge_points, questions) in results.items():
+        generator.save_results(knowledge_points, questions,
+                               os.path.join(config.OUTPUT_DIR, "documents", output_names[file_path]),
+                               readable=True)
+    with open(os.path.join(config.OUTPUT_DIR, "batch_stats.json"), 'w', encoding='utf-8') as f:
+        json.dump(processor.stats, f, ensure_ascii=False, indent=2)
+
+    processor.print_stats()
+    print(f"✅ 结果已保存到 {config.OUTPUT_DIR}")
+
+
 if __name__ == "__main__":
     try:
         import google.colab
@@ -1456,6 +4299,8 @@ if __name__ == "__main__":
         IN_COLAB = False
 
     if IN_COLAB:
+        import nest_asyncio
+        nest_asyncio.apply()
         asyncio.run(colab_main())
     else:
         asyncio.run(main())
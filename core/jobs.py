@@ -0,0 +1,236 @@
+import os
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import traceback
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class QueueFullError(Exception):
+    """排队任务已达上限，拒绝新任务"""
+
+
+class Job:
+    """调度器中的一个任务
+
+    func(job) 在工作线程中执行；任务可通过 cancelled 判断是否已被取消，
+    也可以用 add_cancel_callback 注册取消时的回调（如取消协程）。
+    """
+
+    def __init__(self, job_id: str, func: Callable[["Job"], None], priority: int = 0):
+        self.job_id = job_id
+        self.func = func
+        self.priority = priority
+        self.status = "queued"
+        self._cancel_event = threading.Event()
+        self._cancel_callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def add_cancel_callback(self, callback: Callable[[], None]):
+        """注册取消回调；任务已被取消时立即调用"""
+        with self._lock:
+            if not self.cancelled:
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self._cancel_event.set()
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ 任务 {self.job_id} 的取消回调失败: {e}")
+
+
+class JobScheduler:
+    """有界任务调度器：固定数量的工作线程 + 优先级队列
+
+    priority 越小越先执行，同优先级按提交顺序（FIFO）。排队任务超过 max_queue 时
+    submit 抛出 QueueFullError，由调用方拒绝请求。队列变化时调用
+    on_queue_change({job_id: 排队位置}) 报告各任务的位置（从1开始）。
+    工作线程在首次提交时按进程启动，兼容gunicorn的fork模式。
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 32,
+                 on_queue_change: Optional[Callable[[Dict[str, int]], None]] = None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.on_queue_change = on_queue_change
+        self._heap: List[tuple] = []
+        self._jobs: Dict[str, Job] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        self._workers_pid: Optional[int] = None
+        self._shutdown = False
+
+    def _ensure_workers(self):
+        """启动工作线程（调用方需持有锁）"""
+        if self._workers_pid == os.getpid():
+            return
+        self._workers_pid = os.getpid()
+        self._workers = []
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, job_id: str, func: Callable[[Job], None], priority: int = 0) -> Job:
+        """提交任务，队列已满时抛出QueueFullError"""
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("调度器已关闭")
+            existing = self._jobs.get(job_id)
+            if existing is not None and existing.status in ("queued", "running"):
+                return existing
+            if len(self._heap) >= self.max_queue:
+                raise QueueFullError(f"排队任务已达上限（{self.max_queue}）")
+            job = Job(job_id, func, priority)
+            self._jobs[job_id] = job
+            heapq.heappush(self._heap, (priority, next(self._sequence), job))
+            self._ensure_workers()
+            self._condition.notify()
+            positions = self._positions()
+        self._report(positions)
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """取消任务：排队中的直接移出队列，运行中的触发取消回调。任务不存在时返回False"""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in ("queued", "running"):
+                return False
+            positions = None
+            if job.status == "queued":
+                self._heap = [entry for entry in self._heap if entry[2] is not job]
+                heapq.heapify(self._heap)
+                job.status = "cancelled"
+                del self._jobs[job_id]
+                positions = self._positions()
+        job.cancel()
+        if positions is not None:
+            self._report(positions)
+        return True
+
+    def position(self, job_id: str) -> Optional[int]:
+        """任务在队列中的位置（从1开始），不在队列中时返回None"""
+        with self._condition:
+            return self._positions().get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._condition:
+            running = sum(1 for job in self._jobs.values() if job.status == "running")
+            return {"queued": len(self._heap), "running": running, "max_workers": self.max_workers,
+                    "max_queue": self.max_queue}
+
+    def shutdown(self, cancel_running: bool = False):
+        """停止接收任务；可选地取消运行中的任务"""
+        with self._condition:
+            self._shutdown = True
+            queued = [entry[2] for entry in self._heap]
+            self._heap = []
+            running = [job for job in self._jobs.values() if job.status == "running"]
+            self._condition.notify_all()
+        for job in queued:
+            job.status = "cancelled"
+            job.cancel()
+        if cancel_running:
+            for job in running:
+                job.cancel()
+
+    def _positions(self) -> Dict[str, int]:
+        """各排队任务的位置（调用方需持有锁）"""
+        return {entry[2].job_id: i + 1 for i, entry in enumerate(sorted(self._heap))}
+
+    def _report(self, positions: Dict[str, int]):
+        if self.on_queue_change is None:
+            return
+        try:
+            self.on_queue_change(positions)
+        except Exception as e:
+            print(f"⚠️ 报告排队位置失败: {e}")
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                while not self._heap and not self._shutdown:
+                    self._condition.wait()
+                if self._shutdown:
+                    return
+                _, _, job = heapq.heappop(self._heap)
+                job.status = "running"
+                positions = self._positions()
+            self._report(positions)
+
+            try:
+                job.func(job)
+                job.status = "cancelled" if job.cancelled else "done"
+            except Exception:
+                job.status = "error"
+                traceback.print_exc()
+            finally:
+                with self._condition:
+                    if self._jobs.get(job.job_id) is job:
+                        del self._jobs[job.job_id]
+
+
+class BackgroundLoop:
+    """在后台线程中长期运行的事件循环
+
+    所有LLM请求都在这个循环中执行，连接池、限流器等可以在请求之间共享。
+    其他线程通过 submit() 提交协程，得到 concurrent.futures.Future；
+    取消该Future会取消循环中对应的任务。循环在首次使用时按进程启动。
+    """
+
+    def __init__(self, name: str = "asyncio-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._pid != os.getpid():
+                ready = threading.Event()
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run, args=(self._loop, ready),
+                                                name=self.name, daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._pid = os.getpid()
+            return self._loop
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop, ready: threading.Event):
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        loop.run_forever()
+
+    def submit(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """提交协程，立即返回Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """提交协程并等待结果（不能在循环线程内调用）"""
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join(timeout=5)
+            self._loop = None
+            self._pid = None
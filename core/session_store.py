@@ -0,0 +1,356 @@
+import os
+import json
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class SessionStore(ABC):
+    """会话存储接口
+
+    会话由若干字段组成，每个字段单独序列化保存，更新状态等小字段时不必重写
+    知识点、题目等大字段。列表型数据（如逐道生成的题目）可以按条追加，并按
+    追加顺序分页读取。实现需保证多进程（如gunicorn多个worker）共享同一份数据。
+    """
+
+    @abstractmethod
+    def create(self, session_id: str, data: Dict[str, Any]):
+        """创建会话并写入初始字段"""
+
+    @abstractmethod
+    def exists(self, session_id: str) -> bool:
+        """会话是否存在且未过期"""
+
+    @abstractmethod
+    def get(self, session_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        """读取会话（可只读部分字段），会话不存在时返回None"""
+
+    def get_field(self, session_id: str, field: str, default: Any = None) -> Any:
+        data = self.get(session_id, [field])
+        if data is None:
+            return default
+        return data.get(field, default)
+
+    @abstractmethod
+    def update(self, session_id: str, fields: Dict[str, Any]) -> bool:
+        """更新若干字段，会话不存在时返回False"""
+
+    @abstractmethod
+    def compare_and_set(self, session_id: str, field: str, expected: Iterable[Any],
+                        fields: Dict[str, Any]) -> bool:
+        """字段当前值属于expected时才更新（原子操作），用于状态迁移"""
+
+    @abstractmethod
+    def set_item(self, session_id: str, field: str, key: str, value: Any) -> bool:
+        """设置字典字段中的单个键（如答题记录），会话不存在时返回False"""
+
+    @abstractmethod
+    def append_items(self, session_id: str, field: str, items: List[Any]) -> int:
+        """向列表追加条目，返回追加后的条目总数；会话不存在时返回-1"""
+
+    @abstractmethod
+    def get_items(self, session_id: str, field: str, start: int = 0,
+                  limit: Optional[int] = None) -> List[Any]:
+        """按追加顺序读取 [start, start+limit) 范围内的条目"""
+
+    @abstractmethod
+    def count_items(self, session_id: str, field: str) -> int:
+        """列表中的条目数"""
+
+    @abstractmethod
+    def clear_items(self, session_id: str, field: str):
+        """清空列表"""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """删除会话"""
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """清理过期会话，返回清理数量"""
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """基于SQLite（WAL模式）的会话存储
+
+    同一个数据库文件可被多个进程同时读写；每个线程使用独立连接。
+    会话在最后一次写入后 ttl 秒过期，由后台线程每 sweep_interval 秒清理一次，
+    清理前调用 on_expire(session_id, data) 以便删除上传文件等关联资源。
+    进程内只保存连接，不缓存会话数据。
+    """
+
+    def __init__(self, path: str = "sessions/sessions.sqlite3", ttl: float = 24 * 3600,
+                 sweep_interval: float = 600,
+                 on_expire: Optional[Callable[[str, Dict[str, Any]], None]] = None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.on_expire = on_expire
+        self._local = threading.local()
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_pid: Optional[int] = None
+        self._stop = threading.Event()
+        self._sweeper_lock = threading.Lock()
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_fields ("
+            "session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE, "
+            "field TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (session_id, field))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_items ("
+            "session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE, "
+            "field TEXT NOT NULL, position INTEGER NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (session_id, field, position))"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """当前线程的连接（按进程区分，fork后的子进程会重新连接）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        self._ensure_sweeper()
+        return conn
+
+    def _ensure_sweeper(self):
+        """在当前进程中启动清理线程（gunicorn的每个worker各有一个，清理操作是幂等的）"""
+        if not self.sweep_interval or self._sweeper_pid == os.getpid():
+            return
+        with self._sweeper_lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+            self._stop.clear()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                removed = self.sweep()
+                if removed:
+                    print(f"🧹 清理过期会话: {removed}")
+            except sqlite3.Error as e:
+                print(f"⚠️ 清理过期会话失败: {e}")
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.ttl else float("inf")
+
+    def create(self, session_id: str, data: Dict[str, Any]):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO sessions (id, created_at, expires_at) VALUES (?, ?, ?)",
+                (session_id, now, self._expires_at())
+            )
+            conn.executemany(
+                "INSERT INTO session_fields (session_id, field, value) VALUES (?, ?, ?)",
+                [(session_id, field, json.dumps(value, ensure_ascii=False)) for field, value in data.items()]
+            )
+
+    def exists(self, session_id: str) -> bool:
+        row = self._connect().execute(
+            "SELECT 1 FROM sessions WHERE id = ? AND expires_at > ?", (session_id, time.time())
+        ).fetchone()
+        return row is not None
+
+    def get(self, session_id: str, fields: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        if not self.exists(session_id):
+            return None
+        conn = self._connect()
+        if fields is None:
+            rows = conn.execute(
+                "SELECT field, value FROM session_fields WHERE session_id = ?", (session_id,)
+            ).fetchall()
+        else:
+            fields = list(fields)
+            placeholders = ",".join("?" * len(fields))
+            rows = conn.execute(
+                f"SELECT field, value FROM session_fields WHERE session_id = ? AND field IN ({placeholders})",
+                [session_id, *fields]
+            ).fetchall()
+        return {field: json.loads(value) for field, value in rows}
+
+    def update(self, session_id: str, fields: Dict[str, Any]) -> bool:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            touched = conn.execute(
+                "UPDATE sessions SET expires_at = ? WHERE id = ? AND expires_at > ?",
+                (self._expires_at(), session_id, time.time())
+            ).rowcount
+            if not touched:
+                return False
+            conn.executemany(
+                "INSERT OR REPLACE INTO session_fields (session_id, field, value) VALUES (?, ?, ?)",
+                [(session_id, field, json.dumps(value, ensure_ascii=False)) for field, value in fields.items()]
+            )
+        return True
+
+    def compare_and_set(self, session_id: str, field: str, expected: Iterable[Any],
+                        fields: Dict[str, Any]) -> bool:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT f.value FROM sessions s JOIN session_fields f ON f.session_id = s.id "
+                "WHERE s.id = ? AND s.expires_at > ? AND f.field = ?",
+                (session_id, time.time(), field)
+            ).fetchone()
+            if row is None or json.loads(row[0]) not in list(expected):
+                return False
+            conn.execute("UPDATE sessions SET expires_at = ? WHERE id = ?", (self._expires_at(), session_id))
+            conn.executemany(
+                "INSERT OR REPLACE INTO session_fields (session_id, field, value) VALUES (?, ?, ?)",
+                [(session_id, name, json.dumps(value, ensure_ascii=False)) for name, value in fields.items()]
+            )
+        return True
+
+    def set_item(self, session_id: str, field: str, key: str, value: Any) -> bool:
+        conn = self._connect()
+        path = "$." + json.dumps(str(key), ensure_ascii=False)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            touched = conn.execute(
+                "UPDATE sessions SET expires_at = ? WHERE id = ? AND expires_at > ?",
+                (self._expires_at(), session_id, time.time())
+            ).rowcount
+            if not touched:
+                return False
+            conn.execute(
+                "INSERT INTO session_fields (session_id, field, value) VALUES (?, ?, json_object(?, json(?))) "
+                "ON CONFLICT (session_id, field) DO UPDATE SET value = json_set(value, ?, json(?))",
+                (session_id, field, str(key), json.dumps(value, ensure_ascii=False),
+                 path, json.dumps(value, ensure_ascii=False))
+            )
+        return True
+
+    def append_items(self, session_id: str, field: str, items: List[Any]) -> int:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            touched = conn.execute(
+                "UPDATE sessions SET expires_at = ? WHERE id = ? AND expires_at > ?",
+                (self._expires_at(), session_id, time.time())
+            ).rowcount
+            if not touched:
+                return -1
+            start = conn.execute(
+                "SELECT COUNT(*) FROM session_items WHERE session_id = ? AND field = ?", (session_id, field)
+            ).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO session_items (session_id, field, position, value) VALUES (?, ?, ?, ?)",
+                [(session_id, field, start + i, json.dumps(item, ensure_ascii=False))
+                 for i, item in enumerate(items)]
+            )
+        return start + len(items)
+
+    def get_items(self, session_id: str, field: str, start: int = 0,
+                  limit: Optional[int] = None) -> List[Any]:
+        rows = self._connect().execute(
+            "SELECT value FROM session_items WHERE session_id = ? AND field = ? AND position >= ? "
+            "ORDER BY position LIMIT ?",
+            (session_id, field, start, -1 if limit is None else limit)
+        ).fetchall()
+        return [json.loads(value) for value, in rows]
+
+    def count_items(self, session_id: str, field: str) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM session_items WHERE session_id = ? AND field = ?", (session_id, field)
+        ).fetchone()[0]
+
+    def clear_items(self, session_id: str, field: str):
+        self._connect().execute(
+            "DELETE FROM session_items WHERE session_id = ? AND field = ?", (session_id, field)
+        )
+
+    def delete(self, session_id: str):
+        self._connect().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def sweep(self) -> int:
+        conn = self._connect()
+        expired: List[str] = [row[0] for row in conn.execute(
+            "SELECT id FROM sessions WHERE expires_at <= ?", (time.time(),)
+        )]
+        for session_id in expired:
+            if self.on_expire is not None:
+                data = {field: json.loads(value) for field, value in conn.execute(
+                    "SELECT field, value FROM session_fields WHERE session_id = ?", (session_id,)
+                )}
+                try:
+                    self.on_expire(session_id, data)
+                except Exception as e:
+                    print(f"⚠️ 会话 {session_id} 的清理回调失败: {e}")
+            conn.execute("DELETE FROM sessions WHERE id = ? AND expires_at <= ?", (session_id, time.time()))
+        return len(expired)
+
+    def close(self):
+        self._stop.set()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class SessionWriter:
+    """在专用线程中按顺序执行某个会话的写入
+
+    update()/append_items() 只把写入放进队列就返回，不会因为数据库锁而阻塞调用方
+    （如共享的后台事件循环）。close() 等待队列中的写入全部完成，之后的写入被忽略。
+    """
+
+    def __init__(self, store: SessionStore, session_id: str):
+        self.store = store
+        self.session_id = session_id
+        self._queue: "queue.Queue[Optional[Callable[[], Any]]]" = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"session-writer-{session_id[:8]}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            write = self._queue.get()
+            if write is None:
+                return
+            try:
+                write()
+            except Exception as e:
+                print(f"⚠️ 会话 {self.session_id} 写入失败: {e}")
+
+    def _submit(self, write: Callable[[], Any]):
+        if not self._closed:
+            self._queue.put(write)
+
+    def update(self, fields: Dict[str, Any]):
+        self._submit(lambda: self.store.update(self.session_id, fields))
+
+    def append_items(self, field: str, items: List[Any]):
+        self._submit(lambda: self.store.append_items(self.session_id, field, items))
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
@@ -177,35 +177,51 @@ class QuizGenerator {
         
         try {
             const response = await fetch(`/process/${this.sessionId}`);
+            if (response.status === 503) {
+                const result = await response.json();
+                throw new Error(result.error || '服务器繁忙，请稍后重试');
+            }
             if (!response.ok) {
                 throw new Error('处理请求失败');
             }
             
-            // 开始轮询状态
-            this.pollStatus();
+            // 优先通过SSE接收进度，不支持时轮询状态
+            if (window.EventSource) {
+                this.listenStatus();
+            } else {
+                this.pollStatus();
+            }
         } catch (error) {
             this.hideLoading();
             alert('处理失败: ' + error.message);
         }
     }
 
+    listenStatus() {
+        let failures = 0;
+        const source = new EventSource(`/events/${this.sessionId}`);
+        source.addEventListener('status', event => {
+            failures = 0;
+            if (this.handleStatus(JSON.parse(event.data))) {
+                source.close();
+            }
+        });
+        source.onerror = () => {
+            // 服务器定期关闭连接时浏览器会自动重连；连续失败则改为轮询
+            failures++;
+            if (failures >= 3 || source.readyState === EventSource.CLOSED) {
+                source.close();
+                this.pollStatus();
+            }
+        };
+    }
+
     async pollStatus() {
         try {
             const response = await fetch(`/status/${this.sessionId}`);
             const result = await response.json();
 
-            if (result.status === 'completed') {
-                this.hideLoading();
-                const enableReview = document.getElementById('enableReview').checked;
-                if (enableReview) {
-                    window.location.href = `/review/${this.sessionId}`;
-                } else {
-                    window.location.href = `/quiz/${this.sessionId}`;
-                }
-            } else if (result.status === 'error') {
-                this.hideLoading();
-                alert('处理失败: ' + (result.error || '未知错误'));
-            } else {
+            if (!this.handleStatus(result)) {
                 // 继续轮询
                 setTimeout(() => this.pollStatus(), 2000);
             }
@@ -215,6 +231,50 @@ class QuizGenerator {
         }
     }
 
+    handleStatus(result) {
+        // 返回true表示处理已结束
+        if (result.status === 'completed') {
+            this.hideLoading();
+            const enableReview = document.getElementById('enableReview').checked;
+            if (enableReview) {
+                window.location.href = `/review/${this.sessionId}`;
+            } else {
+                window.location.href = `/quiz/${this.sessionId}`;
+            }
+            return true;
+        } else if (result.status === 'error') {
+            this.hideLoading();
+            alert('处理失败: ' + (result.error || '未知错误'));
+            return true;
+        } else if (result.status === 'cancelled') {
+            this.hideLoading();
+            return true;
+        }
+
+        // 不需要审核时，第一道题生成后即可开始答题
+        if (result.questions_available > 0 && !document.getElementById('enableReview').checked) {
+            this.hideLoading();
+            window.location.href = `/quiz/${this.sessionId}`;
+            return true;
+        }
+
+        const progressText = document.getElementById('progressText');
+        if (result.status === 'queued' && result.queue_position) {
+            progressText.textContent = `排队中，前方还有 ${result.queue_position - 1} 个任务...`;
+        } else if (result.progress && result.progress.phases) {
+            const phases = result.progress.phases;
+            const current = phases.generate || phases.extract;
+            let text = current ? `正在${current.desc}（${current.done}/${current.total}）` : '正在处理文档...';
+            if (current && current.eta) {
+                text += `，预计剩余 ${Math.round(current.eta)} 秒`;
+            }
+            progressText.textContent = text;
+        } else {
+            progressText.textContent = '正在处理文档...';
+        }
+        return false;
+    }
+
     showLoading(message) {
         document.getElementById('progressContainer').style.display = 'block';
         document.getElementById('progressText').textContent = message;
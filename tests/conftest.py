@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# 测试从仓库根目录导入 core 和 app；会话数据库放在临时目录中
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SESSION_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="quiz-sessions-"), "sessions.sqlite3"))
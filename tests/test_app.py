@@ -0,0 +1,122 @@
+import io
+import os
+import time
+import uuid
+
+import pytest
+
+import app as web
+from core.generator import KnowledgePoint, Question, asdict
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    # 上传文件和输出目录都写到临时目录中
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(web.app.config, "TESTING", True)
+    monkeypatch.setitem(web.app.config, "UPLOAD_FOLDER", str(tmp_path / "uploads"))
+    os.makedirs(tmp_path / "uploads")
+    return web.app.test_client()
+
+
+def create_session(status, **fields):
+    session_id = str(uuid.uuid4())
+    web.sessions.create(session_id, dict({"status": status, "config": {}, "file_path": ""}, **fields))
+    return session_id
+
+
+def test_sse_stream_is_shorter_than_gunicorn_worker_timeout():
+    # gunicorn sync worker 默认30秒超时，单次SSE连接必须在此之前结束
+    assert web.app.config["SSE_MAX_DURATION"] < 30
+
+
+def test_sse_stream_closes_after_max_duration(client, monkeypatch):
+    monkeypatch.setitem(web.app.config, "SSE_MAX_DURATION", 0.5)
+    monkeypatch.setitem(web.app.config, "PROGRESS_INTERVAL", 0.05)
+    session_id = create_session("processing")
+    start = time.perf_counter()
+    response = client.get(f"/events/{session_id}")
+    body = response.get_data(as_text=True)
+    assert time.perf_counter() - start < 2
+    assert body.startswith("retry: 3000")
+    assert body.count("event: status") == 1
+
+
+def test_sse_stream_closes_on_terminal_status(client, monkeypatch):
+    monkeypatch.setitem(web.app.config, "SSE_MAX_DURATION", 10)
+    monkeypatch.setitem(web.app.config, "PROGRESS_INTERVAL", 0.05)
+    session_id = create_session("processing")
+    response = client.get(f"/events/{session_id}", buffered=False)
+    stream = response.response
+    assert next(iter(stream))
+    web.sessions.update(session_id, {"status": "completed"})
+    start = time.perf_counter()
+    rest = b"".join(stream).decode()
+    assert time.perf_counter() - start < 2
+    assert '"status": "completed"' in rest
+
+
+def upload(client, api_key="sk-test-secret-key"):
+    data = {"file": (io.BytesIO("段落内容。".encode("utf-8")), "notes.txt"), "apiKey": api_key,
+            "qualityLevel": "中等"}
+    response = client.post("/upload", data=data, content_type="multipart/form-data")
+    assert response.status_code == 200
+    return response.get_json()["session_id"]
+
+
+def test_api_key_is_not_persisted(client):
+    session_id = upload(client)
+    stored = web.sessions.get(session_id)
+    assert "API_KEY" not in stored["config"]
+    with open(web.sessions.path, "rb") as f:
+        assert b"sk-test-secret-key" not in f.read()
+    with client.application.test_request_context():
+        # 没有浏览器Cookie中的密钥流时无法还原
+        assert web.session_api_key(session_id) is None
+
+
+def test_api_key_is_restored_for_the_job(client, monkeypatch):
+    session_id = upload(client)
+    submitted = []
+    monkeypatch.setattr(web.jobs, "submit", lambda job_id, func, priority=0: submitted.append(func))
+    monkeypatch.setattr(web, "process_document_job", lambda job, api_key: api_key)
+    response = client.get(f"/process/{session_id}")
+    assert response.status_code == 200
+    assert submitted[0](None) == "sk-test-secret-key"
+
+
+def test_process_without_api_key_redirects(client):
+    session_id = upload(client)
+    other_browser = web.app.test_client()
+    response = other_browser.get(f"/process/{session_id}")
+    assert response.status_code == 302
+    assert web.sessions.get_field(session_id, "status") == "uploaded"
+
+
+def test_repeated_downloads_outside_repo_root(client):
+    # 测试时当前目录是临时目录，与 app.root_path 不同
+    session_id = create_session(
+        "completed", file_path="uploads/notes.txt", config={"OUTPUT_DIR": os.path.join("outputs", "s")},
+        knowledge_points=[asdict(KnowledgePoint(id=1, title="标题", summary="摘要"))]
+    )
+    web.sessions.append_items(session_id, "questions", [asdict(Question(
+        id=0, knowledge_point_id=1, question="问题", options={"A": "甲", "B": "乙"},
+        correct_answer="A", explanation="解析"))])
+    for format_type in ("html", "html", "markdown", "markdown", "json", "json"):
+        response = client.get(f"/download/{session_id}/{format_type}")
+        assert response.status_code == 200, response.get_data(as_text=True)
+        assert response.get_data()
+        response.close()
+
+
+def test_quiz_waits_for_review_while_extracting(client):
+    session_id = create_session("processing", enable_review=True, reviewed=False)
+    response = client.get(f"/quiz/{session_id}")
+    assert response.status_code == 302
+    assert f"/process/{session_id}" in response.headers["Location"]
+
+
+@pytest.mark.parametrize("fields", [{"enable_review": False}, {"enable_review": True, "reviewed": True}])
+def test_quiz_starts_while_generating_questions(client, fields):
+    session_id = create_session("processing", **fields)
+    assert client.get(f"/quiz/{session_id}").status_code == 200
@@ -0,0 +1,95 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+import core.generator as generator
+from core.generator import KnowledgePoint, Question, ResultArchive, asdict
+
+
+def make_results():
+    knowledge_points = [
+        KnowledgePoint(id=1, title="牛顿第二定律", summary="力等于质量乘以加速度。", key_formulas=["F=ma"],
+                       key_terms=["力", "加速度"], difficulty_level="进阶", knowledge_type="公式计算"),
+        KnowledgePoint(id=2, title="惯性", summary="物体保持原有运动状态的性质。"),
+    ]
+    questions = [
+        Question(id=0, knowledge_point_id=1, question="F=ma 中 a 表示？",
+                 options={"A": "加速度", "B": "速度", "C": "位移", "D": "质量"}, correct_answer="A",
+                 explanation="a 是加速度。", difficulty="easy"),
+        Question(id=1, knowledge_point_id=2, question="惯性的大小取决于？",
+                 options={"A": "速度", "B": "质量", "C": "受力", "D": "位置"}, correct_answer="B",
+                 explanation="质量是惯性大小的量度。", related_knowledge_points=[1, 2]),
+    ]
+    return knowledge_points, questions
+
+
+@pytest.fixture(params=["none", "gzip", "zstd"])
+def compression(request):
+    if request.param == "zstd":
+        pytest.importorskip("zstandard")
+    return request.param
+
+
+@pytest.fixture(params=["json", "msgpack"])
+def encoding(request, monkeypatch):
+    if request.param == "msgpack":
+        pytest.importorskip("msgpack")
+    else:
+        optional_module = generator._optional_module
+        monkeypatch.setattr(generator, "_optional_module",
+                            lambda name: None if name == "msgpack" else optional_module(name))
+    return request.param
+
+
+def test_round_trip(tmp_path, compression, encoding):
+    knowledge_points, questions = make_results()
+    path = str(tmp_path / ResultArchive.FILENAME)
+    ResultArchive.write(path, knowledge_points, questions, compression=compression)
+
+    archive = ResultArchive(path)
+    loaded_kps, loaded_questions = archive.load()
+    assert loaded_kps.to_dicts() == [asdict(kp) for kp in knowledge_points]
+    assert loaded_questions.to_dicts() == [asdict(q) for q in questions]
+    assert loaded_kps.to_records() == knowledge_points
+    assert archive.digest == ResultArchive(path).digest
+
+
+def test_unknown_compression_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ResultArchive.write(str(tmp_path / ResultArchive.FILENAME), *make_results(), compression="lzma")
+
+
+def test_exports_are_cached_per_content_version(tmp_path):
+    knowledge_points, questions = make_results()
+    path = str(tmp_path / ResultArchive.FILENAME)
+    archive = ResultArchive.write(path, knowledge_points, questions)
+
+    json_export = archive.export("json", "notes")
+    with zipfile.ZipFile(json_export) as zipf:
+        assert json.loads(zipf.read("notes_questions.json")) == [asdict(q) for q in questions]
+    html_export = archive.export("html", "notes")
+    mtime = os.path.getmtime(html_export)
+    assert archive.export("html", "notes") == html_export
+    assert os.path.getmtime(html_export) == mtime
+
+    # 内容变化后摘要改变，旧版本的导出文件被清理
+    questions[0].explanation = "修改后的解析。"
+    updated = ResultArchive.write(path, knowledge_points, questions)
+    assert updated.digest != archive.digest
+    assert not os.path.exists(html_export)
+    assert updated.export_path("html", "notes") != html_export
+
+
+def test_interrupted_stream_export_leaves_no_cached_file(tmp_path):
+    archive = ResultArchive.write(str(tmp_path / ResultArchive.FILENAME), *make_results())
+    stream = archive.stream_export("markdown")
+    next(stream)
+    stream.close()
+    export_dir = os.path.dirname(archive.export_path("markdown"))
+    assert os.listdir(export_dir) == []
+
+    content = b"".join(archive.stream_export("markdown"))
+    with open(archive.export_path("markdown"), "rb") as f:
+        assert f.read() == content
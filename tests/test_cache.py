@@ -0,0 +1,12 @@
+from core.generator import ResponseCache
+
+
+def test_overwriting_an_entry_does_not_inflate_total_bytes(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    cache.set("key", "a" * 100)
+    cache.set("key", "b" * 40)
+    cache.set("other", "c" * 10)
+    assert cache.stats()["bytes"] == 50
+    assert cache.get("key") == "b" * 40
+    cache.close()
+
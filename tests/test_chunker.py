@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+from core.generator import TextChunker
+
+QUALITY_LEVELS = ["简约", "中等", "较细致", "细致", "精细"]
+
+
+def make_text(seed, paragraphs=120):
+    rng = random.Random(seed)
+    sentence_ends = "。！？；\n"
+    parts = []
+    for _ in range(paragraphs):
+        sentences = [
+            "".join(rng.choice("知识点内容分析函数推导证明例题") for _ in range(rng.randint(5, 120)))
+            + rng.choice(sentence_ends)
+            for _ in range(rng.randint(1, 12))
+        ]
+        parts.append("".join(sentences))
+    return "\n\n".join(parts)
+
+
+def split_randomly(text, rng, pieces):
+    cuts = sorted(rng.sample(range(1, len(text)), pieces))
+    return [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+
+@pytest.mark.parametrize("quality_level", QUALITY_LEVELS)
+@pytest.mark.parametrize("seed", range(3))
+def test_chunk_stream_matches_chunk_text(quality_level, seed):
+    chunker = TextChunker(quality_level)
+    text = make_text(seed)
+    expected = chunker.chunk_text(text)
+    assert len(expected) > 1
+
+    rng = random.Random(seed)
+    # 任意切分（包括把"\n\n"切开、出现空片段）都不影响分块结果
+    segments = split_randomly(text, rng, 200)
+    segments.insert(rng.randrange(len(segments)), "")
+    assert list(chunker.chunk_stream(segments)) == expected
+    assert list(chunker.chunk_stream(iter(text))) == expected
+
+
+@pytest.mark.parametrize("quality_level", ["简约", "中等"])
+def test_paragraph_chunks_are_slices_of_joined_text(quality_level):
+    chunker = TextChunker(quality_level)
+    text = make_text(7)
+    for chunk, metadata in chunker.chunk_stream(split_randomly(text, random.Random(7), 50)):
+        assert chunk == text[metadata["start_char"]:metadata["end_char"]]
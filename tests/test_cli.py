@@ -0,0 +1,25 @@
+import os
+
+from core.generator import _document_output_names
+
+
+def test_unique_file_names_keep_their_stem():
+    assert _document_output_names(["a/讲义.pdf", "b/notes.md"]) == {"a/讲义.pdf": "讲义", "b/notes.md": "notes"}
+
+
+def test_same_file_names_get_distinct_directories():
+    paths = [os.path.join("course", "week1", "notes.pdf"), os.path.join("course", "week2", "notes.pdf"),
+             os.path.join("course", "week1", "notes.md"), os.path.join("course", "summary.txt")]
+    names = _document_output_names(paths)
+    assert len(set(names.values())) == len(paths)
+    assert names[paths[0]] == "week1_notes.pdf"
+    assert names[paths[1]] == "week2_notes.pdf"
+    assert names[paths[2]] == "week1_notes.md"
+    assert names[paths[3]] == "summary"
+
+
+def test_sanitized_collisions_get_a_counter():
+    paths = [os.path.join("x", "a_b", "c.pdf"), os.path.join("x", "a", "b_c.pdf"), os.path.join("y", "c.pdf"),
+             os.path.join("y", "b_c.pdf")]
+    names = _document_output_names(paths)
+    assert len(set(names.values())) == len(paths)
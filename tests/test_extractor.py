@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import pytest
+
+from core.generator import FingerprintStore, KnowledgeExtractor, UsageStats, content_fingerprint
+
+RESPONSE = json.dumps({"knowledge_points": [
+    {"id": 1, "title": "牛顿第二定律", "summary": "力等于质量乘以加速度。"},
+    {"id": 2, "title": "惯性", "summary": "物体保持原有运动状态的性质。"},
+]}, ensure_ascii=False)
+
+
+class StreamingClient:
+    """分段产出固定的响应，finish_reason 由测试指定"""
+
+    cache = None
+
+    def __init__(self, response, finish_reason):
+        self.usage = UsageStats()
+        self.response = response
+        self.finish_reason = finish_reason
+
+    async def stream_api(self, prompt, max_tokens=2000, system=None, finish=None):
+        for start in range(0, len(self.response), 7):
+            yield self.response[start:start + 7]
+        if finish is not None and self.finish_reason:
+            finish["reason"] = self.finish_reason
+
+
+def extract(tmp_path, response, finish_reason):
+    extractor = KnowledgeExtractor(StreamingClient(response, finish_reason), streaming=True)
+    store = FingerprintStore(str(tmp_path / "fingerprints.sqlite3"))
+    extractor.fingerprints = store
+    chunk = "牛顿第二定律与惯性。"
+    knowledge_points = asyncio.run(extractor.extract_from_chunk(chunk, {"chunk_index": 0}))
+    stored = store.get("chunk", content_fingerprint(extractor.system_prompt, chunk))
+    store.close()
+    return knowledge_points, stored
+
+
+def test_complete_extraction_is_stored(tmp_path):
+    knowledge_points, stored = extract(tmp_path, RESPONSE, "stop")
+    assert [kp.title for kp in knowledge_points] == ["牛顿第二定律", "惯性"]
+    assert [item["title"] for item in stored] == ["牛顿第二定律", "惯性"]
+
+
+@pytest.mark.parametrize("response, finish_reason", [
+    # 达到 max_tokens 被截断：第一个知识点已经产出，但输出不完整
+    (RESPONSE[:RESPONSE.index("惯性") + 4], "length"),
+    # 没有结束标记（连接提前结束）
+    (RESPONSE, None),
+    # 第二个对象无法解析
+    (RESPONSE.replace('"id": 2,', '"id": 2,,'), "stop"),
+])
+def test_incomplete_extraction_is_not_stored(tmp_path, response, finish_reason):
+    knowledge_points, stored = extract(tmp_path, response, finish_reason)
+    assert [kp.title for kp in knowledge_points][:1] == ["牛顿第二定律"]
+    assert stored is None
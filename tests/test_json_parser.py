@@ -0,0 +1,52 @@
+import json
+import random
+
+import pytest
+
+from core.generator import IncrementalJSONParser
+
+ITEMS = [
+    {"id": 1, "title": "集合{并}与[交]", "summary": "含有 \"引号\" 和反斜杠 \\ 的摘要", "key_terms": ["a", "b"]},
+    {"id": 2, "title": "嵌套", "summary": "对象中的对象", "extra": {"nested": [{"x": 1}, {"y": "}"}]}},
+    {"id": 3, "title": "转义\\\"结尾\\", "summary": "é中😀", "key_formulas": ["f(x) = {x}"]},
+]
+RESPONSE = json.dumps({"knowledge_points": ITEMS}, ensure_ascii=False, indent=2)
+
+
+def feed_in_pieces(text, cuts):
+    parser = IncrementalJSONParser(item_depth=2)
+    items = []
+    start = 0
+    for cut in sorted(cuts) + [len(text)]:
+        items.extend(parser.feed(text[start:cut]))
+        start = cut
+    return parser, items
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_split_feed_matches_full_parse(seed):
+    rng = random.Random(seed)
+    cuts = rng.sample(range(1, len(RESPONSE)), rng.randint(1, 40))
+    parser, items = feed_in_pieces(RESPONSE, cuts)
+    assert items == json.loads(RESPONSE)["knowledge_points"]
+    assert parser.errors == 0
+
+
+def test_character_by_character_feed():
+    parser, items = feed_in_pieces(RESPONSE, list(range(1, len(RESPONSE))))
+    assert items == ITEMS
+
+
+def test_items_are_returned_as_soon_as_they_close():
+    parser = IncrementalJSONParser(item_depth=2)
+    first_end = RESPONSE.index('"key_terms"')
+    first_end = RESPONSE.index("}", first_end) + 1
+    assert parser.feed(RESPONSE[:first_end]) == [ITEMS[0]]
+    assert parser.feed(RESPONSE[first_end:]) == ITEMS[1:]
+
+
+def test_malformed_item_is_counted_and_skipped():
+    text = '{"knowledge_points": [{"id": 1, "title": }, {"id": 2}]}'
+    parser, items = feed_in_pieces(text, [10, 30])
+    assert items == [{"id": 2}]
+    assert parser.errors == 1
@@ -0,0 +1,174 @@
+import asyncio
+import copy
+import json
+import random
+import re
+
+from core.generator import (FingerprintStore, InlineMerger, KnowledgePoint, KnowledgePointMerger,
+                            NoteToQuizGenerator, UsageStats)
+
+
+class FakeClient:
+    """按提示词类型返回固定格式响应的LLM客户端，记录出题请求的提示词"""
+
+    cache = None
+
+    TITLES = ["牛顿第二定律", "光合作用过程", "供给与需求", "勾股定理证明"]
+
+    def __init__(self, extraction_system: str = ""):
+        self.usage = UsageStats()
+        self.extraction_system = extraction_system
+        self.extractions = 0
+        self.question_prompts = []
+
+    async def call_api(self, prompt, max_tokens=2000, system=None):
+        if system == self.extraction_system:
+            # 每个文本块返回同一组标题，内容随文本块变化：后面的文本块都是前面知识点的重复项
+            self.extractions += 1
+            version = self.extractions
+            return json.dumps({"knowledge_points": [
+                {"id": i + 1, "title": title, "summary": f"第{version}版的{title}摘要内容。",
+                 "key_terms": [f"{title}术语{version}"], "key_formulas": [f"f{i}_{version}"]}
+                for i, title in enumerate(self.TITLES)
+            ]}, ensure_ascii=False)
+        self.question_prompts.append(prompt)
+        question = {"question": "题干", "options": {"A": "甲", "B": "乙", "C": "丙", "D": "丁"},
+                    "correct_answer": "A", "explanation": "解析"}
+        if "kp_index" in (system or ""):
+            count = len(re.findall(r"^\[\d+\]", prompt, re.M))
+            return json.dumps({"questions": [dict(question, kp_index=i + 1) for i in range(count)]},
+                              ensure_ascii=False)
+        return json.dumps(question, ensure_ascii=False)
+
+    async def stream_api(self, prompt, max_tokens=2000, system=None, finish=None):
+        yield await self.call_api(prompt, max_tokens, system)
+        if finish is not None:
+            finish["reason"] = "stop"
+
+    async def aclose(self):
+        pass
+
+
+def process(document, store):
+    async def run():
+        generator = NoteToQuizGenerator("key", "中等", llm_client=FakeClient())
+        generator.llm_client.extraction_system = generator.extractor.system_prompt
+        generator.cpu_workers = 1
+        generator.extractor.fingerprints = store
+        generator.generator.fingerprints = store
+        knowledge_points, questions = await generator.process_document(str(document))
+        return generator, knowledge_points, questions
+
+    return asyncio.run(run())
+
+
+def test_final_knowledge_points_merge_duplicates_and_keep_questions(tmp_path):
+    document = tmp_path / "notes.txt"
+    document.write_text("\n\n".join(f"第{i}段" + "段落内容。" * 100 for i in range(40)), encoding="utf-8")
+    store = FingerprintStore(str(tmp_path / "fingerprints.sqlite3"))
+
+    generator, knowledge_points, questions = process(document, store)
+    client = generator.llm_client
+    versions = range(1, client.extractions + 1)
+    assert client.extractions > 1
+    assert len(knowledge_points) == len(client.TITLES)
+
+    # 最终知识点包含所有重复项的术语和公式，编号不变
+    for i, kp in enumerate(knowledge_points):
+        assert kp.id == i + 1
+        assert sorted(kp.key_terms) == sorted(f"{kp.title}术语{version}" for version in versions)
+        assert sorted(kp.key_formulas) == sorted(f"f{client.TITLES.index(kp.title)}_{version}"
+                                                 for version in versions)
+        assert len(generator.merger.duplicates(kp.id)) == client.extractions - 1
+
+    # 题目按最先到达的版本生成，对应的知识点编号都存在
+    prompts = "\n".join(client.question_prompts)
+    kp_by_id = {kp.id: kp for kp in knowledge_points}
+    assert questions
+    for question in questions:
+        kp = kp_by_id[question.knowledge_point_id]
+        assert f"第1版的{kp.title}摘要内容" in prompts
+
+    # 再次处理同一文档时全部基础题按指纹复用
+    generator, knowledge_points_again, _ = process(document, store)
+    assert not any("kp_index" in prompt for prompt in generator.llm_client.question_prompts)
+    assert [kp.key_terms for kp in knowledge_points_again] == [kp.key_terms for kp in knowledge_points]
+    store.close()
+
+
+def make_topic_points(seed: int = 0):
+    """若干主题、每个主题几个轻微改写的知识点（英文词，主题之间词表不相交）"""
+    rng = random.Random(seed)
+    points = []
+    for topic in range(6):
+        vocabulary = [f"t{topic}w{i}" for i in range(40)]
+        base = rng.sample(vocabulary, 16)
+        for variant in range(3):
+            words = list(base)
+            words[rng.randrange(len(words))] = rng.choice(vocabulary)
+            points.append(KnowledgePoint(
+                id=len(points) + 1,
+                title=f"{rng.getrandbits(128):032x}",
+                summary=" ".join(words),
+                key_terms=[f"term{len(points)}"]
+            ))
+    rng.shuffle(points)
+    return points
+
+
+def partition_by_terms(groups):
+    return sorted(sorted(terms) for terms in groups)
+
+
+def test_incremental_content_merge_matches_batch_tfidf_partition():
+    points = make_topic_points()
+
+    batch = KnowledgePointMerger("简约").merge_knowledge_points(
+        copy.deepcopy(points))
+    batch_groups = [kp.key_terms for kp in batch]
+
+    merger = KnowledgePointMerger("简约")
+    for kp in points:
+        merger.add(copy.deepcopy(kp))
+    incremental_groups = [kp.key_terms for kp in merger.finalize()]
+
+    assert len(batch) == 6
+    assert partition_by_terms(batch_groups) == partition_by_terms(incremental_groups)
+
+
+def test_finalize_merges_duplicates_without_touching_dispatched_points():
+    first = KnowledgePoint(id=1, title="牛顿第二定律", summary="力等于质量乘以加速度。", key_formulas=["F=ma"],
+                           key_terms=["力"])
+    later = KnowledgePoint(id=2, title="牛顿第二定律", summary="加速度与合外力成正比。", key_formulas=["a=F/m"],
+                           key_terms=["加速度"])
+
+    merger = KnowledgePointMerger("中等")
+    accepted = merger.add(copy.deepcopy(first))
+    assert merger.add(copy.deepcopy(later)) is None
+    [final] = merger.finalize()
+
+    # 已交给出题的知识点保持原样，最终结果与批量合并一样并入了重复项的内容
+    assert accepted.summary == first.summary and accepted.key_formulas == ["F=ma"]
+    batch = KnowledgePointMerger("中等").merge_knowledge_points([copy.deepcopy(first), copy.deepcopy(later)])
+    assert len(batch) == 1
+    assert final.id == accepted.id
+    assert set(final.key_formulas) == set(batch[0].key_formulas) == {"F=ma", "a=F/m"}
+    assert set(final.key_terms) == set(batch[0].key_terms) == {"力", "加速度"}
+    assert final.summary == batch[0].summary
+
+
+def test_merger_runs_in_process_by_default():
+    generator = NoteToQuizGenerator("key", "中等", llm_client=FakeClient())
+    generator.cpu_workers = 4
+    merger = generator.open_merger()
+    assert isinstance(merger, InlineMerger)
+    merger.close()
+
+
+def test_title_is_cleaned_before_indexing():
+    merger = KnowledgePointMerger("中等")
+    first = merger.add(KnowledgePoint(id=1, title="\n    牛顿第二定律    \n", summary="力等于质量乘以加速度。"))
+    assert first.title == "牛顿第二定律"
+    assert merger.add(KnowledgePoint(id=2, title="牛顿第二定律", summary="加速度与合外力成正比。")) is None
+    assert merger.add(KnowledgePoint(id=3, title="  牛顿第二定律\t", summary="合外力决定物体的加速度。")) is None
+    assert len(merger.duplicates(first.id)) == 2
@@ -0,0 +1,46 @@
+import asyncio
+import json
+import re
+
+from core.generator import KnowledgePoint, QuestionGenerator, UsageStats
+
+
+class BatchClient:
+    """单题请求返回一道题，批量请求按知识点数返回题目"""
+
+    cache = None
+
+    def __init__(self):
+        self.usage = UsageStats()
+
+    async def call_api(self, prompt, max_tokens=2000, system=None):
+        question = {"question": "题干", "options": {"A": "甲", "B": "乙", "C": "丙", "D": "丁"},
+                    "correct_answer": "A", "explanation": "解析"}
+        if "kp_index" not in (system or ""):
+            return json.dumps(question, ensure_ascii=False)
+        count = len(re.findall(r"^\[\d+\]", prompt, re.M))
+        return json.dumps({"questions": [dict(question, kp_index=i + 1) for i in range(count)]},
+                          ensure_ascii=False)
+
+
+def test_partial_batch_is_sent_before_input_ends():
+    generator = QuestionGenerator(BatchClient(), "中等")
+    generator.batch_delay = 0.05
+    more_input = asyncio.Event()
+
+    async def knowledge_points():
+        yield KnowledgePoint(id=1, title="牛顿第二定律", summary="力等于质量乘以加速度。")
+        # 后面的知识点迟迟不到：第一批不满 batch_size，也应按 batch_delay 发出
+        await more_input.wait()
+
+    async def run():
+        questions = generator.iter_generate(knowledge_points())
+        first = await asyncio.wait_for(questions.__anext__(), timeout=5)
+        assert not more_input.is_set()
+        more_input.set()
+        rest = [question async for question in questions]
+        return first, rest
+
+    first, rest = asyncio.run(run())
+    assert first.knowledge_point_id == 1
+    assert rest == []
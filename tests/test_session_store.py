@@ -0,0 +1,44 @@
+import threading
+import time
+
+from core.session_store import SessionWriter, SQLiteSessionStore
+
+
+class BlockedStore(SQLiteSessionStore):
+    """写入在 release 之前一直等待（模拟其他进程持有数据库锁）"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.release = threading.Event()
+
+    def update(self, session_id, fields):
+        self.release.wait()
+        return super().update(session_id, fields)
+
+    def append_items(self, session_id, field, items):
+        self.release.wait()
+        return super().append_items(session_id, field, items)
+
+
+def test_session_writer_does_not_block_caller_and_keeps_order(tmp_path):
+    store = BlockedStore(str(tmp_path / "sessions.sqlite3"))
+    store.create("s", {"status": "processing"})
+    writer = SessionWriter(store, "s")
+
+    started = time.monotonic()
+    for i in range(5):
+        writer.append_items("questions", [{"id": i}])
+        writer.update({"progress": i})
+    assert time.monotonic() - started < 0.5
+    assert store.count_items("s", "questions") == 0
+
+    store.release.set()
+    writer.close()
+    assert [item["id"] for item in store.get_items("s", "questions")] == list(range(5))
+    assert store.get_field("s", "progress") == 4
+
+    # close() 之后的写入被忽略
+    writer.update({"progress": 99})
+    writer.close()
+    assert store.get_field("s", "progress") == 4
+    store.close()
@@ -0,0 +1,87 @@
+import random
+from difflib import SequenceMatcher
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from core.generator import NearDuplicateIndex, UnionFind, similar_pairs
+
+ALPHABET = "函数极限导数积分微分方程矩阵向量概率统计分布期望方差定理证明性质定义"
+
+
+def make_titles(seed, count=150):
+    """随机标题，其中约一半是已有标题的少量改写"""
+    rng = random.Random(seed)
+    titles = []
+    for _ in range(count):
+        if titles and rng.random() < 0.5:
+            chars = list(rng.choice(titles))
+            for _ in range(rng.randint(0, 3)):
+                position = rng.randrange(len(chars))
+                if rng.random() < 0.5:
+                    chars[position] = rng.choice(ALPHABET)
+                else:
+                    chars.insert(position, rng.choice(ALPHABET))
+            titles.append("".join(chars))
+        else:
+            titles.append("".join(rng.choice(ALPHABET) for _ in range(rng.randint(4, 20))))
+    return titles
+
+
+def dedup_by_pairwise_loop(titles, threshold):
+    """原来的逐一比较：与最早的、相似度超过阈值的已保留标题合并"""
+    kept, assignment = [], []
+    for title in titles:
+        match = next((i for i, existing in enumerate(kept)
+                      if SequenceMatcher(None, title, existing).ratio() > threshold), None)
+        if match is None:
+            kept.append(title)
+            match = len(kept) - 1
+        assignment.append(match)
+    return assignment
+
+
+def dedup_by_index(titles, threshold):
+    index = NearDuplicateIndex(threshold)
+    assignment = []
+    for title, band_keys in zip(titles, index.prepare(titles)):
+        match = index.find(title, band_keys)
+        if match is None:
+            match = index.add(title, band_keys)
+        assignment.append(match)
+    return assignment
+
+
+@pytest.mark.parametrize("threshold", [0.7, 0.8, 0.9])
+@pytest.mark.parametrize("seed", range(3))
+def test_near_duplicate_index_matches_pairwise_loop(seed, threshold):
+    titles = make_titles(seed)
+    assert dedup_by_index(titles, threshold) == dedup_by_pairwise_loop(titles, threshold)
+
+
+def make_documents(seed, count=200):
+    """从少量主题词表中抽词组成的文档，同一主题的文档相似度较高"""
+    rng = random.Random(seed)
+    topics = [[f"t{topic}w{i}" for i in range(30)] for topic in range(20)]
+    return [" ".join(rng.choices(rng.choice(topics), k=rng.randint(5, 30))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 64, 1024])
+@pytest.mark.parametrize("threshold", [0.3, 0.5, 0.7])
+def test_similar_pairs_matches_dense_cosine_similarity(threshold, block_size):
+    matrix = TfidfVectorizer().fit_transform(make_documents(block_size))
+    dense = cosine_similarity(matrix)
+    expected = {(i, j) for i, j in zip(*np.nonzero(dense > threshold)) if i < j}
+
+    rows, cols = similar_pairs(matrix, threshold, block_size=block_size)
+    assert set(zip(rows.tolist(), cols.tolist())) == expected
+    assert len(rows) == len(expected)
+
+
+def test_union_find_groups_connected_pairs():
+    clusters = UnionFind(6)
+    for a, b in [(0, 3), (3, 5), (1, 2)]:
+        clusters.union(a, b)
+    assert sorted(sorted(group) for group in clusters.groups()) == [[0, 3, 5], [1, 2], [4]]